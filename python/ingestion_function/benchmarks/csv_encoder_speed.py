@@ -0,0 +1,142 @@
+"""
+This script benchmarks the CSV encoding of a wide table by
+`CsvBatchEncoder` against `csv.writer`.
+
+The table is three totesys sales_order tables side by side (36 columns,
+six of them timestamps), generated in Python so no database is needed.
+Both encoders are timed in turns, each going first every other turn, so
+that they see the same load on the machine, and the median of the
+speedups of the turns is reported. The outputs are checked to be the
+same bytes first.
+
+Usage:
+From the root of the repository run:
+   python -m python.ingestion_function.benchmarks.csv_encoder_speed \\
+       --rows 20000 --turns 8 --min-speedup 3
+The script exits with status 1 if the median speedup is below
+--min-speedup.
+
+Example output:
+rows     csv_writer_s   batch_s   speedup
+20000    0.591          0.162     3.65
+"""
+import argparse
+from collections import namedtuple
+import csv
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+import io
+import statistics
+import sys
+import timeit
+
+from python.ingestion_function.src.csv_encoder import CsvBatchEncoder
+from python.ingestion_function.src.parquet_output import (
+    NUMERIC_OID, TIMESTAMP_OID)
+
+INTEGER_OID = 23
+VARCHAR_OID = 1043
+
+
+# The fields of psycopg2's cursor.description
+Column = namedtuple('Column', ['name', 'type_code', 'display_size',
+                               'internal_size', 'precision', 'scale',
+                               'null_ok'])
+
+
+def column(name, type_code, precision=None, scale=None):
+    """
+    Describe a column the way psycopg2 does.
+    """
+    return Column(name, type_code, None, None, precision, scale, None)
+
+
+def wide_table(rows):
+    """
+    Build the description and rows of three sales_order tables side by
+    side.
+    """
+    description = []
+    for number in range(3):
+        description += [
+            column(f'sales_order_id_{number}', INTEGER_OID),
+            column(f'created_at_{number}', TIMESTAMP_OID),
+            column(f'last_updated_{number}', TIMESTAMP_OID),
+            column(f'design_id_{number}', INTEGER_OID),
+            column(f'staff_id_{number}', INTEGER_OID),
+            column(f'counterparty_id_{number}', INTEGER_OID),
+            column(f'units_sold_{number}', INTEGER_OID),
+            column(f'unit_price_{number}', NUMERIC_OID, 10, 2),
+            column(f'currency_id_{number}', INTEGER_OID),
+            column(f'agreed_delivery_date_{number}', VARCHAR_OID),
+            column(f'agreed_payment_date_{number}', VARCHAR_OID),
+            column(f'agreed_delivery_location_id_{number}', INTEGER_OID)]
+    start = datetime(2022, 11, 3, 14, 20, 49, 962000)
+    table = []
+    for i in range(rows):
+        created = start + timedelta(seconds=i, microseconds=i * 1000)
+        table.append((i, created, created, i % 50, i % 20, i % 30,
+                      i * 7 % 100000, Decimal(i % 500).scaleb(-2), 1 + i % 3,
+                      str(date(2023, 1, 1 + i % 28)),
+                      str(date(2023, 2, 1 + i % 28)), i % 30) * 3)
+    return description, table
+
+
+def csv_writer_bytes(rows):
+    """
+    Encode rows with csv.writer, as the ingestion did before.
+    """
+    output = io.StringIO()
+    csv.writer(output).writerows(rows)
+    return output.getvalue().encode('utf-8')
+
+
+def measure(rows, turns):
+    """
+    Time both encoders in turns on a wide table.
+
+    Args:
+        rows (int): The rows of the table.
+        turns (int): The number of times each encoder is timed.
+
+    Returns:
+        tuple: The median seconds of csv.writer and of the batch
+        encoder, and the median speedup.
+    """
+    description, table = wide_table(rows)
+    encoder = CsvBatchEncoder(description)
+    if encoder.encode(table) != csv_writer_bytes(table):
+        sys.exit('The batch encoder does not write the csv.writer bytes')
+
+    encoders = {'csv.writer': lambda: csv_writer_bytes(table),
+                'batch': lambda: encoder.encode(table)}
+    seconds = {name: [] for name in encoders}
+    speedups = []
+    for turn in range(turns):
+        times = {name: timeit.timeit(encoders[name], number=1)
+                 for name in sorted(encoders, reverse=turn % 2 == 1)}
+        for name, elapsed in times.items():
+            seconds[name].append(elapsed)
+        speedups.append(times['csv.writer'] / times['batch'])
+    return (statistics.median(seconds['csv.writer']),
+            statistics.median(seconds['batch']),
+            statistics.median(speedups))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--turns', type=int, default=8)
+    parser.add_argument('--min-speedup', type=float, default=3)
+    args = parser.parse_args()
+
+    writer_seconds, batch_seconds, speedup = measure(args.rows, args.turns)
+    print(f"{'rows':<9}{'csv_writer_s':<15}{'batch_s':<10}speedup")
+    print(f'{args.rows:<9}{writer_seconds:<15.3f}{batch_seconds:<10.3f}'
+          f'{speedup:.2f}')
+    if speedup < args.min_speedup:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,508 @@
+"""
+This script benchmarks the ingestion lambda end to end, table by table,
+against a synthetic totesys database.
+
+For every scale factor and update-churn rate, the script creates the
+totesys schema in a throwaway database, fills every table with rows
+generated by PostgreSQL itself (`generate_series`), and updates the
+given fraction of the rows of every table. It then runs
+`postgres_data_capture` once per table, in a fresh Python process with
+S3 and Secrets Manager mocked by moto, and with the change window
+starting just before the updates. Each run writes the full snapshot of
+the table and the file of its changes (the updated rows), and the
+script reports, for each file, the rows and bytes written per second
+and the peak memory (RSS) of the process. Every table runs in its own
+process because the peak resident set size reported by the operating
+system can only grow during the life of a process.
+
+The database is created in a throwaway PostgreSQL cluster (`initdb`
+and `pg_ctl` in a temporary directory, listening on a Unix socket only,
+removed at the end), or with --dsn in a throwaway database of an
+existing server.
+
+Usage:
+1. Ensure the PostgreSQL server binaries (initdb, pg_ctl) are on the
+PATH or given with --pg-bin, or give a server with --dsn. PostgreSQL
+refuses to run as root, so run the script as another user to use a
+throwaway cluster.
+2. From the root of the repository run:
+   python -m python.ingestion_function.benchmarks.ingestion_throughput \\
+       --scale 1,10 --churn 0.01,0.1 \\
+       --event '{"engine": "stream", "format": "parquet"}'
+   The event holds the options of the lambda for every run.
+
+Example output (peak_mb includes the baseline of the process, about
+180 MB with pandas and moto; extract_mb is the extraction's own):
+scale 10 (335850 rows), churn 0.01
+table          file     rows     seconds rows_per_s mb_per_s peak_mb extract_mb
+sales_order    changes  1000     0.05    18868      2.12     299.6   121.3
+sales_order    snapshot 100000   1.13    88810      9.47     299.6   121.3
+transaction    changes  1100     0.04    24444      1.87     256.3   78.4
+transaction    snapshot 110000   0.75    145889     10.17    256.3   78.4
+"""
+import argparse
+from contextlib import contextmanager
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import psycopg2
+from psycopg2.extensions import parse_dsn
+
+BENCHMARK_DATABASE = 'totesys_benchmark'
+BUCKET = 'ingested-data-vox-indicium'
+
+TOTESYS_SCHEMA = '''
+CREATE TABLE _prisma_migrations (
+    id varchar(36) PRIMARY KEY, checksum varchar(64) NOT NULL,
+    finished_at timestamptz, migration_name varchar(255) NOT NULL,
+    logs text, rolled_back_at timestamptz,
+    started_at timestamptz NOT NULL DEFAULT now(),
+    applied_steps_count int NOT NULL DEFAULT 0);
+CREATE TABLE currency (
+    currency_id int PRIMARY KEY, currency_code varchar(3) NOT NULL,
+    created_at timestamp NOT NULL DEFAULT now(),
+    last_updated timestamp NOT NULL DEFAULT now());
+CREATE TABLE payment_type (
+    payment_type_id int PRIMARY KEY, payment_type_name varchar NOT NULL,
+    created_at timestamp NOT NULL DEFAULT now(),
+    last_updated timestamp NOT NULL DEFAULT now());
+CREATE TABLE department (
+    department_id int PRIMARY KEY, department_name varchar NOT NULL,
+    location varchar, manager varchar,
+    created_at timestamp NOT NULL DEFAULT now(),
+    last_updated timestamp NOT NULL DEFAULT now());
+CREATE TABLE staff (
+    staff_id int PRIMARY KEY, first_name varchar NOT NULL,
+    last_name varchar NOT NULL, department_id int NOT NULL,
+    email_address varchar NOT NULL,
+    created_at timestamp NOT NULL DEFAULT now(),
+    last_updated timestamp NOT NULL DEFAULT now());
+CREATE TABLE address (
+    address_id int PRIMARY KEY, address_line_1 varchar NOT NULL,
+    address_line_2 varchar, district varchar, city varchar NOT NULL,
+    postal_code varchar NOT NULL, country varchar NOT NULL,
+    phone varchar NOT NULL,
+    created_at timestamp NOT NULL DEFAULT now(),
+    last_updated timestamp NOT NULL DEFAULT now());
+CREATE TABLE counterparty (
+    counterparty_id int PRIMARY KEY,
+    counterparty_legal_name varchar NOT NULL, legal_address_id int NOT NULL,
+    commercial_contact varchar, delivery_contact varchar,
+    created_at timestamp NOT NULL DEFAULT now(),
+    last_updated timestamp NOT NULL DEFAULT now());
+CREATE TABLE design (
+    design_id int PRIMARY KEY,
+    created_at timestamp NOT NULL DEFAULT now(),
+    design_name varchar NOT NULL, file_location varchar NOT NULL,
+    file_name varchar NOT NULL,
+    last_updated timestamp NOT NULL DEFAULT now());
+CREATE TABLE sales_order (
+    sales_order_id int PRIMARY KEY,
+    created_at timestamp NOT NULL DEFAULT now(),
+    last_updated timestamp NOT NULL DEFAULT now(),
+    design_id int NOT NULL, staff_id int NOT NULL,
+    counterparty_id int NOT NULL, units_sold int NOT NULL,
+    unit_price numeric(10, 2) NOT NULL, currency_id int NOT NULL,
+    agreed_delivery_date varchar NOT NULL,
+    agreed_payment_date varchar NOT NULL,
+    agreed_delivery_location_id int NOT NULL);
+CREATE TABLE purchase_order (
+    purchase_order_id int PRIMARY KEY,
+    created_at timestamp NOT NULL DEFAULT now(),
+    last_updated timestamp NOT NULL DEFAULT now(),
+    staff_id int NOT NULL, counterparty_id int NOT NULL,
+    item_code varchar NOT NULL, item_quantity int NOT NULL,
+    item_unit_price numeric NOT NULL, currency_id int NOT NULL,
+    agreed_delivery_date varchar NOT NULL,
+    agreed_payment_date varchar NOT NULL,
+    agreed_delivery_location_id int NOT NULL);
+CREATE TABLE transaction (
+    transaction_id int PRIMARY KEY, transaction_type varchar NOT NULL,
+    sales_order_id int, purchase_order_id int,
+    created_at timestamp NOT NULL DEFAULT now(),
+    last_updated timestamp NOT NULL DEFAULT now());
+CREATE TABLE payment (
+    payment_id int PRIMARY KEY,
+    created_at timestamp NOT NULL DEFAULT now(),
+    last_updated timestamp NOT NULL DEFAULT now(),
+    transaction_id int NOT NULL, counterparty_id int NOT NULL,
+    payment_amount numeric NOT NULL, currency_id int NOT NULL,
+    payment_type_id int NOT NULL, paid boolean NOT NULL,
+    payment_date varchar NOT NULL, company_ac_number int NOT NULL,
+    counterparty_ac_number int NOT NULL);
+'''
+
+# The rows of every table at scale factor 1, about the size of totesys
+BASE_ROWS = {
+    'currency': 3,
+    'payment_type': 4,
+    'department': 8,
+    'staff': 20,
+    'address': 30,
+    'counterparty': 20,
+    'design': 500,
+    'sales_order': 10000,
+    'purchase_order': 1000,
+    'transaction': 11000,
+    'payment': 11000
+}
+
+# One row a second from the first totesys timestamp, with milliseconds
+CREATED_AT = ("TIMESTAMP '2022-11-03 14:20:49.962' "
+              "+ g * INTERVAL '1 second' + g % 7 * INTERVAL '1 millisecond'")
+
+# The row count of every table is given as {<table>}, to pick the keys
+# of the rows a row refers to
+SYNTHETIC_ROWS = {
+    'currency': '''SELECT g, (ARRAY['GBP', 'USD', 'EUR'])[1 + g % 3],
+        {created_at}, {created_at}''',
+    'payment_type': '''SELECT g, (ARRAY['SALES_RECEIPT', 'SALES_REFUND',
+        'PURCHASE_PAYMENT', 'PURCHASE_REFUND'])[1 + g % 4],
+        {created_at}, {created_at}''',
+    'department': '''SELECT g, 'Department ' || g,
+        (ARRAY['Manchester', 'Leeds', 'Leds'])[1 + g % 3], 'Manager ' || g,
+        {created_at}, {created_at}''',
+    'staff': '''SELECT g, 'First' || g, 'Last' || g,
+        1 + g % {department}, 'staff' || g || '@terrifictotes.com',
+        {created_at}, {created_at}''',
+    'address': '''SELECT g, g || ' Herzog Via', CASE WHEN g % 2 = 0
+        THEN NULL ELSE 'Flat ' || g END, 'Avon', 'New Patienceburgh',
+        lpad((g * 7919 % 100000)::text, 5, '0'), 'Turkey',
+        '1803 ' || lpad(g::text, 6, '0'), {created_at}, {created_at}''',
+    'counterparty': '''SELECT g, 'Counterparty ' || g || ', Ltd',
+        1 + g % {address}, 'Contact ' || g, 'Delivery "' || g || '"',
+        {created_at}, {created_at}''',
+    'design': '''SELECT g, {created_at}, 'Design' || g % 100,
+        '/usr/share/design' || g % 10, 'design-' || md5(g::text) || '.json',
+        {created_at}''',
+    'sales_order': '''SELECT g, {created_at}, {created_at},
+        1 + g % {design}, 1 + g % {staff}, 1 + g % {counterparty},
+        1 + g * 7 % 100000, (g % 400 + 100)::numeric / 100,
+        1 + g % {currency}, '2022-11-' || lpad((1 + g % 28)::text, 2, '0'),
+        '2022-12-' || lpad((1 + g % 28)::text, 2, '0'), 1 + g % {address}''',
+    'purchase_order': '''SELECT g, {created_at}, {created_at},
+        1 + g % {staff}, 1 + g % {counterparty},
+        upper(substr(md5(g::text), 1, 7)), 1 + g % 1000,
+        (g % 90000 + 100)::numeric / 100, 1 + g % {currency},
+        '2022-11-' || lpad((1 + g % 28)::text, 2, '0'),
+        '2022-12-' || lpad((1 + g % 28)::text, 2, '0'), 1 + g % {address}''',
+    'transaction': '''SELECT g, CASE WHEN g % 11 = 0 THEN 'PURCHASE'
+        ELSE 'SALE' END, CASE WHEN g % 11 = 0 THEN NULL
+        ELSE 1 + g % {sales_order} END, CASE WHEN g % 11 = 0
+        THEN 1 + g % {purchase_order} END, {created_at}, {created_at}''',
+    'payment': '''SELECT g, {created_at}, {created_at},
+        1 + g % {transaction}, 1 + g % {counterparty},
+        (g * 7919 % 10000000)::numeric / 100, 1 + g % {currency},
+        1 + g % {payment_type}, g % 3 = 0,
+        '2022-11-' || lpad((1 + g % 28)::text, 2, '0'),
+        10000000 + g % 90000000, 10000000 + g * 7 % 90000000'''
+}
+
+INSERT_QUERY = '''INSERT INTO {table}
+{select}
+FROM generate_series(1, {rows}) AS g;'''
+
+# The rows updated by a churn rate are picked by key, every 1 / churn
+CHURN_QUERY = '''UPDATE {table} SET last_updated = clock_timestamp()
+WHERE {table}_id % {step} = 0;'''
+
+WINDOW_QUERY = "SELECT TO_CHAR(NOW(), 'YYYY-MM-DD HH24:MI:SS.MS');"
+
+
+def peak_rss_mb():
+    """
+    Return the peak resident set size of this process in megabytes.
+    """
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def table_rows(scale):
+    """
+    Return the number of rows of every table at a scale factor.
+    """
+    return {table: max(1, round(rows * scale))
+            for table, rows in BASE_ROWS.items()}
+
+
+def connection_secret(connection_details):
+    """
+    Return the Totesys-Access secret of psycopg2.connect arguments.
+    """
+    return {'host': connection_details.get('host', 'localhost'),
+            'port': str(connection_details.get('port', 5432)),
+            'database': connection_details['dbname'],
+            'username': connection_details.get('user', 'postgres'),
+            'password': connection_details.get('password', '')}
+
+
+def run_admin_query(connection_details, query):
+    """
+    Run a query outside of a transaction, e.g. CREATE DATABASE.
+    """
+    connection = psycopg2.connect(**connection_details)
+    connection.autocommit = True
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(query)
+    finally:
+        connection.close()
+
+
+@contextmanager
+def throwaway_cluster(pg_bin=None):
+    """
+    Run a PostgreSQL cluster in a temporary directory for the block.
+
+    Args:
+        pg_bin (str): The directory of initdb and pg_ctl, or None to
+        find them on the PATH.
+
+    Yields:
+        dict: The arguments of psycopg2.connect for its postgres
+        database.
+    """
+    def binary(name):
+        return os.path.join(pg_bin, name) if pg_bin else name
+
+    directory = tempfile.mkdtemp(prefix='totesys-benchmark-')
+    data = os.path.join(directory, 'data')
+    try:
+        subprocess.run([binary('initdb'), '-D', data, '-U', 'postgres',
+                        '-A', 'trust', '--no-sync'],
+                       check=True, capture_output=True)
+        # Only a Unix socket in the directory, so no port can clash
+        subprocess.run([binary('pg_ctl'), '-D', data, '-w',
+                        '-l', os.path.join(directory, 'postgres.log'),
+                        '-o', f"-k {directory} -c listen_addresses='' "
+                              "-c fsync=off", 'start'],
+                       check=True, capture_output=True)
+        try:
+            yield {'host': directory, 'port': 5432, 'dbname': 'postgres',
+                   'user': 'postgres'}
+        finally:
+            subprocess.run([binary('pg_ctl'), '-D', data, '-m', 'fast',
+                            '-w', 'stop'], capture_output=True)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+@contextmanager
+def existing_server(dsn):
+    """
+    Yield the arguments of psycopg2.connect of a DSN.
+    """
+    yield parse_dsn(dsn)
+
+
+@contextmanager
+def benchmark_database(dsn=None, pg_bin=None):
+    """
+    Create the throwaway database of the benchmark for the block.
+
+    Args:
+        dsn (str): The server to create it in, or None for a throwaway
+        cluster.
+        pg_bin (str): The directory of the PostgreSQL binaries.
+
+    Yields:
+        dict: The arguments of psycopg2.connect for the database.
+    """
+    with (throwaway_cluster(pg_bin) if dsn is None
+          else existing_server(dsn)) as server_details:
+        run_admin_query(server_details,
+                        f'DROP DATABASE IF EXISTS {BENCHMARK_DATABASE};')
+        run_admin_query(server_details,
+                        f'CREATE DATABASE {BENCHMARK_DATABASE};')
+        try:
+            yield {**server_details, 'dbname': BENCHMARK_DATABASE}
+        finally:
+            run_admin_query(
+                server_details,
+                f'DROP DATABASE IF EXISTS {BENCHMARK_DATABASE};')
+
+
+def load_totesys(connection_details, scale):
+    """
+    Create the totesys tables, replacing them, with the synthetic rows
+    of a scale factor.
+
+    Returns:
+        dict: The number of rows of every table.
+    """
+    rows = table_rows(scale)
+    connection = psycopg2.connect(**connection_details)
+    try:
+        with connection, connection.cursor() as cursor:
+            cursor.execute('DROP SCHEMA public CASCADE; CREATE SCHEMA public;')
+            cursor.execute(TOTESYS_SCHEMA)
+            for table, select in SYNTHETIC_ROWS.items():
+                cursor.execute(INSERT_QUERY.format(
+                    table=table, rows=rows[table],
+                    select=select.format(created_at=CREATED_AT, **rows)))
+    finally:
+        connection.close()
+    # The change query shape is chosen from the planner's estimates
+    run_admin_query(connection_details, 'VACUUM ANALYZE;')
+    return rows
+
+
+def churn_tables(connection_details, churn, tables):
+    """
+    Update a fraction of the rows of every table.
+
+    Args:
+        connection_details (dict): The arguments of psycopg2.connect.
+        churn (float): The fraction of the rows to update, 0 to 1.
+        tables (list of str): The tables.
+
+    Returns:
+        str: The time before the updates, as the lambda stores the time
+        of a run (e.g. '2022-11-03 14:20:49.962').
+    """
+    connection = psycopg2.connect(**connection_details)
+    try:
+        with connection, connection.cursor() as cursor:
+            cursor.execute(WINDOW_QUERY)
+            window_start = cursor.fetchone()[0]
+        if churn > 0:
+            with connection, connection.cursor() as cursor:
+                for table in tables:
+                    cursor.execute(CHURN_QUERY.format(
+                        table=table, step=max(1, round(1 / churn))))
+    finally:
+        connection.close()
+    return window_start
+
+
+def table_event(event, table):
+    """
+    Return the event of a run extracting only one table.
+    """
+    registry = dict(event.get('table_registry') or {})
+    registry['tables'] = {
+        **{name: 'excluded' for name in ['_prisma_migrations', *BASE_ROWS]},
+        **registry.get('tables', {}),
+        table: 'hot'}
+    return {**event, 'table_registry': registry}
+
+
+def run_worker(secret, table, window_start, event):
+    """
+    Run the lambda for one table against mocked AWS services, and print
+    the measurements as JSON.
+    """
+    for variable in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY',
+                     'AWS_SECURITY_TOKEN', 'AWS_SESSION_TOKEN'):
+        os.environ[variable] = 'testing'
+    os.environ['AWS_DEFAULT_REGION'] = 'eu-west-2'
+
+    import boto3
+    from moto import mock_s3, mock_secretsmanager
+
+    from python.ingestion_function.src.extraction_metrics import (
+        collect_metrics)
+    from python.ingestion_function.src.postgres_data_capture import (
+        postgres_data_capture)
+
+    with mock_s3(), mock_secretsmanager():
+        s3 = boto3.client('s3')
+        s3.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={
+            'LocationConstraint': 'eu-west-2'})
+        s3.put_object(Bucket=BUCKET, Key='postgres-datetime.txt',
+                      Body=window_start.encode('utf-8'))
+        boto3.client('secretsmanager').create_secret(
+            Name='Totesys-Access', SecretString=json.dumps(secret))
+
+        baseline = peak_rss_mb()
+        with collect_metrics() as collector:
+            postgres_data_capture(table_event(event, table), None)
+        peak = peak_rss_mb()
+
+    print(json.dumps({'files': collector.for_table(table),
+                      'peak_rss_mb': peak,
+                      'extraction_mb': peak - baseline}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DSN'),
+                        help='an existing server, instead of a throwaway '
+                             'cluster')
+    parser.add_argument('--pg-bin', default=os.environ.get('PG_BIN'),
+                        help='the directory of initdb and pg_ctl')
+    parser.add_argument('--scale', default='1')
+    parser.add_argument('--churn', default='0.05')
+    parser.add_argument('--tables', default=','.join(BASE_ROWS))
+    parser.add_argument('--event', default='{}', type=json.loads)
+    parser.add_argument('--worker', nargs=3,
+                        metavar=('SECRET', 'TABLE', 'WINDOW_START'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        secret, table, window_start = args.worker
+        run_worker(json.loads(secret), table, window_start, args.event)
+        return
+
+    tables = args.tables.split(',')
+    unknown = set(tables) - set(BASE_ROWS)
+    if unknown:
+        parser.error(f'unknown tables: {", ".join(sorted(unknown))}')
+
+    with benchmark_database(args.dsn, args.pg_bin) as connection_details:
+        secret = json.dumps(connection_secret(connection_details))
+        for scale in args.scale.split(','):
+            for churn in args.churn.split(','):
+                rows = load_totesys(connection_details, float(scale))
+                window_start = churn_tables(connection_details,
+                                            float(churn), tables)
+                print(f"scale {scale} ({sum(rows.values())} rows), "
+                      f"churn {churn}")
+                print(f"{'table':<15}{'file':<9}{'rows':<9}{'seconds':<8}"
+                      f"{'rows_per_s':<11}{'mb_per_s':<9}{'peak_mb':<8}"
+                      f"{'extract_mb'}")
+                for table in tables:
+                    measured = run_table(secret, table, window_start,
+                                         args.event)
+                    for record in measured['files']:
+                        print_file(record, measured)
+
+
+def run_table(secret, table, window_start, event):
+    """
+    Run the lambda for one table in a worker process.
+
+    Returns:
+        dict: The measurements of the worker.
+    """
+    result = subprocess.run(
+        [sys.executable, '-m', __spec__.name, '--event', json.dumps(event),
+         '--worker', secret, table, window_start],
+        capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.exit(f'The run of {table} failed:\n{result.stderr}')
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def print_file(record, measured):
+    """
+    Print the line of an extracted file, from its metrics record.
+    """
+    seconds = record['Duration']
+    mb_per_s = record['Bytes'] / 2 ** 20 / seconds if seconds > 0 else 0
+    kind = ('changes' if '_changes' in os.path.basename(record['File'])
+            else 'snapshot')
+    print(f"{record['Table']:<15}{kind:<9}{record['Rows']:<9}"
+          f"{seconds:<8.2f}{record['RowsPerSecond']:<11.0f}"
+          f"{mb_per_s:<9.2f}{measured['peak_rss_mb']:<8.1f}"
+          f"{measured['extraction_mb']:.1f}")
+
+
+if __name__ == '__main__':
+    main()
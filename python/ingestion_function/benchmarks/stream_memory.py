@@ -0,0 +1,119 @@
+"""
+This script benchmarks the peak memory (RSS) of the ingestion extraction
+engines against the number of rows extracted.
+
+For every row count and engine the extraction runs in a fresh Python
+process, because the peak resident set size reported by the operating
+system can only grow during the life of a process. The rows are
+generated by PostgreSQL itself with `generate_series`, shaped like the
+totesys sales_order table, so no test data has to be loaded.
+
+Usage:
+1. Start a PostgreSQL server you can connect to (a local one is enough).
+2. From the root of the repository run:
+   python -m python.ingestion_function.benchmarks.stream_memory \\
+       --dsn "host=localhost port=5432 dbname=postgres user=postgres" \\
+       --rows 10000,100000,1000000
+   The DSN can also be given with the BENCH_DSN environment variable.
+
+Example output (the baseline includes pandas, imported by the package):
+rows        engine      seconds   peak_rss_mb   extraction_mb
+10000       fetchall    0.16      126.7         8.5
+10000       stream      0.19      120.8         2.6
+100000      fetchall    1.93      204.8         86.8
+100000      stream      2.07      120.7         2.6
+500000      fetchall    10.10     554.0         435.8
+500000      stream      9.39      120.8         2.6
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import psycopg2
+
+from python.ingestion_function.src.postgres_data_capture import (
+    write_query_to_file)
+from python.ingestion_function.src.stream_table import DEFAULT_FETCH_SIZE
+
+SYNTHETIC_QUERY = '''SELECT g AS sales_order_id,
+    now() AS created_at,
+    now() AS last_updated,
+    g % 500 AS design_id,
+    g % 20 AS staff_id,
+    g % 20 AS counterparty_id,
+    g % 1000 AS units_sold,
+    (g % 400)::numeric / 100 AS unit_price,
+    g % 3 AS currency_id,
+    '2022-11-10' AS agreed_delivery_date,
+    '2022-11-03' AS agreed_payment_date,
+    g % 30 AS agreed_delivery_location_id
+FROM generate_series(1, {rows}) AS g;'''
+
+
+def peak_rss_mb():
+    """
+    Return the peak resident set size of this process in megabytes.
+    """
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_worker(dsn, engine, rows, fetch_size):
+    """
+    Extract the synthetic table once and print the measurements as JSON.
+    """
+    connection = psycopg2.connect(dsn)
+    cursor = connection.cursor()
+    baseline = peak_rss_mb()
+
+    start = time.perf_counter()
+    write_query_to_file(connection, cursor, SYNTHETIC_QUERY.format(rows=rows),
+                        'benchmark_stream_memory', engine, fetch_size)
+    seconds = time.perf_counter() - start
+
+    peak = peak_rss_mb()
+    connection.close()
+    os.remove('/tmp/csv_files/benchmark_stream_memory.csv')
+    print(json.dumps({'seconds': seconds, 'peak_rss_mb': peak,
+                      'extraction_mb': peak - baseline}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DSN'))
+    parser.add_argument('--rows', default='10000,100000,1000000')
+    parser.add_argument('--engines', default='fetchall,stream')
+    parser.add_argument('--fetch-size', type=int, default=DEFAULT_FETCH_SIZE)
+    parser.add_argument('--worker', nargs=2, metavar=('ENGINE', 'ROWS'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error('a DSN is required (--dsn or BENCH_DSN)')
+
+    if args.worker:
+        engine, rows = args.worker
+        run_worker(args.dsn, engine, int(rows), args.fetch_size)
+        return
+
+    print(f"{'rows':<12}{'engine':<12}{'seconds':<10}"
+          f"{'peak_rss_mb':<14}{'extraction_mb'}")
+    for rows in args.rows.split(','):
+        for engine in args.engines.split(','):
+            result = subprocess.run(
+                [sys.executable, '-m', __spec__.name, '--dsn', args.dsn,
+                 '--fetch-size', str(args.fetch_size),
+                 '--worker', engine, rows],
+                check=True, capture_output=True, text=True)
+            measured = json.loads(result.stdout.splitlines()[-1])
+            print(f"{rows:<12}{engine:<12}{measured['seconds']:<10.2f}"
+                  f"{measured['peak_rss_mb']:<14.1f}"
+                  f"{measured['extraction_mb']:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,463 @@
+"""
+This module contains an asyncio pipeline extracting files from the
+database while the files before them are encoded and uploaded.
+
+The primary purpose of this module is to keep the database and the
+network busy at the same time. With the other engines a file is read,
+then encoded, then uploaded, and the next file only starts once the
+upload has finished. The "async" engine splits the work between two
+tasks joined by a bounded queue:
+   - the fetch task runs the query of every file in turn and puts its
+   rows on the queue in batches of "fetch_size" rows;
+   - the upload task takes the batches off the queue, encodes them with
+   a `TableWriter` and streams them into an `S3MultipartWriter`, whose
+   parts upload in the background.
+So the upload of one table overlaps the fetch of the next one. The
+queue holds at most "queue_depth" batches: when the upload falls
+behind, the fetch waits, which bounds the memory used whatever the
+size of the tables.
+
+By default, the rows are read through the psycopg2 server-side cursor
+of the `stream` engine, in a thread, which overlaps the same way. The
+asyncpg driver is opt-in: asyncpg is not in requirements.txt nor in the
+layers of the ingestion lambda, so the deployed function always uses
+psycopg2. Where asyncpg is installed, it is used (or chosen with the
+"async_driver" option) on its own connection, in one repeatable read
+transaction, so every file of the run reads the same snapshot. The
+encoding and the S3 calls run in threads too, so neither blocks the
+fetch.
+
+A file whose encoding or upload fails is aborted, leaving no object
+behind, and the other files carry on; a failed query stops the
+pipeline, as it stops the other engines.
+
+Usage:
+1. Ensure the necessary libraries (boto3, psycopg2, optionally
+asyncpg) are available.
+2. Describe every file with `file_job` and extract them all with
+`capture_files_async`.
+
+Example:
+jobs = [file_job("staff", "staff.csv", "SELECT * FROM staff;"),
+        file_job("currency", "currency.csv", "SELECT * FROM currency;")]
+for result in capture_files_async(jobs, connection):
+    print(result["job"]["key"], result["counter"].rows)
+"""
+import asyncio
+import logging
+import time
+
+from .extraction_metrics import PhaseTimer, TimedWriter, PHASES
+from .parquet_output import DEFAULT_ROW_GROUP_SIZE
+from .s3_stream import (S3MultipartWriter, DEFAULT_PART_SIZE,
+                        DEFAULT_MAX_IN_FLIGHT)
+from .stream_table import iter_query_batches, DEFAULT_FETCH_SIZE
+from .table_writer import TableWriter, object_args
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+logger = logging.getLogger('MyLogger')
+
+DRIVERS = ('asyncpg', 'psycopg2')
+DEFAULT_QUEUE_DEPTH = 4
+DESCRIBE_QUERY = 'SELECT * FROM ({query}) AS result LIMIT 0;'
+
+# Marks the end of the batches of a file on the queue
+END = 'end'
+
+
+def default_driver():
+    """
+    Return the driver used when the "async_driver" option is not set:
+    asyncpg if it is installed, psycopg2 otherwise, as in the deployed
+    lambda, which does not package asyncpg.
+    """
+    return 'asyncpg' if asyncpg is not None else 'psycopg2'
+
+
+def file_job(table_name, key, query, window_start=None, upper_bound=None,
+             file_format='csv', compression=None,
+             row_group_size=DEFAULT_ROW_GROUP_SIZE,
+             part_size=DEFAULT_PART_SIZE,
+             max_in_flight=DEFAULT_MAX_IN_FLIGHT, description=None):
+    """
+    Describe a file for the pipeline to extract.
+
+    Args:
+        table_name (str): The table the file is extracted from.
+        key (str): The key of the object.
+        query (str): The SQL query selecting the rows of the file.
+        window_start (str): The start of the change window of the file.
+        upper_bound (str): The timestamp of the run.
+        file_format (str): The output format, one of FORMATS.
+        compression (str): "gzip" or "zstd" to compress the object.
+        row_group_size (int): The rows of each Parquet row group.
+        part_size (int): The size of the multipart upload parts.
+        max_in_flight (int): The number of parts uploading at a time.
+        description (sequence of psycopg2 Column): The columns of the
+        query, from `describe_query`, needed by the asyncpg driver.
+
+    Returns:
+        dict: The job.
+    """
+    return {
+        'table_name': table_name,
+        'key': key,
+        'query': query,
+        'window_start': window_start,
+        'upper_bound': upper_bound,
+        'file_format': file_format,
+        'compression': compression,
+        'row_group_size': row_group_size,
+        'part_size': part_size,
+        'max_in_flight': max_in_flight,
+        'description': description
+    }
+
+
+def describe_query(cursor, query):
+    """
+    Find the columns of a query without running it.
+
+    The description comes from psycopg2, so the header and the Parquet
+    schema of a file are the same whichever driver reads its rows.
+
+    Args:
+        cursor (psycopg2 cursor): A database cursor.
+        query (str): The SQL query.
+
+    Returns:
+        sequence of psycopg2 Column: cursor.description.
+    """
+    cursor.execute(DESCRIBE_QUERY.format(query=query.strip().rstrip(';')))
+    return cursor.description
+
+
+def merge_timers(*timers):
+    """
+    Add up the phases timed by several PhaseTimers into a new one.
+    """
+    merged = PhaseTimer()
+    for timer in timers:
+        for phase in PHASES:
+            merged.seconds[phase] += timer.seconds[phase]
+    return merged
+
+
+def psycopg2_source(connection, fetch_size=DEFAULT_FETCH_SIZE):
+    """
+    Build the batch source of the psycopg2 driver, which reads a
+    server-side cursor in a thread.
+
+    Args:
+        connection (psycopg2 connection): An open database connection,
+        not used by anything else while the pipeline runs.
+        fetch_size (int): The number of rows fetched at a time.
+
+    Returns:
+        function: Called with a job, returns an async iterator of its
+        batches, the first one starting with the description.
+    """
+    async def batches_of(job):
+        batches = iter_query_batches(connection, job['query'],
+                                     f"{job['table_name']}_async",
+                                     fetch_size, describe=True)
+        try:
+            while True:
+                batch = await asyncio.to_thread(next, batches, None)
+                if batch is None:
+                    return
+                yield batch
+        finally:
+            await asyncio.to_thread(batches.close)
+
+    return batches_of
+
+
+def asyncpg_source(connection, fetch_size=DEFAULT_FETCH_SIZE):
+    """
+    Build the batch source of the asyncpg driver.
+
+    Args:
+        connection (asyncpg Connection): A connection in a transaction.
+        fetch_size (int): The number of rows fetched at a time.
+
+    Returns:
+        function: Called with a job, returns an async iterator of its
+        batches, the first one starting with the job's description.
+    """
+    async def batches_of(job):
+        cursor = await connection.cursor(
+            job['query'].strip().rstrip(';'))
+        batch = await cursor.fetch(fetch_size)
+        yield [job['description']] + batch
+        while len(batch) == fetch_size:
+            batch = await cursor.fetch(fetch_size)
+            yield batch
+
+    return batches_of
+
+
+async def fetch_files(jobs, batches_of, queue, can_start=None):
+    """
+    Put the batches of every file on the queue, in the order of the
+    jobs, each file followed by END.
+
+    Args:
+        jobs (list of dict): The files, from `file_job`.
+        batches_of (function): The batch source of the driver.
+        queue (asyncio.Queue): The queue of (job, timer, start, batch)
+        items, the timer holding the fetch phases of the file and start
+        the time its query started.
+        can_start (function): Called with a table name before its first
+        file; False leaves the table's files out.
+
+    Returns:
+        set of str: The tables left out.
+    """
+    skipped = set()
+    started = set()
+    for job in jobs:
+        table_name = job['table_name']
+        if table_name not in started and can_start is not None \
+                and not can_start(table_name):
+            logger.warning(f'Not enough time left for {table_name}; '
+                           'it is left for the next run')
+            skipped.add(table_name)
+        started.add(table_name)
+        if table_name in skipped:
+            continue
+
+        timer = PhaseTimer()
+        start = time.perf_counter()
+        batches = batches_of(job).__aiter__()
+        phase = 'query'
+        while True:
+            with timer.phase(phase):
+                batch = await anext(batches, None)
+            if batch is None:
+                break
+            # Waits while the queue is full, so the fetch never gets
+            # more than queue_depth batches ahead of the upload
+            await queue.put((job, timer, start, batch))
+            phase = 'fetch'
+        await queue.put((job, timer, start, END))
+    return skipped
+
+
+class FileUpload:
+    """
+    Encode the batches of one file and upload them to S3.
+
+    Its methods block, and are run in a thread by `upload_files`.
+
+    Args:
+        job (dict): The file, from `file_job`.
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.timer = PhaseTimer()
+        self.stream = None
+        self.writer = None
+        self.error = None
+
+    def start(self, description):
+        with self.timer.phase('upload'):
+            self.stream = S3MultipartWriter(
+                self.job['key'], part_size=self.job['part_size'],
+                max_in_flight=self.job['max_in_flight'],
+                extra_args=object_args(self.job['file_format'],
+                                       self.job['compression']))
+        self.writer = TableWriter(TimedWriter(self.stream, self.timer),
+                                  self.job['file_format'],
+                                  self.job['compression'],
+                                  self.job['row_group_size'])
+        with self.timer.phase('serialize'):
+            self.writer.writeheader(description)
+
+    def write(self, rows):
+        with self.timer.phase('serialize'):
+            self.writer.writerows(rows)
+
+    def finish(self):
+        with self.timer.phase('serialize'):
+            self.writer.close()
+        with self.timer.phase('upload'):
+            self.stream.close()
+        print(f"The file {self.job['key']} was uploaded")
+
+    def abort(self, error):
+        self.error = error
+        if self.stream is not None:
+            self.stream.abort()
+
+    def result(self, fetch_timer, start):
+        """
+        Return the result of the file, once its last batch is taken.
+        """
+        if self.error is not None:
+            logger.error(f"Error writing {self.job['key']}: {self.error}")
+        return {
+            'job': self.job,
+            'counter': self.writer.counter if self.error is None
+            else None,
+            'timer': merge_timers(fetch_timer, self.timer),
+            'duration': time.perf_counter() - start,
+            'error': self.error
+        }
+
+
+async def upload_files(queue, results):
+    """
+    Take the batches of the files off the queue, encode and upload
+    them, until None is taken.
+
+    Args:
+        queue (asyncio.Queue): The queue filled by `fetch_files`.
+        results (list): A list the result of every file is appended to:
+        a dict of its job, counter (None if it failed), timer, duration
+        and error.
+
+    Returns:
+        None
+    """
+    upload = None
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            job, fetch_timer, start, batch = item
+            if upload is None:
+                upload = FileUpload(job)
+
+            if batch is END:
+                if upload.error is None:
+                    try:
+                        await asyncio.to_thread(upload.finish)
+                    except Exception as e:
+                        await asyncio.to_thread(upload.abort, e)
+                results.append(upload.result(fetch_timer, start))
+                upload = None
+            elif upload.error is None:
+                # The rest of a failed file is dropped
+                try:
+                    if upload.writer is None:
+                        await asyncio.to_thread(upload.start, batch[0])
+                        batch = batch[1:]
+                    await asyncio.to_thread(upload.write, batch)
+                except Exception as e:
+                    await asyncio.to_thread(upload.abort, e)
+    finally:
+        # A file cut off by a failed query leaves no object behind
+        if upload is not None and upload.error is None:
+            upload.abort(RuntimeError('The pipeline stopped'))
+
+
+async def extract_files(jobs, batches_of, queue_depth=DEFAULT_QUEUE_DEPTH,
+                        can_start=None):
+    """
+    Run the fetch and upload tasks of the pipeline over the jobs.
+
+    Args:
+        jobs (list of dict): The files, from `file_job`.
+        batches_of (function): The batch source of the driver.
+        queue_depth (int): The largest number of batches waiting to be
+        uploaded.
+        can_start (function): Called with a table name before its first
+        file; False leaves the table out.
+
+    Returns:
+        list of dict: The result of every file extracted, in order.
+
+    Raises:
+        ValueError: If queue_depth is not a positive integer.
+        Exception: The error of a failed query.
+    """
+    if not isinstance(queue_depth, int) or queue_depth < 1:
+        raise ValueError("queue_depth must be a positive integer")
+
+    queue = asyncio.Queue(maxsize=queue_depth)
+    results = []
+    uploader = asyncio.create_task(upload_files(queue, results))
+    fetcher = asyncio.create_task(fetch_files(jobs, batches_of, queue,
+                                              can_start))
+    # The upload task only ends before the fetch task if it failed
+    done, _ = await asyncio.wait({fetcher, uploader},
+                                 return_when=asyncio.FIRST_COMPLETED)
+    error = (fetcher if fetcher in done else uploader).exception()
+    if error is not None:
+        # The other task would wait forever on the queue
+        for task in (fetcher, uploader):
+            task.cancel()
+        await asyncio.gather(fetcher, uploader, return_exceptions=True)
+        raise error
+
+    await queue.put(None)
+    await uploader
+    return results
+
+
+async def extract_files_asyncpg(connection_details, jobs, fetch_size,
+                                queue_depth, can_start):
+    connection = await asyncpg.connect(**connection_details)
+    try:
+        # One snapshot for every file of the run
+        async with connection.transaction(isolation='repeatable_read',
+                                          readonly=True):
+            return await extract_files(
+                jobs, asyncpg_source(connection, fetch_size), queue_depth,
+                can_start)
+    finally:
+        await connection.close()
+
+
+def capture_files_async(jobs, connection=None, connection_details=None,
+                        driver='psycopg2', fetch_size=DEFAULT_FETCH_SIZE,
+                        queue_depth=DEFAULT_QUEUE_DEPTH, can_start=None):
+    """
+    Extract files with the asyncio pipeline.
+
+    Args:
+        jobs (list of dict): The files, from `file_job`.
+        connection (psycopg2 connection): The connection read by the
+        psycopg2 driver.
+        connection_details (dict): The arguments of psycopg2.connect,
+        used to open the connection of the asyncpg driver.
+        driver (str): One of DRIVERS.
+        fetch_size (int): The number of rows fetched at a time.
+        queue_depth (int): The largest number of batches waiting to be
+        uploaded.
+        can_start (function): Called with a table name before its first
+        file; False leaves the table out.
+
+    Returns:
+        list of dict: The result of every file extracted, in order: its
+        job, counter (None if it failed), timer, duration and error.
+
+    Raises:
+        ValueError: If the driver is unknown or not installed, or a job
+        has no description with the asyncpg driver.
+        psycopg2.Error or asyncpg.PostgresError: If a query fails.
+    """
+    if driver not in DRIVERS:
+        raise ValueError(f"Unknown async driver: {driver}")
+    if not isinstance(fetch_size, int) or fetch_size < 1:
+        raise ValueError("fetch_size must be a positive integer")
+
+    if driver == 'asyncpg':
+        if asyncpg is None:
+            raise ValueError("The asyncpg driver needs asyncpg")
+        if any(job['description'] is None for job in jobs):
+            raise ValueError("The asyncpg driver needs the description "
+                             "of every query")
+        return asyncio.run(extract_files_asyncpg(
+            connection_details, jobs, fetch_size, queue_depth, can_start))
+
+    return asyncio.run(extract_files(
+        jobs, psycopg2_source(connection, fetch_size), queue_depth,
+        can_start))
@@ -0,0 +1,40 @@
+"""
+This module contains a function for reading ingestion options from the
+AWS Lambda event.
+
+The ingestion lambda is triggered by EventBridge, which can pass a
+constant JSON input as the event. Options in that event can either be a
+single value used for every table, or a dictionary keyed by table name
+with an optional 'default' entry.
+
+Example:
+event = {"engine": {"default": "fetchall", "sales_order": "stream"},
+         "fetch_size": 5000}
+
+get_capture_option(event, "engine", "sales_order")   # 'stream'
+get_capture_option(event, "engine", "currency")      # 'fetchall'
+get_capture_option(event, "fetch_size", "currency")  # 5000
+"""
+
+
+def get_capture_option(event, option, table_name=None, default=None):
+    """
+    Get the value of an ingestion option for a table.
+
+    Args:
+        event: Event data passed to the lambda. Anything other than
+        a dictionary is treated as an empty event.
+        option (str): The name of the option.
+        table_name (str): The table the option applies to.
+        default: The value returned when the option is not set.
+
+    Returns:
+        The value of the option for the table, or the default.
+    """
+    if not isinstance(event, dict) or option not in event:
+        return default
+
+    value = event[option]
+    if isinstance(value, dict):
+        return value.get(table_name, value.get('default', default))
+    return value
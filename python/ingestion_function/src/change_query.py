@@ -0,0 +1,413 @@
+"""
+This module contains functions for choosing, per table, the shape of
+the query that selects the rows changed in a run's window, from the
+cost PostgreSQL's planner gives each shape.
+
+The primary purpose of this module is to stop the default change filter
+`WHERE created_at BETWEEN ... OR last_updated BETWEEN ...` from turning
+into a sequential scan of a big table. The shapes are:
+   - "or": the default filter above;
+   - "union": the rows whose primary key is in the `UNION` of two range
+   scans, one on created_at and one on last_updated, so each can use
+   its own index. It needs a single-column primary key;
+   - "last_updated": a single `last_updated BETWEEN ...` range. It is
+   only the same as the others if every row's last_updated is set when
+   it is inserted, so it is never chosen unless listed in the
+   "change_query_shapes" option.
+With the "change_query" option set to "auto" (the default), every shape
+of "change_query_shapes" ("or" and "union" by default) is run through
+`EXPLAIN` with the window of the run, and the cheapest one is used.
+The choice is cached in 'query_plans.json' in the ingestion bucket, e.g.
+{"sales_order": {"shape": "union", "costs": {"or": 3571.0,
+                 "union": 24.6}, "shapes": ["or", "union"],
+                 "planned_at": "2022-11-03T14:20:49+00:00",
+                 "schema_fingerprint": "9f0c..."}}
+and planned again when it is older than "query_plan_ttl" seconds (a day
+by default), when the table's columns change, or when the candidate
+shapes change. Setting "change_query" to a shape uses it without
+planning.
+
+Every change file also gets an "op" column, from `op_column`: 'insert'
+for a row created in the window, 'update' otherwise, so the warehouse
+can copy the inserts and only merge the updates.
+
+`index_report` lists, for every table, the change columns that no index
+starts with, the shape chosen, and the planner's estimated cost and rows
+of one run's change query, and whether it scans the whole table.
+
+Usage:
+1. Ensure the necessary libraries (boto3, psycopg2) are available.
+2. Use `choose_change_filters` for the change filter of every table.
+3. Use `index_report` to find the tables missing supporting indexes.
+
+Example:
+filters = choose_change_filters(cursor, table_names, window_starts,
+                                run_timestamp, event, fingerprints, now)
+report = index_report(cursor, table_names, last_run, run_timestamp)
+"""
+from datetime import datetime, timedelta
+import json
+import logging
+
+import boto3
+import psycopg2
+from botocore.exceptions import ClientError
+
+from .capture_options import get_capture_option
+from .keyset_capture import get_primary_key
+
+logger = logging.getLogger('MyLogger')
+
+PLAN_BUCKET = 'ingested-data-vox-indicium'
+PLAN_KEY = 'query_plans.json'
+
+SHAPES = ('or', 'union', 'last_updated')
+DEFAULT_SHAPES = ('or', 'union')
+DEFAULT_PLAN_TTL = 24 * 60 * 60
+CHANGE_COLUMNS = ('created_at', 'last_updated')
+
+EXPLAIN_QUERY = 'EXPLAIN (FORMAT JSON) SELECT * FROM {table} {row_filter};'
+
+# The first column of every index of a table
+INDEXED_COLUMNS_QUERY = '''SELECT DISTINCT a.attname
+FROM pg_index i
+JOIN pg_attribute a
+ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+WHERE i.indrelid = %s::regclass;'''
+
+ESTIMATE_QUERY = 'SELECT reltuples FROM pg_class WHERE oid = %s::regclass;'
+
+
+def window_filter(lower_bound, upper_bound):
+    """
+    Build the WHERE clause selecting the rows created or updated in a
+    change window.
+
+    Args:
+        lower_bound (str): The start of the window.
+        upper_bound (str): The end of the window, the timestamp of the
+        run.
+
+    Returns:
+        str: The clause.
+    """
+    return f'''WHERE created_at
+        BETWEEN timestamp '{lower_bound}'
+        AND timestamp '{upper_bound}'
+        OR last_updated
+        BETWEEN timestamp '{lower_bound}'
+        AND timestamp '{upper_bound}'
+        '''
+
+
+def op_column(lower_bound, upper_bound):
+    """
+    Build the select list entry of the "op" column of a change file:
+    'insert' for a row created in the window, 'update' otherwise.
+
+    The window is open at its start, as its first instant was part of
+    the previous window: a row is never tagged as inserted twice, and a
+    doubtful row is an update, which the warehouse merges either way.
+
+    Args:
+        lower_bound (str): The start of the window.
+        upper_bound (str): The end of the window.
+
+    Returns:
+        str: The SQL expression, aliased to "op".
+    """
+    return (f"CASE WHEN created_at > timestamp '{lower_bound}' "
+            f"AND created_at <= timestamp '{upper_bound}' "
+            "THEN 'insert' ELSE 'update' END AS op")
+
+
+def change_filter(shape, table_name, lower_bound, upper_bound,
+                  primary_key=None):
+    """
+    Build the WHERE clause of a change window in a given shape.
+
+    Args:
+        shape (str): One of SHAPES.
+        table_name (str): The name of the table.
+        lower_bound (str): The start of the window.
+        upper_bound (str): The end of the window.
+        primary_key (str): The primary key column, for "union".
+
+    Returns:
+        str: The clause.
+
+    Raises:
+        ValueError: If the shape is unknown, or "union" has no primary
+        key.
+    """
+    if shape == 'or':
+        return window_filter(lower_bound, upper_bound)
+    window = (f"BETWEEN timestamp '{lower_bound}' "
+              f"AND timestamp '{upper_bound}'")
+    if shape == 'last_updated':
+        return f'WHERE last_updated {window}'
+    if shape == 'union':
+        if primary_key is None:
+            raise ValueError(f"The union shape of {table_name} needs "
+                             "its primary key")
+        return (f'WHERE {primary_key} IN ('
+                f'SELECT {primary_key} FROM {table_name} '
+                f'WHERE created_at {window} '
+                f'UNION SELECT {primary_key} FROM {table_name} '
+                f'WHERE last_updated {window})')
+    raise ValueError(f"Unknown change query shape: {shape}")
+
+
+def plan_nodes(plan):
+    """
+    Yield a plan node of EXPLAIN's JSON output and all its children.
+    """
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def explain_change_query(cursor, table_name, row_filter):
+    """
+    Ask the planner for the cost of selecting the rows of a filter.
+
+    Args:
+        cursor (psycopg2 cursor): A database cursor.
+        table_name (str): The name of the table.
+        row_filter (str): The WHERE clause.
+
+    Returns:
+        dict: The estimated "cost" and "rows" of the query, and
+        "seq_scan", True if it reads the whole table.
+    """
+    cursor.execute(EXPLAIN_QUERY.format(table=table_name,
+                                        row_filter=row_filter))
+    output = cursor.fetchone()[0]
+    if isinstance(output, str):
+        output = json.loads(output)
+    plan = output[0]['Plan']
+    return {'cost': plan['Total Cost'],
+            'rows': plan['Plan Rows'],
+            'seq_scan': any(node['Node Type'] == 'Seq Scan'
+                            and node.get('Relation Name') == table_name
+                            for node in plan_nodes(plan))}
+
+
+def candidate_filters(cursor, table_name, shapes, lower_bound, upper_bound):
+    """
+    Build the change filter of a table in each candidate shape it can
+    use.
+
+    Returns:
+        dict: The clause by shape.
+    """
+    primary_key = None
+    if 'union' in shapes:
+        try:
+            primary_key = get_primary_key(cursor, table_name)
+        except ValueError:
+            shapes = [shape for shape in shapes if shape != 'union']
+    return {shape: change_filter(shape, table_name, lower_bound,
+                                 upper_bound, primary_key)
+            for shape in shapes}
+
+
+def plan_change_query(cursor, table_name, shapes, lower_bound, upper_bound):
+    """
+    Choose the cheapest shape of a table's change query.
+
+    Args:
+        cursor (psycopg2 cursor): A database cursor.
+        table_name (str): The name of the table.
+        shapes (list of str): The candidate shapes.
+        lower_bound (str): The start of the window planned.
+        upper_bound (str): The end of the window planned.
+
+    Returns:
+        dict: The "shape" chosen, the "costs" of every candidate it can
+        use, and the candidate "shapes".
+
+    Raises:
+        psycopg2.Error: If EXPLAIN fails.
+    """
+    filters = candidate_filters(cursor, table_name, shapes, lower_bound,
+                                upper_bound)
+    costs = {shape: explain_change_query(cursor, table_name,
+                                         row_filter)['cost']
+             for shape, row_filter in filters.items()}
+    # Ties keep the order of the candidates, so "or" is preferred
+    return {'shape': min(costs, key=costs.get), 'costs': costs,
+            'shapes': sorted(shapes)}
+
+
+def get_query_plans():
+    """
+    Retrieve the cached change query plan of every table.
+
+    Returns:
+        dict: The plans by table name, empty if none exist.
+
+    Raises:
+        ClientError: If the plans cannot be read for another reason
+        than them not existing.
+    """
+    s3 = boto3.client('s3')
+    try:
+        file = s3.get_object(Bucket=PLAN_BUCKET, Key=PLAN_KEY)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchKey':
+            return {}
+        raise e
+    return json.loads(file['Body'].read().decode('utf-8'))
+
+
+def put_query_plans(plans):
+    """
+    Store the change query plan of every table.
+    """
+    s3 = boto3.client('s3')
+    s3.put_object(Bucket=PLAN_BUCKET, Key=PLAN_KEY,
+                  Body=json.dumps(plans, indent=2))
+
+
+def plan_is_current(plan, shapes, fingerprint, now, ttl=DEFAULT_PLAN_TTL):
+    """
+    Check whether a cached plan can still be used.
+
+    Args:
+        plan (dict): The cached plan of the table, or None.
+        shapes (list of str): The candidate shapes of this run.
+        fingerprint (str): The table's schema fingerprint.
+        now (datetime): The time of the run, timezone-aware.
+        ttl (float): The seconds a plan is kept.
+
+    Returns:
+        bool: True if the plan is current.
+    """
+    if not plan or plan.get('shapes') != sorted(shapes):
+        return False
+    if plan.get('schema_fingerprint') != fingerprint:
+        return False
+    planned_at = datetime.fromisoformat(plan['planned_at'])
+    return now - planned_at < timedelta(seconds=ttl)
+
+
+def choose_change_filters(cursor, table_names, window_starts, upper_bound,
+                          event, fingerprints, now, store_plans=True):
+    """
+    Build the change filter of every table in the shape of its options,
+    planning the "auto" tables whose cached plan is out of date.
+
+    Args:
+        cursor (psycopg2 cursor): A database cursor.
+        table_names (list of str): The tables of the run.
+        window_starts (dict): The start of each table's change window.
+        upper_bound (str): The timestamp of the run.
+        event: Event data passed to the lambda, holding the options.
+        fingerprints (dict): The schema fingerprint of every table.
+        now (datetime): The time of the run, timezone-aware.
+        store_plans (bool): False to leave the cached plans as they are.
+
+    Returns:
+        dict: The WHERE clause selecting the changed rows of each table.
+    """
+    plans = None
+    planned = False
+    filters = {}
+    for table_name in table_names:
+        lower_bound = window_starts[table_name]
+        shape = get_capture_option(event, 'change_query', table_name,
+                                   'auto')
+        if shape == 'auto':
+            shapes = list(get_capture_option(
+                event, 'change_query_shapes', table_name, DEFAULT_SHAPES))
+            if plans is None:
+                plans = get_query_plans()
+            plan = plans.get(table_name)
+            if not plan_is_current(
+                    plan, shapes, fingerprints.get(table_name), now,
+                    get_capture_option(event, 'query_plan_ttl', table_name,
+                                       DEFAULT_PLAN_TTL)):
+                # Only a failed EXPLAIN is undone, as the transaction may
+                # hold the snapshot exported to the parallel workers
+                cursor.execute('SAVEPOINT plan_change_query;')
+                try:
+                    plan = plan_change_query(cursor, table_name, shapes,
+                                             lower_bound, upper_bound)
+                except psycopg2.Error as e:
+                    logger.error(f'Change query of {table_name} could '
+                                 f'not be planned: {e}')
+                    cursor.execute('ROLLBACK TO SAVEPOINT plan_change_query;')
+                    plan = {'shape': 'or', 'costs': {}}
+                else:
+                    cursor.execute('RELEASE SAVEPOINT plan_change_query;')
+                    plan.update(planned_at=now.isoformat(),
+                                schema_fingerprint=fingerprints.get(
+                                    table_name))
+                    plans[table_name] = plan
+                    planned = True
+                    logger.info(f"Change query of {table_name}: "
+                                f"{plan['shape']} {plan['costs']}")
+            shape = plan['shape']
+
+        try:
+            primary_key = get_primary_key(cursor, table_name) \
+                if shape == 'union' else None
+            filters[table_name] = change_filter(
+                shape, table_name, lower_bound, upper_bound, primary_key)
+        except ValueError as e:
+            logger.error(f'{e}; the default change query is used')
+            filters[table_name] = window_filter(lower_bound, upper_bound)
+
+    if planned and store_plans:
+        put_query_plans(plans)
+    return filters
+
+
+def get_indexed_columns(cursor, table_name):
+    """
+    Return the columns some index of a table starts with.
+    """
+    cursor.execute(INDEXED_COLUMNS_QUERY, (table_name,))
+    return {column for (column,) in cursor.fetchall()}
+
+
+def index_report(cursor, table_names, lower_bound, upper_bound,
+                 shapes=DEFAULT_SHAPES):
+    """
+    Describe how well the indexes of every table support its change
+    query.
+
+    Args:
+        cursor (psycopg2 cursor): A database cursor.
+        table_names (list of str): The tables to describe.
+        lower_bound (str): The start of the window planned, usually the
+        last run.
+        upper_bound (str): The end of the window planned.
+        shapes (list of str): The candidate shapes.
+
+    Returns:
+        list of dict: For every table, the change columns no index
+        starts with ("missing_indexes"), its estimated rows, the
+        cheapest "shape" and the "cost", "rows" and "seq_scan" of its
+        change query for one run, the tables missing indexes first.
+    """
+    report = []
+    for table_name in table_names:
+        missing = [column for column in CHANGE_COLUMNS
+                   if column not in get_indexed_columns(cursor, table_name)]
+        cursor.execute(ESTIMATE_QUERY, (table_name,))
+        table_rows = cursor.fetchone()[0]
+        plan = plan_change_query(cursor, table_name, shapes, lower_bound,
+                                 upper_bound)
+        filters = candidate_filters(cursor, table_name, [plan['shape']],
+                                    lower_bound, upper_bound)
+        estimate = explain_change_query(cursor, table_name,
+                                        filters[plan['shape']])
+        report.append({'table': table_name,
+                       'missing_indexes': missing,
+                       'table_rows': max(table_rows, 0),
+                       'shape': plan['shape'],
+                       **estimate})
+    return sorted(report, key=lambda entry: (not entry['missing_indexes'],
+                                             -entry['cost']))
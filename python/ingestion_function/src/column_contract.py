@@ -0,0 +1,109 @@
+"""
+This module contains functions for extracting only the columns of a
+table that the transformation lambda uses.
+
+The primary purpose of this module is to stop paying for columns that
+are dropped as soon as they are read. Each table can have a column
+contract, the list of columns its downstream readers use, given by the
+"columns" option of the event, e.g.
+{"columns": {"counterparty": ["counterparty_legal_name",
+                              "legal_address_id"],
+             "sales_order": "*"}}
+Tables without one in the event use DEFAULT_CONTRACTS, which lists the
+columns read by the transformation lambda (e.g. the dim_counterparty
+table does not use the contacts of a counterparty, and dim_staff only
+uses the name and location of a department); other tables, or a
+contract of "*", extract every column.
+
+The primary key and the watermark columns (created_at, last_updated)
+are always extracted, so the files can still be merged and the change
+capture still works, and columns keep the order of the table. A
+contract naming a column the table does not have is ignored with an
+error in the log, so the table is extracted whole rather than missing
+a column downstream expects.
+
+Usage:
+1. Ensure the necessary library (psycopg2) is available.
+2. Use `get_column_contract` with the event, and `project_columns` for
+the columns to select.
+
+Example:
+contract = get_column_contract(event, "counterparty")
+columns = project_columns(cursor, "counterparty", contract)
+query = f"SELECT {select_list(columns)} FROM counterparty;"
+"""
+import logging
+
+from .capture_options import get_capture_option
+from .copy_table import COLUMNS_QUERY
+from .keyset_capture import PRIMARY_KEY_QUERY
+
+logger = logging.getLogger('MyLogger')
+
+WATERMARK_COLUMNS = ('created_at', 'last_updated')
+
+DEFAULT_CONTRACTS = {
+    'counterparty': ['counterparty_id', 'counterparty_legal_name',
+                     'legal_address_id'],
+    'department': ['department_id', 'department_name', 'location']
+}
+
+
+def get_column_contract(event, table_name):
+    """
+    Return the column contract of a table.
+
+    Args:
+        event: Event data passed to the lambda, holding the options.
+        table_name (str): The name of the table.
+
+    Returns:
+        list of str: The columns used downstream, or None for all.
+    """
+    contract = get_capture_option(event, 'columns', table_name,
+                                  DEFAULT_CONTRACTS.get(table_name))
+    if contract in (None, '*'):
+        return None
+    return list(contract)
+
+
+def project_columns(cursor, table_name, contract):
+    """
+    Find the columns of a table to extract under a contract.
+
+    Args:
+        cursor (psycopg2 cursor): A database cursor.
+        table_name (str): The name of the table.
+        contract (list of str): The columns used downstream, or None.
+
+    Returns:
+        list of str: The columns, in the order of the table, or None
+        to extract every column.
+    """
+    if contract is None:
+        return None
+
+    cursor.execute(COLUMNS_QUERY, (table_name,))
+    table_columns = [name for name, _ in cursor.fetchall()]
+    unknown = [column for column in contract
+               if column not in table_columns]
+    if unknown:
+        logger.error(f'Column contract of {table_name} names unknown '
+                     f'columns {unknown}; every column is extracted')
+        return None
+
+    cursor.execute(PRIMARY_KEY_QUERY, (table_name,))
+    required = {column for (column,) in cursor.fetchall()}
+    required.update(WATERMARK_COLUMNS)
+    wanted = required.union(contract)
+    columns = [column for column in table_columns if column in wanted]
+    if len(columns) == len(table_columns):
+        return None
+    return columns
+
+
+def select_list(columns):
+    """
+    Build the select list of a projection.
+    """
+    return ', '.join(columns) if columns else '*'
@@ -0,0 +1,120 @@
+"""
+This module contains a writer compressing the CSV output of the
+ingestion lambda with gzip or zstd on its way to a file or S3 upload.
+
+The primary purpose of this module is to cut the bytes uploaded to and
+stored in the ingestion bucket, and downloaded again by the
+transformation lambda. The object keys do not change ('<table>.csv');
+the compression is recorded in the object's Content-Encoding and in a
+'compression' metadata entry, which the transformation readers use to
+decode the objects while streaming them.
+
+   - "gzip" uses zlib from the standard library and writes a single
+   gzip member.
+   - "zstd" uses cramjam, an optional dependency (it is shipped with
+   fastparquet in the transformation and loading deployments). The data
+   is cut into independent frames of FRAME_SIZE bytes, so a reader can
+   decode the object one frame at a time.
+
+Usage:
+1. Ensure the necessary library (cramjam) is available for "zstd".
+2. Put a `CompressingWriter` in front of the file or upload, write the
+CSV to it and call `finish` before closing the file or upload.
+3. Pass `upload_args` to the upload to record the compression.
+
+Example:
+with S3MultipartWriter("staff.csv", extra_args=upload_args("gzip")) as s:
+    compressor = CompressingWriter(s, "gzip")
+    csv.writer(compressor).writerows(rows)
+    compressor.finish()
+"""
+import zlib
+
+try:
+    import cramjam
+except ImportError:
+    cramjam = None
+
+COMPRESSIONS = (None, 'gzip', 'zstd')
+FRAME_SIZE = 4 * 1024 * 1024
+# cramjam defaults to level 11, much slower than zstd's own default
+DEFAULT_ZSTD_LEVEL = 3
+
+
+class CompressingWriter:
+    """
+    A file-like object compressing the bytes written to it into
+    another one. Without compression, the bytes are passed through.
+
+    Args:
+        raw: A file-like object accepting bytes.
+        compression (str): One of COMPRESSIONS.
+        level (int): The compression level, or None for the default.
+
+    Raises:
+        ValueError: If the compression is not one of COMPRESSIONS, or
+        is "zstd" and cramjam is not installed.
+    """
+
+    def __init__(self, raw, compression=None, level=None):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression: {compression}")
+        if compression == 'zstd' and cramjam is None:
+            raise ValueError("zstd compression needs cramjam")
+
+        self.raw = raw
+        self.compression = compression
+        self.level = level
+        self.buffer = bytearray()
+        if compression == 'gzip':
+            # wbits 31 writes the gzip header and trailer
+            self.compressor = zlib.compressobj(
+                zlib.Z_DEFAULT_COMPRESSION if level is None else level,
+                zlib.DEFLATED, 31)
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        if self.compression is None:
+            self.raw.write(data)
+        elif self.compression == 'gzip':
+            self.raw.write(self.compressor.compress(data))
+        else:
+            self.buffer += data
+            if len(self.buffer) >= FRAME_SIZE:
+                self._write_frame()
+        return len(data)
+
+    def _write_frame(self):
+        level = DEFAULT_ZSTD_LEVEL if self.level is None else self.level
+        self.raw.write(bytes(cramjam.zstd.compress(bytes(self.buffer),
+                                                   level=level)))
+        self.buffer = bytearray()
+
+    def finish(self):
+        """
+        Write the end of the compressed data. Nothing can be written
+        afterwards.
+        """
+        if self.compression == 'gzip':
+            self.raw.write(self.compressor.flush())
+        elif self.compression == 'zstd' and self.buffer:
+            self._write_frame()
+
+
+def upload_args(compression):
+    """
+    Build the S3 arguments recording the compression of an object.
+
+    Args:
+        compression (str): One of COMPRESSIONS.
+
+    Returns:
+        dict: The ContentEncoding and Metadata arguments, or None
+        without compression.
+    """
+    if compression is None:
+        return None
+    return {'ContentEncoding': compression,
+            'Metadata': {'compression': compression}}
@@ -0,0 +1,243 @@
+"""
+This module contains functions for extracting a table with PostgreSQL's
+`COPY ... TO STDOUT` and piping the output straight into an S3 upload.
+
+The primary purpose of this module is to skip the slowest part of the
+default extraction: building a Python tuple for every row in psycopg2
+and writing it again with `csv.writer`. Here PostgreSQL writes the CSV
+itself and the bytes go straight into an `S3MultipartWriter`, so no
+Python row objects are created and nothing is written to /tmp.
+
+The output is byte-identical to the files written by
+`write_table_to_csv`:
+   - every column is rendered the way Python's `str()` renders the
+   value psycopg2 returns (e.g. timestamps drop '.000000', booleans are
+   'True'/'False', empty strings are unquoted, floats keep '.0' and
+   print 'nan'/'inf');
+   - records end with '\\r\\n' like `csv.writer`, while newlines inside
+   quoted values are kept as they are.
+Types whose Python rendering cannot be reproduced in SQL (json, arrays,
+bytea, intervals) are rejected with a ValueError. Numerics that Python's
+`Decimal` prints in scientific notation (non-zero values below 1E-6) are
+not reproduced, nor are whole doubles between 1E16 and about 1E18, which
+PostgreSQL prints with every digit rather than the shortest ones; totesys
+holds neither.
+
+Usage:
+1. Ensure the necessary library (psycopg2) is available.
+2. Use the `copy_table_to_s3` function with an open connection.
+   - Pass the connection, the table name, the S3 object key and
+   optionally a WHERE clause.
+
+Example:
+copy_table_to_s3(connection, "sales_order", "sales_order.csv")
+"""
+from .compression import CompressingWriter, upload_args
+from .extraction_metrics import PhaseTimer, TimedWriter
+from .run_manifest import CountingWriter
+from .s3_stream import (S3MultipartWriter, DEFAULT_PART_SIZE,
+                        DEFAULT_MAX_IN_FLIGHT)
+
+COLUMNS_QUERY = '''SELECT column_name, data_type
+FROM information_schema.columns
+WHERE table_schema = 'public' AND table_name = %s
+ORDER BY ordinal_position;'''
+
+UNSUPPORTED_TYPES = ('json', 'jsonb', 'ARRAY', 'bytea', 'interval')
+
+# Python's str() omits the fractional seconds when they are zero
+TIMESTAMP_FORMAT = '''CASE WHEN EXTRACT(MICROSECONDS FROM {col}) % 1000000 = 0
+THEN to_char({col}, 'YYYY-MM-DD HH24:MI:SS{tz}')
+ELSE to_char({col}, 'YYYY-MM-DD HH24:MI:SS.US{tz}') END'''
+
+# Python's str() writes a float in positional notation from 1E-4 up to
+# 1E16, where PostgreSQL switches to an exponent at 1E15 (1E6 for real),
+# and writes whole floats with '.0'
+FLOAT_FORMAT = '''CASE WHEN {col} = 'NaN' THEN 'nan'
+WHEN {col} = 'Infinity' THEN 'inf'
+WHEN {col} = '-Infinity' THEN '-inf'
+WHEN {col} = 0 THEN CASE WHEN {col}::text = '-0' THEN '-0.0' ELSE '0.0' END
+WHEN abs({col}) >= 1e16 OR abs({col}) < 1e-4 THEN {col}::text
+WHEN {col} = trunc({col}) THEN {col}::text::numeric::text || '.0'
+ELSE {col}::text::numeric::text END'''
+
+TIME_FORMAT = '''CASE WHEN EXTRACT(MICROSECONDS FROM {col}) % 1000000 = 0
+THEN to_char({col}, 'HH24:MI:SS')
+ELSE to_char({col}, 'HH24:MI:SS.US') END'''
+
+
+def quote_identifier(name):
+    """
+    Quote a column or table name for use in SQL.
+    """
+    return '"' + name.replace('"', '""') + '"'
+
+
+def python_rendering(column_name, data_type):
+    """
+    Build the SQL expression that renders a column the way `str()`
+    renders the value psycopg2 returns for it.
+
+    Args:
+        column_name (str): The name of the column.
+        data_type (str): The column's type from information_schema.
+
+    Returns:
+        str: The SQL expression, aliased to the column name.
+
+    Raises:
+        ValueError: If the column type cannot be rendered in SQL.
+    """
+    col = quote_identifier(column_name)
+
+    if data_type in UNSUPPORTED_TYPES:
+        raise ValueError(
+            f"Column {column_name} of type {data_type} is not supported "
+            "by the copy engine")
+
+    if data_type == 'timestamp without time zone':
+        expression = TIMESTAMP_FORMAT.format(col=col, tz='')
+    elif data_type == 'timestamp with time zone':
+        expression = TIMESTAMP_FORMAT.format(col=col, tz='TZH:TZM')
+    elif data_type == 'time without time zone':
+        expression = TIME_FORMAT.format(col=col)
+    elif data_type == 'date':
+        expression = f"to_char({col}, 'YYYY-MM-DD')"
+    elif data_type in ('double precision', 'real'):
+        expression = FLOAT_FORMAT.format(col=col)
+    elif data_type == 'boolean':
+        expression = (f"CASE WHEN {col} THEN 'True' "
+                      f"WHEN NOT {col} THEN 'False' END")
+    elif data_type in ('character varying', 'character', 'text'):
+        # csv.writer leaves empty strings unquoted, like NULLs
+        expression = f"NULLIF({col}, '')"
+    else:
+        expression = col
+
+    return f"{expression} AS {col}"
+
+
+def build_copy_query(cursor, table_name, row_filter='', extra_select='',
+                     columns=None):
+    """
+    Build the COPY statement for a table.
+
+    Args:
+        cursor (psycopg2 cursor): A cursor used to look up the columns.
+        table_name (str): The name of the table.
+        row_filter (str): An optional WHERE clause.
+        extra_select (str): An optional column expression added after
+        the columns of the table.
+        columns (list of str): The columns to extract, all by default.
+
+    Returns:
+        str: The `COPY (SELECT ...) TO STDOUT WITH CSV HEADER` statement.
+
+    Raises:
+        ValueError: If the table has no columns or one of its columns
+        cannot be rendered in SQL.
+    """
+    cursor.execute(COLUMNS_QUERY, (table_name,))
+    table_columns = cursor.fetchall()
+    if len(table_columns) == 0:
+        raise ValueError(f"Table {table_name} has no columns")
+
+    select_list = ',\n'.join(
+        python_rendering(name, data_type)
+        for name, data_type in table_columns
+        if columns is None or name in columns)
+    if extra_select:
+        select_list += f',\n{extra_select}'
+
+    return (f"COPY (SELECT {select_list}\n"
+            f"FROM {quote_identifier(table_name)} {row_filter}) "
+            "TO STDOUT WITH CSV HEADER")
+
+
+class CsvLineEndingWriter:
+    """
+    A file-like object that rewrites PostgreSQL's '\\n' record endings
+    as the '\\r\\n' written by `csv.writer`.
+
+    A newline ends a record only when an even number of quote
+    characters has been seen before it; newlines inside quoted values
+    are left alone. The quote parity is carried from one write to the
+    next, so the data can be split anywhere.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.in_quotes = False
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        segments = data.split(b'\n')
+        output = [segments[0]]
+        self.in_quotes ^= segments[0].count(b'"') % 2 == 1
+        for segment in segments[1:]:
+            output.append(b'\n' if self.in_quotes else b'\r\n')
+            output.append(segment)
+            self.in_quotes ^= segment.count(b'"') % 2 == 1
+
+        translated = b''.join(output)
+        self.raw.write(translated)
+        return len(data)
+
+
+def copy_table_to_s3(connection, table_name, file_name, row_filter='',
+                     part_size=DEFAULT_PART_SIZE,
+                     max_in_flight=DEFAULT_MAX_IN_FLIGHT, compression=None,
+                     timer=None, extra_select='', columns=None):
+    """
+    Extract a table with COPY and upload the CSV output to S3.
+
+    Args:
+        connection (psycopg2 connection): An open database connection.
+        table_name (str): The name of the table to extract.
+        file_name (str): The key of the object in the ingestion bucket.
+        row_filter (str): An optional WHERE clause.
+        part_size (int): The size of the multipart upload parts.
+        max_in_flight (int): The number of parts uploading at a time.
+        compression (str): "gzip" or "zstd" to compress the object.
+        timer (PhaseTimer): Times the phases of the extraction. The
+        rows are encoded by the database, so COPY counts as "fetch".
+        extra_select (str): An optional column expression added after
+        the columns of the table.
+        columns (list of str): The columns to extract, all by default.
+
+    Returns:
+        CountingWriter: The rows, bytes and checksum of the file.
+
+    Raises:
+        ValueError: If the table cannot be extracted with COPY.
+        psycopg2.Error: If the COPY statement fails.
+        ClientError: If the upload to S3 fails.
+    """
+    timer = timer or PhaseTimer()
+    cursor = connection.cursor()
+    try:
+        with timer.phase('query'):
+            copy_query = build_copy_query(cursor, table_name, row_filter,
+                                          extra_select, columns)
+
+        # The upload is aborted if the COPY fails, so a truncated
+        # object is never published
+        with timer.phase('upload'), \
+                S3MultipartWriter(file_name, part_size=part_size,
+                                  max_in_flight=max_in_flight,
+                                  extra_args=upload_args(compression)) \
+                as stream:
+            counter = CountingWriter(TimedWriter(stream, timer))
+            compressor = CompressingWriter(counter, compression)
+            with timer.phase('fetch'):
+                cursor.copy_expert(copy_query,
+                                   CsvLineEndingWriter(compressor))
+                compressor.finish()
+        counter.rows = cursor.rowcount
+
+        print(f"The file {file_name} was uploaded")
+        return counter
+    finally:
+        cursor.close()
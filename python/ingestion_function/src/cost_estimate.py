@@ -0,0 +1,269 @@
+"""
+This module contains functions for estimating what an ingestion run
+will extract, and how long it will take, without fetching any rows.
+
+The primary purpose of this module is to tell before a run whether it
+fits in the Lambda's timeout, and how much parallelism it needs if it
+does not. Every table is estimated from the planner's statistics:
+   - the rows of its full snapshot from `pg_class.reltuples` (or from
+   `EXPLAIN` for a table never analysed);
+   - the rows of its change file from `EXPLAIN` of its change query;
+   - the bytes of a row from `pg_stats`: the average width of the text
+   columns, a fixed width for the text of the other types (e.g. 26
+   characters for a timestamp), less the share of nulls, over the
+   columns extracted under the table's column contract;
+   - its seconds from the rows per second it managed last time (the
+   "rows" and "duration" of its checkpoint), or else the
+   "rows_per_second" option (50000 by default), plus a fixed overhead
+   per file.
+The bytes are those of uncompressed CSV, an upper bound for the other
+formats.
+
+The run is then predicted as its tables spread over "workers"
+connections (longest first, each to the least busy worker), and
+`recommend_parallelism` gives the fewest workers that fit the time the
+run has, and the "fan_out" parts of every snapshot too slow for the
+whole run on its own.
+
+Usage:
+1. Ensure the necessary library (psycopg2) is available.
+2. Use `estimate_table` for every table of the run, then
+`recommend_parallelism` with the estimates and the seconds available.
+
+Example:
+estimates = [estimate_table(cursor, table, change_filters[table],
+                            table in snapshot_tables, event, checkpoints)
+             for table in table_names]
+plan = recommend_parallelism(estimates, budget_seconds=50)
+"""
+import math
+
+from .capture_options import get_capture_option
+from .change_query import ESTIMATE_QUERY, explain_change_query
+from .column_contract import get_column_contract, project_columns
+from .fan_out import DEFAULT_MAX_SHARDS
+
+DEFAULT_ROWS_PER_SECOND = 50000
+# Running the queries of a file and starting its upload
+FILE_OVERHEAD = 0.1
+DEFAULT_MAX_WORKERS = 8
+# The timeout of the ingestion lambda, for a run without a deadline
+DEFAULT_TIME_BUDGET = 60
+
+COLUMN_STATS_QUERY = '''SELECT a.attname, a.atttypid::regtype::text,
+    s.avg_width, s.null_frac
+FROM pg_attribute a
+LEFT JOIN pg_stats s
+ON s.schemaname = 'public' AND s.tablename = %s AND s.attname = a.attname
+WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped
+ORDER BY a.attnum;'''
+
+TEXT_TYPES = ('text', 'character varying', 'character', 'json', 'jsonb')
+# The characters str() writes for the values of fixed-width types
+TEXT_WIDTHS = {
+    'smallint': 4,
+    'integer': 6,
+    'bigint': 10,
+    'numeric': 10,
+    'real': 10,
+    'double precision': 18,
+    'boolean': 5,
+    'date': 10,
+    'time without time zone': 15,
+    'timestamp without time zone': 26,
+    'timestamp with time zone': 32,
+    'uuid': 36
+}
+# The width of a text column without statistics
+DEFAULT_TEXT_WIDTH = 32
+# The "op" column of a change file: ',insert' or ',update'
+OP_COLUMN_WIDTH = 7
+
+
+def row_width(cursor, table_name, columns=None):
+    """
+    Estimate the bytes of a row of a table written as CSV.
+
+    Args:
+        cursor (psycopg2 cursor): A database cursor.
+        table_name (str): The name of the table.
+        columns (list of str): The columns extracted, or None for all.
+
+    Returns:
+        float: The bytes, with the commas and the line break.
+    """
+    cursor.execute(COLUMN_STATS_QUERY, (table_name, table_name))
+    widths = []
+    for name, type_name, avg_width, null_frac in cursor.fetchall():
+        if columns is not None and name not in columns:
+            continue
+        if type_name in TEXT_TYPES:
+            width = avg_width or DEFAULT_TEXT_WIDTH
+        else:
+            width = TEXT_WIDTHS.get(type_name,
+                                    avg_width or DEFAULT_TEXT_WIDTH)
+        widths.append(width * (1 - (null_frac or 0)))
+    return sum(widths) + max(len(widths) - 1, 0) + 2
+
+
+def table_rows(cursor, table_name):
+    """
+    Estimate the rows of a table from `pg_class.reltuples`, or from the
+    planner for a table never vacuumed or analysed.
+    """
+    cursor.execute(ESTIMATE_QUERY, (table_name,))
+    rows = cursor.fetchone()[0]
+    if rows is None or rows < 0:
+        rows = explain_change_query(cursor, table_name, '')['rows']
+    return int(rows)
+
+
+def rows_per_second(checkpoints, table_name, default):
+    """
+    Return the rows per second a table was extracted at last time, or
+    the default if its checkpoint does not tell.
+    """
+    checkpoint = checkpoints.get(table_name, {})
+    rows, duration = checkpoint.get('rows'), checkpoint.get('duration')
+    if rows and duration:
+        return rows / duration
+    return default
+
+
+def estimate_table(cursor, table_name, change_filter, snapshot, event,
+                   checkpoints):
+    """
+    Estimate the rows, bytes and seconds of the files of a table.
+
+    Args:
+        cursor (psycopg2 cursor): A database cursor.
+        table_name (str): The name of the table.
+        change_filter (str): The WHERE clause of its change window.
+        snapshot (bool): True if its full snapshot is written too.
+        event: Event data passed to the lambda, holding the options.
+        checkpoints (dict): The checkpoints by table name.
+
+    Returns:
+        dict: The "table", its "table_rows", the "change_rows" of its
+        window with the planner's "cost" and "seq_scan", whether it
+        has a "snapshot", and the "rows", "bytes" and "seconds" of its
+        files.
+    """
+    columns = project_columns(cursor, table_name,
+                              get_column_contract(event, table_name))
+    width = row_width(cursor, table_name, columns)
+    rows = table_rows(cursor, table_name)
+    change = explain_change_query(cursor, table_name, change_filter)
+    change_rows = int(change['rows'])
+
+    files = [(change_rows, width + OP_COLUMN_WIDTH)]
+    if snapshot:
+        files.append((rows, width))
+    rate = rows_per_second(checkpoints, table_name, get_capture_option(
+        event, 'rows_per_second', table_name, DEFAULT_ROWS_PER_SECOND))
+    total_rows = sum(file_rows for file_rows, _ in files)
+    return {'table': table_name,
+            'table_rows': rows,
+            'change_rows': change_rows,
+            'cost': change['cost'],
+            'seq_scan': change['seq_scan'],
+            'snapshot': snapshot,
+            'rows': total_rows,
+            'bytes': round(sum(file_rows * file_width
+                               for file_rows, file_width in files)),
+            'seconds': round(len(files) * FILE_OVERHEAD
+                             + total_rows / rate, 3)}
+
+
+def predict_seconds(seconds, workers):
+    """
+    Predict the seconds of a run whose tables are spread over workers,
+    the longest first, each to the least busy worker.
+
+    Args:
+        seconds (list of float): The seconds of every table.
+        workers (int): The number of workers.
+
+    Returns:
+        float: The seconds of the busiest worker.
+    """
+    busy = [0.0] * workers
+    for table_seconds in sorted(seconds, reverse=True):
+        busy[busy.index(min(busy))] += table_seconds
+    return max(busy)
+
+
+def recommend_parallelism(estimates, budget_seconds,
+                          max_workers=DEFAULT_MAX_WORKERS,
+                          max_shards=DEFAULT_MAX_SHARDS):
+    """
+    Recommend the workers and fan-out parts a run needs to finish in
+    time.
+
+    Args:
+        estimates (list of dict): The estimates of the tables, from
+        `estimate_table`.
+        budget_seconds (float): The seconds the run has.
+        max_workers (int): The largest number of workers recommended.
+        max_shards (int): The largest number of parts of a table.
+
+    Returns:
+        dict: The "workers" recommended, the "fan_out" parts of every
+        table whose snapshot needs them, the "predicted_seconds" of the
+        run with them, and whether it "fits" in the budget.
+    """
+    # A snapshot slower than the whole run is split into parts, each
+    # written by its own worker alongside the run
+    fan_out = {}
+    seconds = []
+    for estimate in estimates:
+        table_seconds = estimate['seconds']
+        if estimate['snapshot'] and table_seconds > budget_seconds > 0:
+            parts = min(max_shards,
+                        math.ceil(table_seconds / budget_seconds))
+            fan_out[estimate['table']] = parts
+            table_seconds /= parts
+        seconds.append(table_seconds)
+
+    workers = 1
+    while workers < max_workers and \
+            predict_seconds(seconds, workers) > budget_seconds:
+        workers += 1
+    predicted = predict_seconds(seconds, workers)
+    return {'workers': workers,
+            'fan_out': fan_out,
+            'predicted_seconds': round(predicted, 3),
+            'fits': predicted <= budget_seconds}
+
+
+def estimate_run(cursor, table_names, change_filters, snapshot_tables,
+                 event, checkpoints, budget_seconds):
+    """
+    Estimate every table of a run and the parallelism it needs.
+
+    Args:
+        cursor (psycopg2 cursor): A database cursor.
+        table_names (list of str): The tables of the run.
+        change_filters (dict): The WHERE clause of each table's window.
+        snapshot_tables (list of str): The tables written whole too.
+        event: Event data passed to the lambda, holding the options.
+        checkpoints (dict): The checkpoints by table name.
+        budget_seconds (float): The seconds the run has.
+
+    Returns:
+        dict: The "tables" estimates, the total "rows", "bytes" and
+        "seconds" run one table at a time, the "budget_seconds", and
+        the recommendation of `recommend_parallelism`.
+    """
+    estimates = [estimate_table(cursor, table_name,
+                                change_filters[table_name],
+                                table_name in snapshot_tables, event,
+                                checkpoints)
+                 for table_name in table_names]
+    return {'tables': estimates,
+            'rows': sum(estimate['rows'] for estimate in estimates),
+            'bytes': sum(estimate['bytes'] for estimate in estimates),
+            'seconds': round(sum(estimate['seconds']
+                                 for estimate in estimates), 3),
+            'budget_seconds': budget_seconds,
+            **recommend_parallelism(estimates, budget_seconds)}
@@ -15,6 +15,8 @@ with provided data.
    - The function will create a CSV file named 'tablename.csv' in the
    '/tmp/csv_files' directory.
 3. The created CSV file will contain the data from the provided table.
+The rows are encoded a batch at a time by a `CsvBatchEncoder`, which
+writes the same bytes as `csv.writer`.
 
 Example:
 Assuming a data table is defined as:
@@ -31,7 +33,8 @@ This will create a CSV file named 'people_info.csv' in
 the '/tmp/csv_files' directory.
 """
 import os
-import csv
+
+from .csv_encoder import CsvBatchEncoder
 
 
 def write_table_to_csv(table, tablename):
@@ -51,6 +54,9 @@ def write_table_to_csv(table, tablename):
 
     file_path = os.path.join(csv_directory, f"{tablename}.csv")
 
-    with open(file_path, mode='w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerows(table)
+    # The first row is usually the column names, so it is encoded on its
+    # own and the types of the columns are found from the other rows
+    encoder = CsvBatchEncoder()
+    with open(file_path, mode='wb') as file:
+        file.write(encoder.encode(table[:1]))
+        file.write(encoder.encode(table[1:]))
@@ -0,0 +1,222 @@
+"""
+This module contains functions for timing the phases of every file the
+ingestion lambda extracts, and emitting the timings, rows and bytes as
+CloudWatch metrics.
+
+The primary purpose of this module is to show which table, and which
+part of its extraction, uses the Lambda's time. A `PhaseTimer` adds up
+the seconds spent in each phase of a file:
+   - "query": running the query, up to its first rows;
+   - "fetch": reading the following rows from the database;
+   - "serialize": encoding the rows as CSV or Parquet (and writing them
+   to /tmp for the "file" upload);
+   - "upload": sending the object to S3, including the time the encoder
+   waits for a multipart upload to free a part.
+Phases can be nested, and each one only counts its own time: an upload
+that blocks while rows are encoded counts as "upload", not "serialize".
+With the "copy" engine the database encodes the rows itself, so its
+"serialize" time is part of "fetch".
+
+Each file is emitted as one CloudWatch Embedded Metric Format (EMF)
+record, a JSON line printed to the Lambda's log, from which CloudWatch
+creates the metrics Rows, Bytes, RowsPerSecond, Duration and the
+seconds of each phase (QuerySeconds, FetchSeconds, ...) in the
+'TotesysIngestion' namespace, by Table. The file, change window and run
+are kept as properties of the log line.
+
+In tests or local runs, `collect_metrics` replaces the log with a
+`MetricsCollector` holding the records.
+
+Usage:
+1. Time each phase of a file with `PhaseTimer.phase`, or wrap the
+upload stream in a `TimedWriter`.
+2. Use `emit_file_metrics` with the run manifest entry of the file.
+
+Example:
+timer = PhaseTimer()
+with timer.phase("query"):
+    cursor.execute(query)
+...
+emit_file_metrics(entry, timer)
+
+with collect_metrics() as collector:
+    postgres_data_capture({}, None)
+collector.records
+"""
+from contextlib import contextmanager
+import json
+import time
+
+NAMESPACE = 'TotesysIngestion'
+PHASES = ('query', 'fetch', 'serialize', 'upload')
+
+# Where the records go: None prints them as EMF log lines
+_sink = {'sink': None}
+
+
+class PhaseTimer:
+    """
+    Add up the seconds spent in each phase of the extraction of a file.
+    """
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        self.running = []
+
+    def start(self, name):
+        self.running.append((name, time.perf_counter(), [0.0]))
+
+    def stop(self):
+        name, start, inner = self.running.pop()
+        elapsed = time.perf_counter() - start
+        # The time of nested phases is only counted by them
+        self.seconds[name] += elapsed - inner[0]
+        if self.running:
+            self.running[-1][2][0] += elapsed
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Time the block as the phase `name`, one of PHASES.
+        """
+        self.start(name)
+        try:
+            yield self
+        finally:
+            self.stop()
+
+
+class TimedWriter:
+    """
+    A file-like object that passes data through to another one, timing
+    every write as a phase.
+
+    Args:
+        raw: A file-like object.
+        timer (PhaseTimer): The timer of the file.
+        phase (str): The phase the writes count as.
+    """
+
+    closed = False
+
+    def __init__(self, raw, timer, phase='upload'):
+        self.raw = raw
+        self.timer = timer
+        self.phase = phase
+
+    def write(self, data):
+        self.timer.start(self.phase)
+        try:
+            return self.raw.write(data)
+        finally:
+            self.timer.stop()
+
+
+class MetricsCollector:
+    """
+    Keep the emitted records in memory instead of logging them.
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def for_table(self, table_name):
+        """
+        Return the records of the files of a table.
+        """
+        return [record for record in self.records
+                if record['Table'] == table_name]
+
+
+def set_metrics_sink(sink):
+    """
+    Send the records to a sink with an `emit` method, or to the log
+    with None.
+
+    Returns:
+        The previous sink.
+    """
+    previous = _sink['sink']
+    _sink['sink'] = sink
+    return previous
+
+
+@contextmanager
+def collect_metrics():
+    """
+    Collect the records emitted in the block in a MetricsCollector.
+    """
+    collector = MetricsCollector()
+    previous = set_metrics_sink(collector)
+    try:
+        yield collector
+    finally:
+        set_metrics_sink(previous)
+
+
+def metrics_record(entry, timer=None, timestamp=None):
+    """
+    Build the EMF record of an extracted file.
+
+    Args:
+        entry (dict): The run manifest entry of the file.
+        timer (PhaseTimer): The phase timings of the file, if known.
+        timestamp (float): The time of the record, in seconds since the
+        epoch; now by default.
+
+    Returns:
+        dict: The record.
+    """
+    duration = entry['duration']
+    metrics = [{'Name': 'Rows', 'Unit': 'Count'},
+               {'Name': 'Bytes', 'Unit': 'Bytes'},
+               {'Name': 'RowsPerSecond', 'Unit': 'Count/Second'},
+               {'Name': 'Duration', 'Unit': 'Seconds'}]
+    record = {
+        'Table': entry['table'],
+        'File': entry['file'],
+        'WindowFrom': entry['window']['from'],
+        'WindowTo': entry['window']['to'],
+        'Rows': entry['rows'],
+        'Bytes': entry['bytes'],
+        'RowsPerSecond': round(entry['rows'] / duration, 1)
+        if duration > 0 else 0,
+        'Duration': duration
+    }
+    if timer is not None:
+        for phase in PHASES:
+            name = f'{phase.capitalize()}Seconds'
+            metrics.append({'Name': name, 'Unit': 'Seconds'})
+            record[name] = round(timer.seconds[phase], 4)
+
+    record['_aws'] = {
+        'Timestamp': int((time.time() if timestamp is None
+                          else timestamp) * 1000),
+        'CloudWatchMetrics': [{'Namespace': NAMESPACE,
+                               'Dimensions': [['Table']],
+                               'Metrics': metrics}]
+    }
+    return record
+
+
+def emit_file_metrics(entry, timer=None):
+    """
+    Emit the metrics of an extracted file.
+
+    Args:
+        entry (dict): The run manifest entry of the file.
+        timer (PhaseTimer): The phase timings of the file, if known.
+
+    Returns:
+        dict: The record.
+    """
+    record = metrics_record(entry, timer)
+    if _sink['sink'] is None:
+        # CloudWatch reads EMF records from lines of the log
+        print(json.dumps(record), flush=True)
+    else:
+        _sink['sink'].emit(record)
+    return record
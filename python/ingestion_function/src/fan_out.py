@@ -0,0 +1,285 @@
+"""
+This module contains functions for extracting a large table in shards,
+each a range of its primary key, written by separate workers.
+
+The primary purpose of this module is to let tables that no longer fit
+in one Lambda run (e.g. sales_order, payment, transaction) be extracted
+by several at once. The ingestion lambda acts as a coordinator:
+   - `plan_key_ranges` splits the table into primary-key ranges, from
+   its min/max key and its `pg_class.reltuples` row estimate, so each
+   range holds about "rows_per_shard" rows (at most "max_shards"
+   ranges). The first and last ranges are open, so rows with keys
+   outside min/max written meanwhile are not missed;
+   - an executor runs one worker per range:
+      - `LambdaExecutor` invokes the ingestion lambda itself with a
+      {"fan_out_shard": {...}} event, concurrently;
+      - `LocalExecutor` runs the workers in threads of this process, for
+      tests and local runs;
+   - each worker writes its range as a numbered part file, e.g.
+   'sales_order.part-0003.csv' ('table=sales_order/.../part-3.csv' in
+   the partitioned layout), and returns its run manifest entry;
+   - once every part is written, the coordinator writes a completion
+   manifest listing the parts, '<table>.parts.json' (or '_parts.json'
+   next to the parts), which the transformation lambda reads instead of
+   a single '<table>.csv'.
+A table is only complete when its completion manifest exists; a failed
+worker fails the whole file.
+
+Usage:
+1. Ensure the necessary libraries (boto3, psycopg2) are available.
+2. Use `plan_key_ranges` and `plan_shards` to describe the shards, run
+them with an executor's `map`, and store the result with
+`put_parts_manifest`.
+
+Example:
+key, ranges = plan_key_ranges(cursor, "sales_order", rows_per_shard=500000)
+shards = plan_shards("sales_order", "sales_order", key, ranges,
+                     run_timestamp, "csv", "root", options)
+entries = LocalExecutor(capture_shard, max_workers=4).map(shards)
+put_parts_manifest("sales_order", "sales_order", run_timestamp, "root",
+                   shards, entries)
+"""
+from .keyset_capture import get_primary_key
+from .partition_layout import object_key
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import math
+
+import boto3
+
+PARTS_BUCKET = 'ingested-data-vox-indicium'
+DEFAULT_ROWS_PER_SHARD = 500000
+DEFAULT_MAX_SHARDS = 8
+
+RANGE_QUERY = 'SELECT min({key}), max({key}) FROM {table};'
+ESTIMATE_QUERY = 'SELECT reltuples FROM pg_class WHERE oid = %s::regclass;'
+
+
+def plan_key_ranges(cursor, table_name, rows_per_shard=DEFAULT_ROWS_PER_SHARD,
+                    max_shards=DEFAULT_MAX_SHARDS):
+    """
+    Split a table into ranges of its integer primary key.
+
+    Args:
+        cursor (psycopg2 cursor): A database cursor.
+        table_name (str): The name of the table.
+        rows_per_shard (int): The rows each range should hold.
+        max_shards (int): The largest number of ranges.
+
+    Returns:
+        tuple: The primary key column, and the list of (lower, upper)
+        key bounds of each range, lower included and upper excluded;
+        None is unbounded.
+
+    Raises:
+        ValueError: If the table has no single-column primary key.
+    """
+    primary_key = get_primary_key(cursor, table_name)
+    cursor.execute(RANGE_QUERY.format(key=primary_key, table=table_name))
+    low, high = cursor.fetchone()
+    if not isinstance(low, int) or not isinstance(high, int):
+        # An empty table, or a key that cannot be split evenly
+        return primary_key, [(None, None)]
+
+    cursor.execute(ESTIMATE_QUERY, (table_name,))
+    rows = cursor.fetchone()[0]
+    if rows is None or rows <= 0:
+        # reltuples is -1 for a table never vacuumed or analysed
+        rows = high - low + 1
+
+    shards = max(1, min(max_shards, math.ceil(rows / rows_per_shard)))
+    step = math.ceil((high - low + 1) / shards)
+    bounds = [low + step * shard for shard in range(1, shards)]
+    return primary_key, list(zip([None] + bounds, bounds + [None]))
+
+
+def range_filter(primary_key, lower, upper, row_filter=''):
+    """
+    Build the WHERE clause selecting the rows of a key range.
+
+    Args:
+        primary_key (str): The name of the primary key column.
+        lower (int): The first key of the range, or None.
+        upper (int): The key after the range, or None.
+        row_filter (str): An optional WHERE clause to combine.
+
+    Returns:
+        str: The clause, empty for an unbounded range with no filter.
+    """
+    conditions = []
+    if lower is not None:
+        conditions.append(f'{primary_key} >= {int(lower)}')
+    if upper is not None:
+        conditions.append(f'{primary_key} < {int(upper)}')
+    row_filter = row_filter.strip()
+    if row_filter:
+        conditions.append(f'({row_filter[len("WHERE"):].strip()})')
+    return f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+
+def part_key(file_stem, extension, run_timestamp, layout, part):
+    """
+    Build the key of a part file.
+
+    Args:
+        file_stem (str): The name of the file, e.g. 'sales_order'.
+        extension (str): The extension of the file.
+        run_timestamp (str): The timestamp of the run.
+        layout (str): The object layout, "root" or "partitioned".
+        part (int): The number of the part.
+
+    Returns:
+        str: The key.
+    """
+    if layout == 'root':
+        return f'{file_stem}.part-{part:04d}.{extension}'
+    return object_key(file_stem, extension, run_timestamp, layout, part)
+
+
+def parts_manifest_key(file_stem, run_timestamp, layout):
+    """
+    Build the key of the completion manifest of a file.
+    """
+    if layout == 'root':
+        return f'{file_stem}.parts.json'
+    directory = object_key(file_stem, 'json', run_timestamp, layout)
+    return f"{directory.rsplit('/', 1)[0]}/_parts.json"
+
+
+def plan_shards(table_name, file_stem, primary_key, ranges, run_timestamp,
+                file_format='csv', layout='root', options=None,
+                row_filter=''):
+    """
+    Describe the work of each worker.
+
+    Args:
+        table_name (str): The name of the table.
+        file_stem (str): The name of the file, e.g. 'sales_order'.
+        primary_key (str): The primary key column of the ranges.
+        ranges (list): The key ranges, from `plan_key_ranges`.
+        run_timestamp (str): The timestamp of the run.
+        file_format (str): The output format.
+        layout (str): The object layout.
+        options (dict): The output options passed to the workers, e.g.
+        engine, compression.
+        row_filter (str): An optional WHERE clause.
+
+    Returns:
+        list of dict: The shards, JSON serialisable so they can be sent
+        to another invocation.
+    """
+    return [{'table_name': table_name,
+             'file_stem': f'{file_stem}.part-{part:04d}',
+             'row_filter': range_filter(primary_key, lower, upper,
+                                        row_filter),
+             'key': part_key(file_stem, file_format, run_timestamp,
+                             layout, part),
+             'run_timestamp': run_timestamp,
+             'range': [lower, upper],
+             'options': dict(options or {}, file_format=file_format)}
+            for part, (lower, upper) in enumerate(ranges)]
+
+
+class LocalExecutor:
+    """
+    Run the workers of a table in threads of this process.
+
+    Args:
+        capture_shard (callable): Called with a shard, returns its run
+        manifest entry.
+        max_workers (int): The number of shards written at a time.
+    """
+
+    def __init__(self, capture_shard, max_workers=DEFAULT_MAX_SHARDS):
+        self.capture_shard = capture_shard
+        self.max_workers = max_workers
+
+    def map(self, shards):
+        """
+        Write every shard.
+
+        Returns:
+            list of dict: The run manifest entries, in shard order.
+
+        Raises:
+            Exception: The first error of a worker.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(self.capture_shard, shards))
+
+
+class LambdaExecutor:
+    """
+    Run each worker of a table as an invocation of a lambda.
+
+    Args:
+        function_name (str): The name of the lambda, usually the
+        ingestion lambda itself (context.function_name).
+        max_workers (int): The number of invocations at a time.
+    """
+
+    def __init__(self, function_name, max_workers=DEFAULT_MAX_SHARDS):
+        self.function_name = function_name
+        self.max_workers = max_workers
+
+    def invoke(self, shard):
+        client = boto3.client('lambda')
+        response = client.invoke(
+            FunctionName=self.function_name,
+            InvocationType='RequestResponse',
+            Payload=json.dumps({'fan_out_shard': shard}))
+        payload = json.loads(response['Payload'].read())
+        if response.get('FunctionError'):
+            raise RuntimeError(
+                f"Worker for {shard['key']} failed: "
+                f"{payload.get('errorMessage', payload)}")
+        return payload
+
+    def map(self, shards):
+        """
+        Write every shard, each in its own invocation.
+
+        Returns:
+            list of dict: The run manifest entries, in shard order.
+
+        Raises:
+            RuntimeError: If a worker invocation failed.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(self.invoke, shards))
+
+
+def put_parts_manifest(table_name, file_stem, run_timestamp, layout,
+                       shards, entries):
+    """
+    Store the completion manifest of a file written in parts.
+
+    Args:
+        table_name (str): The name of the table.
+        file_stem (str): The name of the file.
+        run_timestamp (str): The timestamp of the run.
+        layout (str): The object layout.
+        shards (list of dict): The shards, from `plan_shards`.
+        entries (list of dict): The run manifest entries of the parts,
+        in shard order.
+
+    Returns:
+        str: The key of the manifest.
+    """
+    key = parts_manifest_key(file_stem, run_timestamp, layout)
+    manifest = {
+        'table': table_name,
+        'file': file_stem,
+        'run': run_timestamp,
+        'rows': sum(entry['rows'] for entry in entries),
+        'bytes': sum(entry['bytes'] for entry in entries),
+        'parts': [{'key': entry['file'], 'range': shard['range'],
+                   'rows': entry['rows'], 'bytes': entry['bytes'],
+                   'checksum': entry['checksum']}
+                  for shard, entry in zip(shards, entries)]
+    }
+    s3 = boto3.client('s3')
+    s3.put_object(Bucket=PARTS_BUCKET, Key=key,
+                  Body=json.dumps(manifest, indent=2))
+    return key
@@ -0,0 +1,238 @@
+"""
+This module contains functions for detecting the rows deleted from a
+table between two runs, by comparing the set of its primary keys with
+the set stored by the previous run.
+
+The primary purpose of this module is to propagate deletes without the
+full export of every table on every run. With the "delete_detection"
+option set to "key_diff", each run:
+   - reads only the primary-key column of the table, in key order,
+   streamed with a server-side cursor;
+   - compares it with the key set of the previous run, and writes the
+   keys that are gone as '<table>_deletes.<format>', the same file as
+   the "logical" change capture, holding the primary-key column;
+   - stores the new key set once the deletes are uploaded.
+The first run of a table only stores its key set. A run that finds no
+deletes still writes its '<table>_deletes' file, with no keys, so that
+neither the root object nor the latest pointer of the partitioned
+layout keeps the deletes of an earlier run, which would be applied
+again.
+
+The keys are held as an `array('q')`, 8 bytes a key, and compared by
+walking both sorted key sets together, so a run never builds a Python
+object for each key.
+
+A key set is stored compactly as 'key_sets/<table>.bin' in the ingestion
+bucket: the sorted keys are delta-encoded (the first key, then the
+difference between each key and the one before) as little-endian 64-bit
+integers, and compressed with zlib. Keys are mostly consecutive, so a
+million keys take a few kilobytes. Only tables with a single integer
+primary key can be compared.
+
+Usage:
+1. Ensure the necessary libraries (boto3, psycopg2) are available.
+2. Use `capture_deletes_by_key_diff` for a table on every run.
+
+Example:
+entry = capture_deletes_by_key_diff(connection, cursor, "sales_order",
+                                    last_run, run_timestamp)
+"""
+from array import array
+from itertools import accumulate, chain
+from operator import sub
+import os
+import sys
+import time
+import zlib
+
+import boto3
+from botocore.exceptions import ClientError
+
+from .keyset_capture import get_primary_key
+from .parquet_output import DEFAULT_ROW_GROUP_SIZE
+from .push_data_in_bucket import push_data_in_bucket
+from .run_manifest import file_entry
+from .stream_table import iter_query_batches, DEFAULT_FETCH_SIZE
+from .table_writer import TableWriter, object_args
+
+KEY_SET_BUCKET = 'ingested-data-vox-indicium'
+KEY_SET_PREFIX = 'key_sets/'
+CSV_DIRECTORY = '/tmp/csv_files'
+
+KEYS_QUERY = 'SELECT {key} FROM {table} ORDER BY {key};'
+KEY_COLUMN_QUERY = 'SELECT {key} FROM {table} LIMIT 0;'
+
+
+def encode_key_set(keys):
+    """
+    Encode sorted integer keys as compressed deltas.
+
+    Args:
+        keys (sequence of int): The keys, in ascending order.
+
+    Returns:
+        bytes: The encoded keys.
+    """
+    deltas = array('q', map(sub, keys, chain([0], keys)))
+    if sys.byteorder == 'big':
+        deltas.byteswap()
+    return zlib.compress(deltas.tobytes())
+
+
+def decode_key_set(data):
+    """
+    Decode keys encoded by `encode_key_set`.
+
+    Returns:
+        array of int: The keys, in ascending order.
+    """
+    deltas = array('q')
+    deltas.frombytes(zlib.decompress(data))
+    if sys.byteorder == 'big':
+        deltas.byteswap()
+    return array('q', accumulate(deltas))
+
+
+def key_set_key(table_name):
+    return f'{KEY_SET_PREFIX}{table_name}.bin'
+
+
+def get_stored_key_set(table_name):
+    """
+    Retrieve the key set of a table stored by the previous run.
+
+    Returns:
+        array of int: The keys, or None if none is stored.
+
+    Raises:
+        ClientError: If the key set cannot be read for another reason
+        than it not existing.
+    """
+    s3 = boto3.client('s3')
+    try:
+        file = s3.get_object(Bucket=KEY_SET_BUCKET,
+                             Key=key_set_key(table_name))
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchKey':
+            return None
+        raise e
+    return decode_key_set(file['Body'].read())
+
+
+def put_key_set(table_name, keys):
+    """
+    Store the key set of a table.
+    """
+    s3 = boto3.client('s3')
+    s3.put_object(Bucket=KEY_SET_BUCKET, Key=key_set_key(table_name),
+                  Body=encode_key_set(keys))
+
+
+def fetch_key_set(connection, table_name, primary_key,
+                  fetch_size=DEFAULT_FETCH_SIZE):
+    """
+    Read the primary keys of a table in ascending order.
+
+    Args:
+        connection (psycopg2 connection): An open database connection.
+        table_name (str): The name of the table.
+        primary_key (str): The primary key column.
+        fetch_size (int): The number of keys fetched at a time.
+
+    Returns:
+        array of int: The keys.
+
+    Raises:
+        ValueError: If the primary key is not an integer.
+    """
+    keys = array('q')
+    batches = iter_query_batches(
+        connection, KEYS_QUERY.format(key=primary_key, table=table_name),
+        f'{table_name}_keys', fetch_size)
+    for number, batch in enumerate(batches):
+        rows = batch[1 if number == 0 else 0:]
+        if rows and not isinstance(rows[0][0], int):
+            raise ValueError(f"Table {table_name} needs an integer "
+                             "primary key to detect deletes")
+        keys.extend(key for (key,) in rows)
+    return keys
+
+
+def deleted_keys(previous, current):
+    """
+    Return the keys of a sorted key set missing from a later one.
+
+    Args:
+        previous (sequence of int): The keys of the previous run,
+        sorted.
+        current (sequence of int): The keys of this run, sorted.
+
+    Returns:
+        list of int: The deleted keys, sorted.
+    """
+    deleted = []
+    position = 0
+    for key in previous:
+        while position < len(current) and current[position] < key:
+            position += 1
+        if position == len(current) or current[position] != key:
+            deleted.append(key)
+    return deleted
+
+
+def capture_deletes_by_key_diff(connection, cursor, table_name,
+                                window_start, upper_bound,
+                                compression=None, file_format='csv',
+                                row_group_size=DEFAULT_ROW_GROUP_SIZE,
+                                s3_key=None):
+    """
+    Write the keys deleted from a table since the previous run as
+    '<table_name>_deletes.<file_format>', and store its new key set.
+
+    Args:
+        connection (psycopg2 connection): An open database connection.
+        cursor (psycopg2 cursor): A cursor of that connection.
+        table_name (str): The name of the table.
+        window_start (str): The start of the table's change window.
+        upper_bound (str): The timestamp of the run.
+        compression (str): "gzip" or "zstd", or None.
+        file_format (str): "csv" or "parquet".
+        row_group_size (int): The rows of each Parquet row group.
+        s3_key (str): The key of the deletes object, the file name by
+        default.
+
+    Returns:
+        dict: The run manifest entry of the deletes file, which has no
+        keys on the first run or if no key was deleted.
+
+    Raises:
+        ValueError: If the table has no single integer primary key.
+        psycopg2.Error: If a query fails.
+        ClientError: If the upload or the key set update fails.
+    """
+    start = time.perf_counter()
+    primary_key = get_primary_key(cursor, table_name)
+    keys = fetch_key_set(connection, table_name, primary_key)
+    previous = get_stored_key_set(table_name)
+
+    deletes = deleted_keys(previous, keys) if previous is not None else []
+    file_name = f'{table_name}_deletes.{file_format}'
+    s3_key = s3_key or file_name
+    # The file is written without deletes too, in place of the deletes
+    # of the previous run, which would otherwise be applied again
+    cursor.execute(KEY_COLUMN_QUERY.format(key=primary_key,
+                                           table=table_name))
+    os.makedirs(CSV_DIRECTORY, exist_ok=True)
+    with open(os.path.join(CSV_DIRECTORY, file_name), 'wb') as file:
+        writer = TableWriter(file, file_format, compression, row_group_size)
+        writer.writeheader(cursor.description)
+        writer.writerows([(key,) for key in deletes])
+        writer.close()
+    push_data_in_bucket(f'{CSV_DIRECTORY}/', file_name,
+                        object_args(file_format, compression), s3_key)
+    entry = file_entry(table_name, s3_key, window_start, upper_bound,
+                       writer.counter, time.perf_counter() - start)
+
+    # The key set only moves once its deletes are stored
+    put_key_set(table_name, keys)
+    return entry
@@ -0,0 +1,228 @@
+"""
+This module contains functions for extracting the changes of a table
+with keyset pagination from its own watermark.
+
+The primary purpose of this module is to drain a large backlog of
+changes in bounded chunks. Rather than one unbounded
+`created_at BETWEEN ... OR last_updated BETWEEN ...` scan, the rows are
+read in (last_updated, primary key) order, `chunk_size` rows at a time,
+each chunk starting right after the last row of the previous one:
+
+    WHERE (last_updated, <primary key>) > (<watermark>)
+    AND last_updated <= <run timestamp>
+    ORDER BY last_updated, <primary key>
+    LIMIT <chunk_size>
+
+At most `max_chunks` chunks are read per invocation. The rows are
+written to '<table>_changes.csv' and uploaded, and only then is the
+table's watermark moved to the last row, so the next invocation carries
+on from there. New rows are picked up too, as totesys sets last_updated
+when a row is created.
+
+Usage:
+1. Ensure the necessary libraries (psycopg2, boto3) are available.
+2. Use `capture_changes_by_keyset` with an open connection and the
+timestamp of the run as the upper bound.
+
+Example:
+entry = capture_changes_by_keyset(connection, cursor, "sales_order",
+                                 "2022-11-03 14:20:49.962",
+                                 chunk_size=10000, max_chunks=10)
+"""
+from .extraction_metrics import PhaseTimer
+from .parquet_output import DEFAULT_ROW_GROUP_SIZE
+from .push_data_in_bucket import push_data_in_bucket
+from .run_manifest import file_entry
+from .table_writer import TableWriter, object_args
+from .watermarks import get_table_watermark, put_table_watermark
+
+import os
+import time
+
+DEFAULT_CHUNK_SIZE = 10000
+DEFAULT_MAX_CHUNKS = 10
+CSV_DIRECTORY = '/tmp/csv_files'
+
+PRIMARY_KEY_QUERY = '''SELECT a.attname
+FROM pg_index i
+JOIN pg_attribute a
+ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+WHERE i.indrelid = %s::regclass AND i.indisprimary;'''
+
+
+def get_primary_key(cursor, table_name):
+    """
+    Find the single-column primary key of a table.
+
+    Args:
+        cursor (psycopg2 cursor): A database cursor.
+        table_name (str): The name of the table.
+
+    Returns:
+        str: The name of the primary key column.
+
+    Raises:
+        ValueError: If the table has no primary key or a composite one.
+    """
+    cursor.execute(PRIMARY_KEY_QUERY, (table_name,))
+    columns = cursor.fetchall()
+    if len(columns) != 1:
+        raise ValueError(
+            f"Table {table_name} needs a single-column primary key "
+            "for keyset pagination")
+    return columns[0][0]
+
+
+def keyset_query(table_name, primary_key, first_chunk, with_op=False,
+                 columns=None):
+    """
+    Build the query reading one chunk of changes.
+
+    Args:
+        table_name (str): The name of the table.
+        primary_key (str): The name of its primary key column.
+        first_chunk (bool): True when the table has no primary key in
+        its watermark yet, so only the timestamp is compared.
+        with_op (bool): True to add the "op" column of a change file.
+        columns (list of str): The columns to select, all by default.
+
+    Returns:
+        str: The query. Its parameters are the start of the window
+        (with the "op" column only), the watermark timestamp, the
+        watermark primary key (except for the first chunk), the upper
+        bound timestamp and the chunk size.
+    """
+    if first_chunk:
+        position = 'last_updated >= %s::timestamp'
+    else:
+        position = f'(last_updated, {primary_key}) > (%s::timestamp, %s)'
+
+    # A row created after the watermark of the run is new to the
+    # warehouse, see `change_query.op_column`
+    op = (", CASE WHEN created_at > %s::timestamp "
+          "THEN 'insert' ELSE 'update' END AS op") if with_op else ''
+
+    select_list = ', '.join(columns) if columns else '*'
+
+    return f'''SELECT {select_list}{op}
+    FROM {table_name}
+    WHERE {position}
+    AND last_updated <= %s::timestamp
+    ORDER BY last_updated, {primary_key}
+    LIMIT %s;'''
+
+
+def capture_changes_by_keyset(connection, cursor, table_name, upper_bound,
+                              chunk_size=DEFAULT_CHUNK_SIZE,
+                              max_chunks=DEFAULT_MAX_CHUNKS,
+                              compression=None, file_format='csv',
+                              row_group_size=DEFAULT_ROW_GROUP_SIZE,
+                              s3_key=None, timer=None, columns=None):
+    """
+    Extract the next chunks of changes of a table, upload them as
+    '<table_name>_changes.<file_format>' and move the table's watermark.
+
+    Args:
+        connection (psycopg2 connection): An open database connection.
+        cursor (psycopg2 cursor): A cursor of that connection.
+        table_name (str): The name of the table.
+        upper_bound (str): The timestamp of the run; later changes are
+        left for the next run.
+        chunk_size (int): The number of rows read per query.
+        max_chunks (int): The maximum number of chunks read.
+        compression (str): "gzip" or "zstd" to compress the file.
+        file_format (str): "csv" or "parquet".
+        row_group_size (int): The rows of each Parquet row group.
+        s3_key (str): The key of the object, the file name by default.
+        timer (PhaseTimer): Times the phases of the extraction.
+        columns (list of str): The columns to extract, all by default.
+        They must include last_updated and the primary key.
+
+    Returns:
+        dict: The run manifest entry of the file, whose window starts
+        at the previous watermark.
+
+    Raises:
+        ValueError: If the table has no single-column primary key, or
+        chunk_size or max_chunks is not a positive integer.
+        psycopg2.Error: If a query fails.
+        ClientError: If the upload or the watermark update fails.
+    """
+    if chunk_size < 1 or max_chunks < 1:
+        raise ValueError("chunk_size and max_chunks must be positive")
+
+    start = time.perf_counter()
+    timer = timer or PhaseTimer()
+    primary_key = get_primary_key(cursor, table_name)
+    last_updated, key = get_table_watermark(table_name)
+    window_start = str(last_updated)
+    file_name = f'{table_name}_changes.{file_format}'
+
+    os.makedirs(CSV_DIRECTORY, exist_ok=True)
+    with open(os.path.join(CSV_DIRECTORY, file_name), 'wb') as file:
+        writer = TableWriter(file, file_format, compression, row_group_size)
+        for chunk in range(max_chunks):
+            with timer.phase('query'):
+                if key is None:
+                    cursor.execute(
+                        keyset_query(table_name, primary_key, True, True,
+                                     columns),
+                        (window_start, last_updated, upper_bound,
+                         chunk_size))
+                else:
+                    cursor.execute(
+                        keyset_query(table_name, primary_key, False, True,
+                                     columns),
+                        (window_start, last_updated, key, upper_bound,
+                         chunk_size))
+            with timer.phase('fetch'):
+                rows = cursor.fetchall()
+
+            names = [col[0] for col in cursor.description]
+            with timer.phase('serialize'):
+                if chunk == 0:
+                    writer.writeheader(cursor.description)
+                writer.writerows(rows)
+
+            if rows:
+                last_updated = rows[-1][names.index('last_updated')]
+                key = rows[-1][names.index(primary_key)]
+            if len(rows) < chunk_size:
+                break
+        with timer.phase('serialize'):
+            writer.close()
+
+    s3_key = s3_key or file_name
+    with timer.phase('upload'):
+        push_data_in_bucket(f'{CSV_DIRECTORY}/', file_name,
+                            object_args(file_format, compression), s3_key)
+    counter = writer.counter
+    if counter.rows > 0:
+        put_table_watermark(table_name, last_updated, key)
+
+    return file_entry(table_name, s3_key, window_start, upper_bound,
+                      counter, time.perf_counter() - start)
+
+
+def has_changes_by_keyset(cursor, table_name, upper_bound):
+    """
+    Probe a table for a change after its watermark, reading one row.
+
+    Args:
+        cursor (psycopg2 cursor): A database cursor.
+        table_name (str): The name of the table.
+        upper_bound (str): The timestamp of the run.
+
+    Returns:
+        bool: True if a row after the watermark exists.
+    """
+    primary_key = get_primary_key(cursor, table_name)
+    last_updated, key = get_table_watermark(table_name)
+
+    if key is None:
+        cursor.execute(keyset_query(table_name, primary_key, True),
+                       (last_updated, upper_bound, 1))
+    else:
+        cursor.execute(keyset_query(table_name, primary_key, False),
+                       (last_updated, key, upper_bound, 1))
+    return len(cursor.fetchall()) > 0
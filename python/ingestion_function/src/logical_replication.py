@@ -0,0 +1,604 @@
+"""
+This module contains functions for capturing the changes of a table
+from a PostgreSQL logical replication slot instead of its timestamps.
+
+The primary purpose of this module is to capture changes that the
+created_at/last_updated window cannot see, above all deletes, at a cost
+proportional to the changes rather than to the tables scanned. A
+replication slot keeps the WAL of the database from the point the
+ingestion lambda last confirmed; each run:
+   - opens a replication connection (psycopg2's
+   `LogicalReplicationConnection`) and creates the slot if it does not
+   exist yet;
+   - reads the decoded change stream up to the WAL position of the start
+   of the run, with either output plugin:
+      - "pgoutput" (default), the binary protocol of PostgreSQL's
+      built-in logical replication. It needs a publication, created
+      FOR ALL TABLES if it does not exist;
+      - "test_decoding", the text output of the contrib module;
+   - keeps the changes of committed transactions only, and folds the
+   changes of each row (by primary key) into its last state;
+   - writes the inserted and updated rows to '<table>_changes.<ext>'
+   with the columns of the table, as the other change captures do, and
+   the primary keys of the deleted rows to '<table>_deletes.<ext>',
+   written without rows when none were deleted so that the deletes of
+   an earlier run are not applied again;
+   - advances the slot past the last transaction read once every file
+   is uploaded, so a failed run reads the same changes again.
+
+The source database needs `wal_level = logical`, and the database user
+the REPLICATION attribute. The slot is created by the first run, so the
+changes made before it are only in that run's full snapshot.
+
+Usage:
+1. Ensure the necessary library (psycopg2) is available.
+2. Use `get_current_lsn` at the start of the run, `open_change_stream`,
+`read_changes` and `close_change_stream` to collect the changes of
+every table, and `write_logical_changes` for each table.
+3. Call `confirm_changes` once the files are uploaded.
+
+Example:
+target = get_current_lsn(cursor)
+stream = open_change_stream(connection_details)
+changes, lsn = read_changes(stream, target, "pgoutput")
+close_change_stream(stream)
+entries = write_logical_changes(cursor, "currency", changes["currency"],
+                                window_start, upper_bound)
+confirm_changes(connection, lsn)
+"""
+from .parquet_output import DEFAULT_ROW_GROUP_SIZE
+from .push_data_in_bucket import push_data_in_bucket
+from .run_manifest import file_entry
+from .table_writer import TableWriter, object_args
+
+from collections import namedtuple
+import logging
+import os
+import re
+import select
+import struct
+import time
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+from psycopg2.extras import LogicalReplicationConnection
+
+logger = logging.getLogger('MyLogger')
+
+DEFAULT_SLOT = 'ingestion_slot'
+DEFAULT_PUBLICATION = 'ingestion_publication'
+DEFAULT_PLUGIN = 'pgoutput'
+PLUGINS = ('pgoutput', 'test_decoding')
+# The longest time a run waits for the stream to reach its start, well
+# within the 60 seconds of the lambda so the tables are still written
+DEFAULT_STREAM_TIMEOUT = 20
+SLOT_RELEASE_TIMEOUT = 10
+CSV_DIRECTORY = '/tmp/csv_files'
+
+# The value of a TOASTed column an update did not change
+UNCHANGED = object()
+
+# A change of a row: its operation ("insert", "update" or "delete"),
+# its table and the text value of its columns by name
+Change = namedtuple('Change', ['op', 'table_name', 'values'])
+
+PRIMARY_KEY_QUERY = '''SELECT a.attname
+FROM pg_index i
+JOIN pg_attribute a
+ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+WHERE i.indrelid = %s::regclass AND i.indisprimary
+ORDER BY array_position(i.indkey, a.attnum);'''
+
+
+def get_current_lsn(cursor):
+    """
+    Read the current WAL position, up to which the run reads changes.
+
+    Args:
+        cursor (psycopg2 cursor): A database cursor.
+
+    Returns:
+        int: The position.
+    """
+    cursor.execute('SELECT pg_current_wal_lsn()::text;')
+    return lsn_to_int(cursor.fetchone()[0])
+
+
+def lsn_to_int(lsn):
+    """
+    Convert a WAL position from its text form, e.g. '0/37E1220'.
+    """
+    high, low = lsn.split('/')
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+def open_change_stream(connection_details, slot=DEFAULT_SLOT,
+                       plugin=DEFAULT_PLUGIN,
+                       publication=DEFAULT_PUBLICATION):
+    """
+    Open a replication connection and start streaming a slot's changes.
+
+    Args:
+        connection_details (dict): The arguments of psycopg2.connect.
+        slot (str): The name of the replication slot.
+        plugin (str): One of PLUGINS.
+        publication (str): The publication read by "pgoutput".
+
+    Returns:
+        psycopg2 ReplicationCursor: The cursor streaming the changes.
+
+    Raises:
+        ValueError: If the plugin is not one of PLUGINS.
+        psycopg2.Error: If the slot cannot be created or read.
+    """
+    if plugin not in PLUGINS:
+        raise ValueError(f"Unknown logical decoding plugin: {plugin}")
+
+    if plugin == 'pgoutput':
+        ensure_publication(connection_details, publication)
+
+    connection = psycopg2.connect(
+        **connection_details, connection_factory=LogicalReplicationConnection)
+    cursor = connection.cursor()
+    try:
+        cursor.create_replication_slot(slot, output_plugin=plugin)
+        logger.info(f'Created replication slot {slot}')
+    except psycopg2.errors.DuplicateObject:
+        pass
+
+    if plugin == 'pgoutput':
+        cursor.start_replication(
+            slot_name=slot, decode=False,
+            options={'proto_version': '1', 'publication_names': publication})
+    else:
+        cursor.start_replication(slot_name=slot, decode=True)
+    return cursor
+
+
+def ensure_publication(connection_details, publication):
+    """
+    Create the publication of every table if it does not exist.
+
+    Args:
+        connection_details (dict): The arguments of psycopg2.connect.
+        publication (str): The name of the publication.
+
+    Returns:
+        None
+    """
+    connection = psycopg2.connect(**connection_details)
+    try:
+        connection.autocommit = True
+        cursor = connection.cursor()
+        cursor.execute('SELECT 1 FROM pg_publication WHERE pubname = %s;',
+                       (publication,))
+        if cursor.fetchone() is None:
+            cursor.execute(
+                f'CREATE PUBLICATION "{publication}" FOR ALL TABLES;')
+            logger.info(f'Created publication {publication}')
+    finally:
+        connection.close()
+
+
+def read_changes(stream, target_lsn, plugin=DEFAULT_PLUGIN,
+                 timeout=DEFAULT_STREAM_TIMEOUT):
+    """
+    Read the committed changes of a stream up to a WAL position.
+
+    Args:
+        stream (psycopg2 ReplicationCursor): From `open_change_stream`.
+        target_lsn (int): The position to read up to, e.g. from
+        `get_current_lsn`.
+        plugin (str): The plugin the stream was opened with.
+        timeout (float): The longest time to wait for the position.
+
+    Returns:
+        tuple: The list of Change of every table by table name, in
+        commit order, and the position to confirm once they are stored
+        (None if no transaction was read).
+    """
+    decode = decode_pgoutput if plugin == 'pgoutput' \
+        else decode_test_decoding
+    relations = {}
+    changes = {}
+    transaction = []
+    confirmed_lsn = None
+    deadline = time.monotonic() + timeout
+
+    while True:
+        # A busy database never leaves the stream empty, so the deadline
+        # is checked before every message, not only while waiting
+        if time.monotonic() > deadline:
+            logger.warning('Change stream did not reach the start '
+                           'of the run; reading the rest next run')
+            break
+        message = stream.read_message()
+        if message is None:
+            if stream.wal_end >= target_lsn and not transaction:
+                break
+            # Ask for a keepalive, which reports how far decoding got
+            stream.send_feedback(reply=True)
+            select.select([stream], [], [], 1)
+            continue
+
+        change = decode(message.payload, relations)
+        if change == 'begin':
+            transaction = []
+        elif change == 'commit':
+            for item in transaction:
+                changes.setdefault(item.table_name, []).append(item)
+            transaction = []
+            confirmed_lsn = message.data_start
+            # The transactions committed after the start of the run are
+            # left for the next run
+            if message.data_start >= target_lsn:
+                break
+        elif change is not None:
+            transaction.append(change)
+
+    return changes, confirmed_lsn
+
+
+def close_change_stream(stream):
+    """
+    Close a stream and its replication connection. The changes read
+    stay in the slot until they are confirmed.
+    """
+    stream.close()
+    stream.connection.close()
+
+
+def confirm_changes(connection, lsn, slot=DEFAULT_SLOT):
+    """
+    Confirm the changes read up to a position, so the slot releases
+    their WAL and the next run starts after them.
+
+    The stream is closed while the files are written, as a replication
+    connection left without feedback is dropped by the server after
+    `wal_sender_timeout`, so the slot is advanced with SQL instead.
+
+    Args:
+        connection (psycopg2 connection): A database connection; its
+        transaction is committed.
+        lsn (int): The position returned by `read_changes`, or None.
+        slot (str): The name of the replication slot.
+
+    Returns:
+        None
+    """
+    if lsn is None:
+        return
+    cursor = connection.cursor()
+    # The walsender of the closed stream may still hold the slot
+    deadline = time.monotonic() + SLOT_RELEASE_TIMEOUT
+    while True:
+        cursor.execute('SELECT active FROM pg_replication_slots '
+                       'WHERE slot_name = %s;', (slot,))
+        if not cursor.fetchone()[0] or time.monotonic() > deadline:
+            break
+        time.sleep(0.1)
+    cursor.execute('SELECT pg_replication_slot_advance(%s, %s::pg_lsn);',
+                   (slot, f'{lsn >> 32:X}/{lsn & 0xffffffff:X}'))
+    cursor.close()
+    connection.commit()
+
+
+def table_name_of(qualified_name):
+    """
+    Drop the schema of a table name, e.g. 'public.currency' -> 'currency'.
+    """
+    schema, _, name = qualified_name.partition('.')
+    return name if schema == 'public' else qualified_name
+
+
+def decode_pgoutput(payload, relations):
+    """
+    Decode a message of the "pgoutput" protocol (version 1).
+
+    Args:
+        payload (bytes): The message.
+        relations (dict): The tables described by earlier Relation
+        messages, updated in place.
+
+    Returns:
+        'begin', 'commit', a Change, or None for other messages.
+    """
+    payload = bytes(payload)
+    kind = payload[:1]
+    if kind == b'B':
+        return 'begin'
+    if kind == b'C':
+        return 'commit'
+    if kind == b'R':
+        oid, = struct.unpack_from('!I', payload, 1)
+        namespace, position = read_string(payload, 5)
+        name, position = read_string(payload, position)
+        column_count, = struct.unpack_from('!H', payload, position + 1)
+        position += 3
+        columns = []
+        for _ in range(column_count):
+            column, position = read_string(payload, position + 1)
+            columns.append(column)
+            # Skip the type oid and modifier of the column
+            position += 8
+        relations[oid] = (table_name_of(f'{namespace}.{name}'), columns)
+        return None
+    if kind not in (b'I', b'U', b'D'):
+        return None
+
+    oid, = struct.unpack_from('!I', payload, 1)
+    table_name, columns = relations[oid]
+    position = 5
+    if kind == b'U' and payload[position:position + 1] in (b'K', b'O'):
+        # The old key of an update of the primary key is not kept
+        _, position = read_tuple(payload, position + 1)
+    values, _ = read_tuple(payload, position + 1)
+    op = {b'I': 'insert', b'U': 'update', b'D': 'delete'}[kind]
+    return Change(op, table_name, dict(zip(columns, values)))
+
+
+def read_string(payload, position):
+    end = payload.index(b'\x00', position)
+    return payload[position:end].decode('utf-8'), end + 1
+
+
+def read_tuple(payload, position):
+    """
+    Read the TupleData of a "pgoutput" message.
+
+    Returns:
+        tuple: The text values (None for NULL, UNCHANGED for an
+        unchanged TOAST value) and the position after the tuple.
+    """
+    count, = struct.unpack_from('!H', payload, position)
+    position += 2
+    values = []
+    for _ in range(count):
+        kind = payload[position:position + 1]
+        position += 1
+        if kind == b'n':
+            values.append(None)
+        elif kind == b'u':
+            values.append(UNCHANGED)
+        else:
+            length, = struct.unpack_from('!I', payload, position)
+            position += 4
+            values.append(
+                payload[position:position + length].decode('utf-8'))
+            position += length
+    return values, position
+
+
+TEST_DECODING_CHANGE = re.compile(
+    r'^table (?P<table>\S+): (?P<op>INSERT|UPDATE|DELETE): (?P<data>.*)$',
+    re.DOTALL)
+TEST_DECODING_COLUMN = re.compile(
+    r"(?P<name>[^\s\[]+)\[(?P<type>[^\]]+)\]:"
+    r"(?P<value>'(?:[^']|'')*'|\S+)")
+
+
+def decode_test_decoding(payload, relations=None):
+    """
+    Decode a line of the "test_decoding" plugin, e.g.
+    "table public.currency: INSERT: currency_id[integer]:1 ...".
+
+    Args:
+        payload (str): The line.
+        relations: Unused; the lines name their table.
+
+    Returns:
+        'begin', 'commit', a Change, or None for other lines.
+    """
+    if payload.startswith('BEGIN'):
+        return 'begin'
+    if payload.startswith('COMMIT'):
+        return 'commit'
+    match = TEST_DECODING_CHANGE.match(payload)
+    if not match:
+        return None
+
+    data = match.group('data')
+    if data.startswith('old-key: '):
+        # The old key of an update of the primary key is not kept
+        data = data[data.index('new-tuple: ') + len('new-tuple: '):]
+    values = {}
+    for column in TEST_DECODING_COLUMN.finditer(data):
+        value = column.group('value')
+        if value == 'null':
+            value = None
+        elif value == 'unchanged-toast-datum':
+            value = UNCHANGED
+        elif value.startswith("'"):
+            value = value[1:-1].replace("''", "'")
+        values[column.group('name')] = value
+    return Change(match.group('op').lower(),
+                  table_name_of(match.group('table')), values)
+
+
+def get_primary_key_columns(cursor, table_name):
+    """
+    Find the primary key columns of a table, in key order.
+
+    Args:
+        cursor (psycopg2 cursor): A database cursor.
+        table_name (str): The name of the table.
+
+    Returns:
+        list: The names of the columns, empty without a primary key.
+    """
+    cursor.execute(PRIMARY_KEY_QUERY, (table_name,))
+    return [column for (column,) in cursor.fetchall()]
+
+
+def fold_changes(changes, key_columns):
+    """
+    Fold the changes of each row into its last state.
+
+    Args:
+        changes (list of Change): The changes of a table, in order.
+        key_columns (list of str): Its primary key columns. Without
+        one, every change is kept.
+
+    Returns:
+        tuple: The values of the inserted or updated rows, and of the
+        deleted rows, each in the order of their last change.
+    """
+    if not key_columns:
+        return ([change.values for change in changes
+                 if change.op != 'delete'],
+                [change.values for change in changes
+                 if change.op == 'delete'])
+
+    rows = {}
+    for change in changes:
+        key = tuple(change.values.get(column) for column in key_columns)
+        previous = rows.pop(key, None)
+        values = change.values
+        if change.op != 'delete' and previous and previous[0] != 'delete':
+            # An unchanged TOAST value keeps its earlier value
+            values = {column: previous[1].get(column, UNCHANGED)
+                      if value is UNCHANGED else value
+                      for column, value in values.items()}
+        rows[key] = (change.op, values)
+
+    return ([values for op, values in rows.values() if op != 'delete'],
+            [values for op, values in rows.values() if op == 'delete'])
+
+
+def change_ops(changes, rows, key_columns):
+    """
+    Tag the folded rows of a table as inserted or updated. A row is
+    inserted if its first change in the window is an insert, so a row
+    the warehouse already holds is always an update.
+
+    Args:
+        changes (list of Change): The changes of a table, in order.
+        rows (list of dict): The inserted or updated rows, from
+        `fold_changes`.
+        key_columns (list of str): Its primary key columns.
+
+    Returns:
+        list of str: 'insert' or 'update' for each row.
+    """
+    if not key_columns:
+        return [change.op for change in changes if change.op != 'delete']
+
+    first_ops = {}
+    for change in changes:
+        key = tuple(change.values.get(column) for column in key_columns)
+        first_ops.setdefault(key, change.op)
+    return ['insert' if first_ops[tuple(values.get(column)
+                                        for column in key_columns)]
+            == 'insert' else 'update' for values in rows]
+
+
+def cast_row(values, description, cursor):
+    """
+    Convert the text values of a row to the Python values psycopg2
+    returns for the same columns, so the files are written the same way
+    as by the other change captures.
+    """
+    row = []
+    for column in description:
+        value = values.get(column.name)
+        caster = psycopg2.extensions.string_types.get(column.type_code)
+        if value is not None and caster is not None:
+            value = caster(value, cursor)
+        row.append(value)
+    return row
+
+
+def refetch_unchanged_values(cursor, table_name, rows, key_columns,
+                             description):
+    """
+    Read the current value of the TOAST columns an update left out.
+    """
+    names = [column.name for column in description]
+    select_list = ', '.join(f'{name}::text' for name in names)
+    condition = ' AND '.join(f'{column}::text = %s' for column in key_columns)
+    for values in rows:
+        if not key_columns or UNCHANGED not in values.values():
+            continue
+        cursor.execute(f'SELECT {select_list} FROM {table_name} '
+                       f'WHERE {condition};',
+                       [values[column] for column in key_columns])
+        current = cursor.fetchone()
+        current = dict(zip(names, current)) if current else {}
+        for column, value in values.items():
+            if value is UNCHANGED:
+                values[column] = current.get(column)
+
+
+def write_rows_file(cursor, file_name, s3_key, description, rows,
+                    compression, file_format, row_group_size):
+    os.makedirs(CSV_DIRECTORY, exist_ok=True)
+    with open(os.path.join(CSV_DIRECTORY, file_name), 'wb') as file:
+        writer = TableWriter(file, file_format, compression, row_group_size)
+        writer.writeheader(description)
+        writer.writerows([cast_row(values, description, cursor)
+                          for values in rows])
+        writer.close()
+    push_data_in_bucket(f'{CSV_DIRECTORY}/', file_name,
+                        object_args(file_format, compression), s3_key)
+    return writer.counter
+
+
+def write_logical_changes(cursor, table_name, changes, window_start,
+                          upper_bound, compression=None, file_format='csv',
+                          row_group_size=DEFAULT_ROW_GROUP_SIZE,
+                          changes_key=None, deletes_key=None):
+    """
+    Write the changes of a table read from the replication slot to
+    '<table_name>_changes.<file_format>' and the primary keys of the
+    deleted rows to '<table_name>_deletes.<file_format>', and upload
+    them. The deletes file is written when no row was deleted too, in
+    place of the deletes of the previous run.
+
+    Args:
+        cursor (psycopg2 cursor): A database cursor, for the columns of
+        the table.
+        table_name (str): The name of the table.
+        changes (list of Change): Its changes, from `read_changes`.
+        window_start (str): The timestamp of the last run.
+        upper_bound (str): The timestamp of the run.
+        compression (str): "gzip" or "zstd", or None.
+        file_format (str): "csv" or "parquet".
+        row_group_size (int): The rows of each Parquet row group.
+        changes_key (str): The key of the changes object, the file name
+        by default.
+        deletes_key (str): The key of the deletes object, the file name
+        by default.
+
+    Returns:
+        list: The run manifest entries of the files.
+    """
+    start = time.perf_counter()
+    cursor.execute(f'SELECT *, NULL::text AS op FROM {table_name} LIMIT 0;')
+    changes_description = cursor.description
+    description = changes_description[:-1]
+    key_columns = get_primary_key_columns(cursor, table_name)
+    rows, deletes = fold_changes(changes, key_columns)
+    refetch_unchanged_values(cursor, table_name, rows, key_columns,
+                             description)
+    for values, op in zip(rows, change_ops(changes, rows, key_columns)):
+        values['op'] = op
+
+    key_description = [column for column in description
+                       if column.name in key_columns] or description
+    files = [(f'{table_name}_changes', changes_key, changes_description,
+              rows),
+             (f'{table_name}_deletes', deletes_key, key_description,
+              deletes)]
+
+    entries = []
+    for file_stem, s3_key, file_description, file_rows in files:
+        file_name = f'{file_stem}.{file_format}'
+        s3_key = s3_key or file_name
+        counter = write_rows_file(cursor, file_name, s3_key,
+                                  file_description, file_rows, compression,
+                                  file_format, row_group_size)
+        entries.append(file_entry(table_name, s3_key, window_start,
+                                  upper_bound, counter,
+                                  time.perf_counter() - start))
+    return entries
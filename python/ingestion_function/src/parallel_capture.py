@@ -0,0 +1,164 @@
+"""
+This module contains functions for extracting several tables at the same
+time while keeping every file consistent with one database snapshot.
+
+The primary purpose of this module is to make the run time of the
+ingestion lambda depend on its largest table rather than on the sum of
+all tables. The tables are handed to a thread pool, and every worker
+takes a connection from a small psycopg2 connection pool.
+
+To keep the files mutually consistent, the main connection exports its
+snapshot with `pg_export_snapshot()` and every worker imports it with
+`SET TRANSACTION SNAPSHOT` before running any query. All workers then
+see exactly the same data as the main connection, whatever commits in
+the meantime. The exporting transaction must stay open until every
+worker has imported the snapshot.
+
+Usage:
+1. Ensure the necessary library (psycopg2) is available.
+2. Call `export_snapshot` on the main connection before any other query.
+3. Use `capture_tables_in_parallel` with a connection pool, the snapshot
+id, the table names and a function extracting one table.
+
+Example:
+snapshot_id = export_snapshot(connection)
+pool = ThreadedConnectionPool(1, 4, **connection_details)
+capture_tables_in_parallel(pool, snapshot_id, ["staff", "sales_order"],
+                           capture, max_workers=4)
+"""
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+logger = logging.getLogger('MyLogger')
+logger.setLevel(logging.INFO)
+
+TABLE_SIZE_QUERY = '''SELECT relname, pg_relation_size(oid)
+FROM pg_class
+WHERE relkind = 'r' AND relname = ANY(%s);'''
+
+
+def export_snapshot(connection):
+    """
+    Start a repeatable read transaction and export its snapshot.
+
+    This must be the first statement of the connection's transaction,
+    and the transaction must stay open while the snapshot is in use.
+
+    Args:
+        connection (psycopg2 connection): The main database connection.
+
+    Returns:
+        str: The snapshot id to pass to `import_snapshot`.
+    """
+    cursor = connection.cursor()
+    cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;')
+    cursor.execute('SELECT pg_export_snapshot();')
+    snapshot_id = cursor.fetchone()[0]
+    cursor.close()
+    return snapshot_id
+
+
+def import_snapshot(connection, snapshot_id):
+    """
+    Start a repeatable read transaction that sees an exported snapshot.
+
+    Args:
+        connection (psycopg2 connection): A connection with no open
+        transaction.
+        snapshot_id (str): The id returned by `export_snapshot`.
+
+    Returns:
+        None
+    """
+    cursor = connection.cursor()
+    cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;')
+    cursor.execute('SET TRANSACTION SNAPSHOT %s;', (snapshot_id,))
+    cursor.close()
+
+
+def order_tables_by_size(cursor, table_names):
+    """
+    Sort table names from the largest table to the smallest.
+
+    Starting the largest tables first stops one of them from being
+    left alone at the end of the run.
+
+    Args:
+        cursor (psycopg2 cursor): A database cursor.
+        table_names (list of str): The tables to sort.
+
+    Returns:
+        list of str: The table names, largest first.
+    """
+    cursor.execute(TABLE_SIZE_QUERY, (list(table_names),))
+    sizes = dict(cursor.fetchall())
+    return sorted(table_names, key=lambda name: sizes.get(name, 0),
+                  reverse=True)
+
+
+def capture_in_snapshot(pool, snapshot_id, table_name, capture):
+    """
+    Extract one table with a pooled connection inside a snapshot.
+
+    Args:
+        pool (psycopg2.pool.AbstractConnectionPool): The connection pool.
+        snapshot_id (str): The id returned by `export_snapshot`.
+        table_name (str): The table to extract.
+        capture (callable): Called as capture(connection, cursor,
+        table_name) to extract the table.
+
+    Returns:
+        None
+    """
+    connection = pool.getconn()
+    try:
+        import_snapshot(connection, snapshot_id)
+        cursor = connection.cursor()
+        try:
+            capture(connection, cursor, table_name)
+        finally:
+            cursor.close()
+    finally:
+        # Ends the read-only transaction before the connection is reused
+        connection.rollback()
+        pool.putconn(connection)
+
+
+def capture_tables_in_parallel(pool, snapshot_id, table_names, capture,
+                               max_workers):
+    """
+    Extract tables concurrently, each worker reading the same snapshot.
+
+    Every table is attempted even when another one fails.
+
+    Args:
+        pool (psycopg2.pool.AbstractConnectionPool): A pool holding at
+        least max_workers connections.
+        snapshot_id (str): The id returned by `export_snapshot`.
+        table_names (list of str): The tables to extract, in the order
+        they should be started.
+        capture (callable): Called as capture(connection, cursor,
+        table_name) to extract one table.
+        max_workers (int): The number of tables extracted at a time.
+
+    Returns:
+        None
+
+    Raises:
+        Exception: The first error raised while extracting a table,
+        once every table has been attempted.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(capture_in_snapshot, pool, snapshot_id,
+                                   table_name, capture)
+                   for table_name in table_names]
+
+    errors = []
+    for table_name, future in zip(table_names, futures):
+        error = future.exception()
+        if error is not None:
+            logger.error(f'Error extracting {table_name}: {error}')
+            errors.append(error)
+
+    if errors:
+        raise errors[0]
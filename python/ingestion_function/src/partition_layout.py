@@ -0,0 +1,151 @@
+"""
+This module contains functions for the partitioned layout of the
+ingestion bucket, where no run overwrites the objects of another.
+
+The primary purpose of this module is to stop each run from replacing
+'<table>.csv' and '<table>_changes.csv' at the root of the bucket while
+the transformation lambda may be reading them. In the "partitioned"
+layout every file of a run gets its own key:
+
+    table=<file stem>/ingest_date=<YYYY-MM-DD>/run=<run id>/part-0.<ext>
+
+e.g. 'table=currency_changes/ingest_date=2022-11-03/
+run=20221103T142049962/part-0.csv', where the run id is the timestamp
+of the run. Once every file of a run is uploaded, 'latest.json' is
+updated to point at the newest complete object of every file stem:
+
+{"run": "20221103T142049962",
+ "files": {"currency": "table=currency/ingest_date=.../part-0.csv",
+           "currency_changes": "table=currency_changes/..."}}
+
+A file stem not written by a run (e.g. a full snapshot not due) keeps
+the object of the last run that wrote it. Older runs stay in place, so
+they can be processed incrementally or replayed.
+
+Usage:
+1. Ensure the necessary library (boto3) is available.
+2. Use `object_key` to name each file, and `get_latest_pointer`,
+`update_latest_pointer` and `put_latest_pointer` at the end of a run.
+
+Example:
+key = object_key("currency_changes", "csv", "2022-11-03 14:20:49.962",
+                 "partitioned")
+"""
+import json
+import re
+
+import boto3
+from botocore.exceptions import ClientError
+
+LAYOUT_BUCKET = 'ingested-data-vox-indicium'
+LATEST_KEY = 'latest.json'
+LAYOUTS = ('root', 'partitioned')
+
+PARTITION_KEY = re.compile(
+    r'^table=(?P<stem>[^/]+)/ingest_date=[^/]+/run=(?P<run>[^/]+)/')
+
+
+def run_id(run_timestamp):
+    """
+    Build the id of a run from its timestamp.
+
+    Args:
+        run_timestamp (str): The timestamp of the run, as stored in
+        'postgres-datetime.txt'.
+
+    Returns:
+        str: The id, e.g. '20221103T142049962', which sorts like the
+        timestamps.
+    """
+    timestamp = run_timestamp.replace(' ', 'T')
+    return re.sub(r'[-:.]', '', timestamp)
+
+
+def object_key(file_stem, extension, run_timestamp, layout='root', part=0):
+    """
+    Build the key of a file of a run.
+
+    Args:
+        file_stem (str): The name of the file, e.g. 'currency_changes'.
+        extension (str): The extension of the file, e.g. 'csv'.
+        run_timestamp (str): The timestamp of the run.
+        layout (str): One of LAYOUTS.
+        part (int): The number of the part of the file.
+
+    Returns:
+        str: '<file_stem>.<extension>' in the "root" layout, else the
+        partitioned key.
+
+    Raises:
+        ValueError: If the layout is not one of LAYOUTS.
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout: {layout}")
+    if layout == 'root':
+        return f'{file_stem}.{extension}'
+
+    ingest_date = run_timestamp[:10]
+    return (f'table={file_stem}/ingest_date={ingest_date}/'
+            f'run={run_id(run_timestamp)}/part-{part}.{extension}')
+
+
+def get_latest_pointer():
+    """
+    Retrieve the pointer to the newest complete objects.
+
+    Returns:
+        dict: The pointer, with an empty "files" dictionary if none
+        exists.
+
+    Raises:
+        ClientError: If the pointer cannot be read for another reason
+        than it not existing.
+    """
+    s3 = boto3.client('s3')
+    try:
+        file = s3.get_object(Bucket=LAYOUT_BUCKET, Key=LATEST_KEY)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchKey':
+            return {'run': None, 'files': {}}
+        raise e
+    return json.loads(file['Body'].read().decode('utf-8'))
+
+
+def update_latest_pointer(pointer, run_timestamp, keys):
+    """
+    Point at the partitioned objects uploaded by a run.
+
+    Args:
+        pointer (dict): The pointer, updated in place.
+        run_timestamp (str): The timestamp of the run.
+        keys (list of str): The keys of the objects uploaded by the
+        run; keys outside the partitioned layout are ignored.
+
+    Returns:
+        bool: True if the pointer moved, i.e. the run uploaded
+        partitioned objects.
+    """
+    moved = False
+    for key in keys:
+        match = PARTITION_KEY.match(key)
+        if match:
+            pointer['files'][match.group('stem')] = key
+            moved = True
+    if moved:
+        pointer['run'] = run_id(run_timestamp)
+    return moved
+
+
+def put_latest_pointer(pointer):
+    """
+    Store the pointer to the newest complete objects.
+
+    Args:
+        pointer (dict): The pointer.
+
+    Returns:
+        None
+    """
+    s3 = boto3.client('s3')
+    s3.put_object(Bucket=LAYOUT_BUCKET, Key=LATEST_KEY,
+                  Body=json.dumps(pointer, indent=2))
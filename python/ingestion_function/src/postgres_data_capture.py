@@ -21,24 +21,1007 @@ to an S3 bucket.
    - Provide appropriate AWS Lambda event and context arguments when
    invoking this function.
 
+Extraction engines:
+The event can select how each table is read from the database with the
+"engine" option (a single value, or a dictionary keyed by table name):
+   - "fetchall" (default) fetches the whole result set at once.
+   - "stream" uses a server-side cursor and writes the CSV file in
+   batches of "fetch_size" rows, so memory use does not grow with
+   the size of the table.
+   - "copy" runs `COPY ... TO STDOUT` and pipes PostgreSQL's CSV output
+   straight into the S3 upload, without creating Python rows or
+   writing to /tmp. The files are byte-identical to the other engines.
+   - "async" fetches the rows in one asyncio task and encodes and
+   uploads them in another, joined by a queue of at most "queue_depth"
+   batches (see `async_capture`). In a run without "workers", the
+   files of every "async" table go through one pipeline once the other
+   tables are extracted, so uploading a table overlaps fetching the
+   next. The rows are read with psycopg2, or with asyncpg where it is
+   installed ("async_driver"); the deployed lambda does not package
+   asyncpg. The files are always uploaded as they are encoded.
+
+Uploads:
+With the "upload" option set to "multipart" (the default is "file"),
+the CSV is not written to /tmp but encoded straight into an S3
+multipart upload of "part_size" byte parts, with at most
+"max_in_flight_parts" parts uploading at a time.
+
+Compression:
+The "compression" option ("gzip" or "zstd") compresses the CSV objects
+as they are written. Their keys do not change; the compression is
+recorded in their Content-Encoding and 'compression' metadata, and the
+transformation lambda decodes them while reading. The run manifest
+counts the bytes of the objects as stored.
+
+Output format:
+With the "format" option set to "parquet" (the default is "csv"), the
+files are written as '<table>.parquet' with a schema typed from the
+PostgreSQL column types, in row groups of "row_group_size" rows. The
+"compression" option then sets the Parquet codec (snappy by default).
+The "copy" engine only writes CSV.
+
+Change capture:
+By default the changes of every table are the rows created or updated
+since the timestamp stored in 'postgres-datetime.txt'. With the
+"change_capture" option set to "keyset", a table's changes are instead
+read from its own watermark in (last_updated, primary key) order, at
+most "keyset_max_chunks" chunks of "keyset_chunk_size" rows per run.
+A table that fails keeps its watermark and does not affect the others.
+With "change_capture" set to "logical", the changes are read from the
+logical replication slot "replication_slot" (decoded with
+"decoding_plugin", "pgoutput" or "test_decoding"), which also captures
+deletes into '<table>_deletes.csv'. The slot is only advanced when every
+"logical" table has stored its changes.
+
+Full snapshots:
+The "snapshot_policy" option sets how often the full '<table>.csv' is
+exported next to the changes: "always" (default), "hourly", "daily",
+"schema_change" or "on_demand". "force_snapshot" requests one in this
+run. The time of the last snapshot of every table is recorded in
+'snapshots.json' for the transformation lambda.
+
+Skipping unchanged tables:
+The "skip_unchanged" option runs a pre-flight check and leaves out the
+tables with no activity: no query, no CSV file and no upload.
+   - "stats" compares the pg_stat_user_tables insert/update/delete
+   counters with the ones stored at the last run. The counters lag the
+   commits by about a second, so a table skipped on them keeps the
+   start of its change window for the next run.
+   - "exists" probes the change window of each table with EXISTS.
+
+Parallel extraction:
+With the "workers" option set above 1, the tables are extracted by a
+thread pool using connections from a psycopg2 connection pool. Every
+worker imports the snapshot exported by the main connection, so the
+changes files and the full files all describe the same moment.
+
+Object layout:
+With the "layout" option set to "partitioned" (the default is "root"),
+each file is written to its own key,
+'table=<file stem>/ingest_date=<date>/run=<run id>/part-0.<ext>', so no
+run overwrites another. 'latest.json' points at the newest complete
+object of every file stem once the run has uploaded all of its files.
+
+Warm invocations:
+The database connection is kept open between invocations of a warm
+Lambda container, checked at the start of each run and opened again if
+it failed. The list of tables and their schema fingerprints are cached
+too, and only read again when the schema fingerprint of the database
+changes.
+
+Scheduling and checkpoints:
+The run reads the time it has left from the Lambda context and does not
+start a table it does not expect to finish "deadline_margin" seconds
+(10 by default) before the timeout, based on how long the table took
+last time. Every table records the end of the last change window it
+stored in 'checkpoints.json'; a table left out or failed is started
+first by the next run, with its changes read from its own checkpoint.
+
+Table registry:
+Every table belongs to a tier of the "table_registry" option, and is
+only extracted when its tier is due: "hot" tables on every run,
+"reference" tables (currency, department, address) hourly, and
+"excluded" tables (_prisma_migrations) never. A table that is not due
+keeps its checkpoint, so its next extraction reads every change since
+the last one. Tables with the "logical" change capture are extracted on
+every run.
+
+Fan-out:
+The "fan_out" option (the largest number of parts) writes the full
+content of a table in parts, one per primary-key range of about
+"rows_per_shard" rows, each by its own worker: an invocation of this
+lambda with a {"fan_out_shard": ...} event, or a thread of this
+invocation with "fan_out_executor" set to "local". A completion manifest
+'<table>.parts.json' lists the parts once all of them are written.
+
+Run manifest:
+The rows, bytes and SHA-256 checksum of every file are counted while it
+is written, and a manifest of the run (table, change window, rows,
+bytes, checksum and duration of every file) is stored as
+'manifests/<run timestamp>.json' in the ingestion bucket.
+
+Every change file has an "op" column: 'insert' for a row created in
+the change window, 'update' otherwise ('insert' or 'update' as read
+from the replication slot for the "logical" change capture).
+
+Column contracts:
+Only the columns the transformation lambda uses are extracted, with the
+primary key and the watermark columns, following the "columns" option
+or the defaults of `column_contract` (e.g. counterparty without its
+contacts). The "logical" change capture writes every column.
+
+Deletes:
+The "delete_detection" option set to "key_diff" compares the primary
+keys of a table with the ones stored by the previous run (see
+`key_set`), and writes the keys that are gone as '<table>_deletes.csv',
+so deletes reach the warehouse without full snapshots. A table skipped
+as unchanged is compared on its next extracted run.
+
+Change queries:
+The shape of the query selecting a table's changes ("or", "union" of
+two range scans, or "last_updated" only) is chosen per table by the
+planner's EXPLAIN cost and cached in 'query_plans.json' (see
+`change_query`). Invoking the function with {"index_report": true}
+extracts nothing and returns, for every table, the change columns
+missing an index and the estimated cost of one run's change query.
+
+Dry run:
+Invoking the function with {"dry_run": true} extracts nothing and
+returns an estimate of the run from the planner's statistics (see
+`cost_estimate`): the rows, bytes and seconds of every due table's
+files, the predicted seconds of the run, and the "workers" and
+"fan_out" parts it needs to finish in the time left ("time_budget"
+seconds, 60 by default, for a run without a deadline). Every
+checkpoint records the rows of its table, so the estimate uses the
+rows per second each table managed last time.
+
+Metrics:
+The time every file spends in each phase of its extraction (query,
+fetch, serialize, upload), its rows, bytes and rows per second are
+printed as a CloudWatch Embedded Metric Format line (see
+`extraction_metrics`), in the 'TotesysIngestion' namespace by Table.
+
 Example:
 Assuming all necessary components are in place, invoking the
 `postgres_data_capture` function can trigger the capture,
 CSV file creation, and S3 upload process.
+
+postgres_data_capture({"engine": "stream", "fetch_size": 5000}, context)
+postgres_data_capture({"engine": "copy", "workers": 4}, context)
 """
-from src.secret_login import retrieve_secret_details
-from src.s3_timestamp import get_s3_timestamp
-from src.csv_write import write_table_to_csv
-from src.push_data_in_bucket import push_data_in_bucket
+from .secret_login import retrieve_secret_details
+from .s3_timestamp import get_s3_timestamp
+from .push_data_in_bucket import push_data_in_bucket
+from .stream_table import iter_query_batches, DEFAULT_FETCH_SIZE
+from .s3_stream import (S3MultipartWriter, DEFAULT_PART_SIZE,
+                        DEFAULT_MAX_IN_FLIGHT)
+from .copy_table import copy_table_to_s3
+from .async_capture import (capture_files_async, file_job, describe_query,
+                            default_driver, DEFAULT_QUEUE_DEPTH)
+from .table_writer import TableWriter, FORMATS, object_args
+from .parquet_output import DEFAULT_ROW_GROUP_SIZE
+from .run_manifest import file_entry, put_run_manifest
+from .extraction_metrics import (PhaseTimer, TimedWriter,
+                                 emit_file_metrics)
+from .partition_layout import (LAYOUTS, object_key, get_latest_pointer,
+                               update_latest_pointer, put_latest_pointer)
+from .capture_options import get_capture_option
+from .change_query import (choose_change_filters, index_report,
+                           op_column)
+from .cost_estimate import estimate_run, DEFAULT_TIME_BUDGET
+from .key_set import capture_deletes_by_key_diff
+from .column_contract import (get_column_contract, project_columns,
+                              select_list)
+from .keyset_capture import (capture_changes_by_keyset,
+                             has_changes_by_keyset,
+                             DEFAULT_CHUNK_SIZE, DEFAULT_MAX_CHUNKS)
+from .table_activity import (get_table_activity, get_stored_table_activity,
+                             put_stored_table_activity, has_activity,
+                             table_has_changes)
+from .snapshot_policy import (get_snapshot_state, put_snapshot_state,
+                              snapshot_due, record_snapshots)
+from .parallel_capture import (export_snapshot, order_tables_by_size,
+                               capture_tables_in_parallel)
+from .warm_state import get_connection, release_connection, get_catalog
+from .table_registry import (get_table_registry, is_due, is_excluded,
+                             DEFAULT_TOLERANCE)
+from .fan_out import (plan_key_ranges, plan_shards, put_parts_manifest,
+                      LocalExecutor, LambdaExecutor, DEFAULT_MAX_SHARDS,
+                      DEFAULT_ROWS_PER_SHARD)
+from .run_schedule import (RunBudget, DEFAULT_DEADLINE_MARGIN,
+                           get_checkpoints, put_checkpoints,
+                           expected_duration, order_tables_by_cost,
+                           table_window_start, record_checkpoint,
+                           mark_pending)
+from .logical_replication import (get_current_lsn, open_change_stream,
+                                  read_changes, close_change_stream,
+                                  confirm_changes, write_logical_changes,
+                                  DEFAULT_SLOT, DEFAULT_PLUGIN,
+                                  DEFAULT_PUBLICATION, DEFAULT_STREAM_TIMEOUT)
 
 import psycopg2
-import re
+from psycopg2.pool import ThreadedConnectionPool
+import os
+import time
 from botocore.exceptions import ClientError
+from datetime import datetime, timedelta, timezone
 import logging
 
 logger = logging.getLogger('MyLogger')
 logger.setLevel(logging.INFO)
 
+ENGINES = ('fetchall', 'stream', 'copy', 'async')
+UPLOADS = ('file', 'multipart')
+CSV_DIRECTORY = '/tmp/csv_files'
+
+
+def query_batches(connection, cursor, query, tablename,
+                  engine='fetchall', fetch_size=DEFAULT_FETCH_SIZE):
+    """
+    Run a query and yield its rows in batches, the first batch
+    starting with the cursor's description.
+
+    Args:
+        connection (psycopg2 connection): An open database connection.
+        cursor (psycopg2 cursor): A cursor of that connection, used by
+        the "fetchall" engine.
+        query (str): The SQL query to execute.
+        tablename (str): The name of the file the rows are for.
+        engine (str): The extraction engine, "fetchall" or "stream".
+        fetch_size (int): The batch size used by the "stream" engine.
+
+    Yields:
+        list of tuples: The rows of each batch.
+
+    Raises:
+        ValueError: If the engine is not "fetchall" or "stream".
+    """
+    if engine == 'stream':
+        yield from iter_query_batches(connection, query,
+                                      f'{tablename}_stream', fetch_size,
+                                      describe=True)
+        return
+
+    if engine != 'fetchall':
+        raise ValueError(f"Unknown extraction engine: {engine}")
+
+    cursor.execute(query)
+    table = cursor.fetchall()
+    table.insert(0, cursor.description)
+    yield table
+
+
+def write_query_to_file(connection, cursor, query, tablename,
+                        engine='fetchall', fetch_size=DEFAULT_FETCH_SIZE,
+                        file_format='csv', compression=None,
+                        row_group_size=DEFAULT_ROW_GROUP_SIZE, timer=None):
+    """
+    Run a query and write its result to a '<tablename>.<file_format>'
+    file in '/tmp/csv_files'.
+
+    Args:
+        connection (psycopg2 connection): An open database connection.
+        cursor (psycopg2 cursor): A cursor of that connection, used by
+        the "fetchall" engine.
+        query (str): The SQL query to execute.
+        tablename (str): The name of the file (without extension).
+        engine (str): The extraction engine, "fetchall" or "stream".
+        fetch_size (int): The batch size used by the "stream" engine.
+        file_format (str): The output format, one of FORMATS.
+        compression (str): "gzip" or "zstd" to compress the file.
+        row_group_size (int): The rows of each Parquet row group.
+        timer (PhaseTimer): Times the phases of the extraction.
+
+    Returns:
+        CountingWriter: The rows, bytes and checksum of the file.
+
+    Raises:
+        ValueError: If the engine is not "fetchall" or "stream", or the
+        format is not one of FORMATS.
+    """
+    os.makedirs(CSV_DIRECTORY, exist_ok=True)
+    file_path = os.path.join(CSV_DIRECTORY, f'{tablename}.{file_format}')
+    with open(file_path, 'wb') as file:
+        writer = TableWriter(file, file_format, compression, row_group_size)
+        write_query_to_stream(connection, cursor, query, tablename, writer,
+                              engine, fetch_size, timer)
+    return writer.counter
+
+
+def write_query_to_stream(connection, cursor, query, tablename, writer,
+                          engine='fetchall', fetch_size=DEFAULT_FETCH_SIZE,
+                          timer=None):
+    """
+    Run a query and encode its result, headed by its columns, with a
+    TableWriter.
+
+    Args:
+        connection (psycopg2 connection): An open database connection.
+        cursor (psycopg2 cursor): A cursor of that connection, used by
+        the "fetchall" engine.
+        query (str): The SQL query to execute.
+        tablename (str): The name of the file the rows are for.
+        writer (TableWriter): The writer of the file or upload.
+        engine (str): The extraction engine, "fetchall" or "stream".
+        fetch_size (int): The batch size used by the "stream" engine.
+        timer (PhaseTimer): Times the phases of the extraction: the
+        first batch as "query", the others as "fetch", and the encoding
+        as "serialize".
+
+    Returns:
+        int: The number of rows written (not counting the header).
+
+    Raises:
+        ValueError: If the engine is not "fetchall" or "stream".
+    """
+    timer = timer or PhaseTimer()
+    batches = query_batches(connection, cursor, query, tablename, engine,
+                            fetch_size)
+    phase = 'query'
+    while True:
+        with timer.phase(phase):
+            batch = next(batches, None)
+        if batch is None:
+            break
+        with timer.phase('serialize'):
+            if phase == 'query':
+                writer.writeheader(batch[0])
+                batch = batch[1:]
+            writer.writerows(batch)
+        phase = 'fetch'
+    with timer.phase('serialize'):
+        writer.close()
+    return writer.counter.rows
+
+
+def table_query(table_name, row_filter='', columns=None, op_window=None):
+    """
+    Build the query extracting the rows of a table.
+
+    Args:
+        table_name (str): The name of the table.
+        row_filter (str): An optional WHERE clause.
+        columns (list of str): The columns to extract, all by default.
+        op_window (tuple): The (start, end) of the change window, to add
+        the "op" column of a change file.
+
+    Returns:
+        str: The query.
+    """
+    selected = select_list(columns)
+    if op_window:
+        selected += f', {op_column(*op_window)}'
+    return f'''SELECT {selected}
+    FROM {table_name}
+    {row_filter};'''
+
+
+def capture_table_file(connection, cursor, table_name, file_stem,
+                       row_filter='', engine='fetchall',
+                       fetch_size=DEFAULT_FETCH_SIZE, upload='file',
+                       part_size=DEFAULT_PART_SIZE,
+                       max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                       compression=None, file_format='csv',
+                       row_group_size=DEFAULT_ROW_GROUP_SIZE, key=None,
+                       timer=None, op_window=None, columns=None):
+    """
+    Extract the rows of a table matching a filter and upload them to
+    the ingestion bucket as '<file_stem>.<file_format>' or a given key.
+
+    Args:
+        connection (psycopg2 connection): An open database connection.
+        cursor (psycopg2 cursor): A cursor of that connection.
+        table_name (str): The name of the table to extract.
+        file_stem (str): The name of the file (without extension).
+        row_filter (str): An optional WHERE clause.
+        engine (str): The extraction engine, one of ENGINES.
+        fetch_size (int): The batch size used by the "stream" engine.
+        upload (str): "file" to write the file to /tmp and upload it
+        afterwards, or "multipart" to upload it while it is encoded.
+        The "copy" and "async" engines always upload while extracting.
+        part_size (int): The size of the multipart upload parts.
+        max_in_flight (int): The number of parts uploading at a time.
+        compression (str): "gzip" or "zstd" to compress the object.
+        file_format (str): The output format, one of FORMATS.
+        row_group_size (int): The rows of each Parquet row group.
+        key (str): The key of the object, the file name by default.
+        timer (PhaseTimer): Times the phases of the extraction.
+        op_window (tuple): The (start, end) of the change window, to add
+        the "op" column of a change file.
+        columns (list of str): The columns to extract, all by default.
+
+    Returns:
+        CountingWriter: The rows, bytes and checksum of the file,
+        counted while it was written.
+
+    Raises:
+        ValueError: If the engine is not one of ENGINES, the upload is
+        not one of UPLOADS, the format not one of FORMATS (or "parquet"
+        with the "copy" engine) or the compression not one of
+        COMPRESSIONS.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown extraction engine: {engine}")
+    if upload not in UPLOADS:
+        raise ValueError(f"Unknown upload method: {upload}")
+    if file_format not in FORMATS:
+        raise ValueError(f"Unknown output format: {file_format}")
+
+    timer = timer or PhaseTimer()
+    extra_select = op_column(*op_window) if op_window else ''
+    if engine == 'copy':
+        if file_format != 'csv':
+            raise ValueError("The copy engine only writes CSV")
+        return copy_table_to_s3(connection, table_name,
+                                key or f'{file_stem}.csv', row_filter,
+                                part_size, max_in_flight, compression,
+                                timer, extra_select, columns)
+
+    query = table_query(table_name, row_filter, columns, op_window)
+    file_name = f'{file_stem}.{file_format}'
+    key = key or file_name
+
+    if engine == 'async':
+        # A file on its own still fetches while it uploads
+        [result] = capture_files_async(
+            [file_job(table_name, key, query, file_format=file_format,
+                      compression=compression,
+                      row_group_size=row_group_size, part_size=part_size,
+                      max_in_flight=max_in_flight)],
+            connection, fetch_size=fetch_size)
+        for phase, seconds in result['timer'].seconds.items():
+            timer.seconds[phase] += seconds
+        if result['error'] is not None:
+            raise result['error']
+        return result['counter']
+
+    extra_args = object_args(file_format, compression)
+
+    if upload == 'multipart':
+        # Starting and completing the upload, and writes waiting for a
+        # free part, count as the upload
+        with timer.phase('upload'), \
+                S3MultipartWriter(key, part_size=part_size,
+                                  max_in_flight=max_in_flight,
+                                  extra_args=extra_args) as stream:
+            writer = TableWriter(TimedWriter(stream, timer), file_format,
+                                 compression, row_group_size)
+            write_query_to_stream(connection, cursor, query, file_stem,
+                                  writer, engine, fetch_size, timer)
+        print(f"The file {key} was uploaded")
+        return writer.counter
+
+    counter = write_query_to_file(connection, cursor, query, file_stem,
+                                  engine, fetch_size, file_format,
+                                  compression, row_group_size, timer)
+    with timer.phase('upload'):
+        push_data_in_bucket(f'{CSV_DIRECTORY}/', file_name, extra_args, key)
+    return counter
+
+
+def capture_shard(connection, cursor, shard):
+    """
+    Write the part file of one key range of a table, as a fan-out
+    worker.
+
+    Args:
+        connection (psycopg2 connection): An open database connection.
+        cursor (psycopg2 cursor): A cursor of that connection.
+        shard (dict): The shard, from `plan_shards`.
+
+    Returns:
+        dict: The run manifest entry of the part file.
+    """
+    start = time.perf_counter()
+    timer = PhaseTimer()
+    counter = capture_table_file(connection, cursor, shard['table_name'],
+                                 shard['file_stem'], shard['row_filter'],
+                                 key=shard['key'], timer=timer,
+                                 **shard['options'])
+    entry = file_entry(shard['table_name'], shard['key'], None,
+                       shard['run_timestamp'], counter,
+                       time.perf_counter() - start)
+    emit_file_metrics(entry, timer)
+    return entry
+
+
+def capture_table_in_shards(cursor, table_name, file_stem, upper_bound,
+                            layout, options, executor,
+                            max_shards=DEFAULT_MAX_SHARDS,
+                            rows_per_shard=DEFAULT_ROWS_PER_SHARD):
+    """
+    Write the full content of a table as part files, one per primary
+    key range, and the completion manifest listing them.
+
+    Args:
+        cursor (psycopg2 cursor): A database cursor, used to plan the
+        ranges.
+        table_name (str): The name of the table.
+        file_stem (str): The name of the file.
+        upper_bound (str): The timestamp of the run.
+        layout (str): The object layout.
+        options (dict): The keyword arguments of `capture_table_file`
+        for every part.
+        executor: A LocalExecutor or LambdaExecutor.
+        max_shards (int): The largest number of parts.
+        rows_per_shard (int): The rows each part should hold.
+
+    Returns:
+        list of dict: The run manifest entries of the parts, each with
+        the key of the completion manifest as "parts_manifest".
+    """
+    primary_key, ranges = plan_key_ranges(cursor, table_name,
+                                          rows_per_shard, max_shards)
+    shards = plan_shards(table_name, file_stem, primary_key, ranges,
+                         upper_bound, options.get('file_format', 'csv'),
+                         layout, options)
+    entries = executor.map(shards)
+    manifest = put_parts_manifest(table_name, file_stem, upper_bound,
+                                  layout, shards, entries)
+    logger.info(f'Wrote {file_stem} in {len(shards)} parts: {manifest}')
+    for entry in entries:
+        entry['parts_manifest'] = manifest
+    return entries
+
+
+def make_fan_out_executor(event, context, connection_details):
+    """
+    Create the executor of the fan-out workers, following the
+    "fan_out_executor" option: "lambda" (the default in AWS Lambda)
+    invokes this function for every part, "local" writes the parts in
+    threads of this invocation.
+
+    Args:
+        event: Event data passed to the lambda, holding the options.
+        context: The AWS Lambda context.
+        connection_details (dict): The arguments of psycopg2.connect.
+
+    Returns:
+        A LambdaExecutor or LocalExecutor.
+    """
+    workers = get_capture_option(event, 'fan_out_workers',
+                                 default=DEFAULT_MAX_SHARDS)
+    default = 'lambda' if hasattr(context, 'function_name') else 'local'
+    if get_capture_option(event, 'fan_out_executor',
+                          default=default) == 'lambda':
+        return LambdaExecutor(context.function_name, workers)
+
+    def capture_local_shard(shard):
+        connection = psycopg2.connect(**connection_details)
+        try:
+            cursor = connection.cursor()
+            return capture_shard(connection, cursor, shard)
+        finally:
+            connection.close()
+
+    return LocalExecutor(capture_local_shard, workers)
+
+
+def capture_shard_event(shard):
+    """
+    Handle the invocation of a fan-out worker.
+
+    Args:
+        shard (dict): The "fan_out_shard" of the event.
+
+    Returns:
+        dict: The run manifest entry of the part file, returned to the
+        coordinator.
+    """
+    connection = get_connection(
+        connection_details_from(retrieve_secret_details("Totesys-Access")))
+    cursor = connection.cursor()
+    try:
+        return capture_shard(connection, cursor, shard)
+    finally:
+        cursor.close()
+        release_connection(connection)
+
+
+def connection_details_from(db_login_deets):
+    """
+    Build the arguments of psycopg2.connect from the database secret.
+    """
+    return {
+        'host': db_login_deets['host'],
+        'port': int(db_login_deets['port']),
+        'database': db_login_deets['database'],
+        'user': db_login_deets['username'],
+        'password': db_login_deets['password']
+    }
+
+
+def log_file_entry(entry):
+    """
+    Log the number of rows and bytes of an uploaded file.
+
+    Args:
+        entry (dict): The run manifest entry of the file.
+
+    Returns:
+        None
+    """
+    logger.info(f"Number of changes made to {entry['file']}: "
+                f"{entry['rows']} ({entry['bytes']} bytes)")
+
+
+def capture_table(connection, cursor, table_name, change_filter,
+                  upper_bound, event, full_snapshot=True, lower_bound=None,
+                  entries=None, logical_changes=None, executor=None,
+                  pipeline=None):
+    """
+    Extract the changes and the full content of a table and upload
+    them as '<table_name>_changes.csv' and '<table_name>.csv' (and its
+    deleted keys as '<table_name>_deletes.csv' with the "key_diff"
+    delete detection), or under partitioned keys with the "partitioned"
+    layout.
+
+    Args:
+        connection (psycopg2 connection): An open database connection.
+        cursor (psycopg2 cursor): A cursor of that connection.
+        table_name (str): The name of the table to extract.
+        change_filter (str): The WHERE clause selecting changed rows.
+        upper_bound (str): The timestamp of the run, the end of the
+        change window.
+        event: Event data passed to the lambda, holding the options.
+        full_snapshot (bool): False to only extract the changes.
+        lower_bound (str): The start of the change window.
+        entries (list): A list the run manifest entries of the
+        uploaded files are appended to.
+        logical_changes (list of Change): The changes of the table read
+        from the replication slot, for the "logical" change capture.
+        executor: The fan-out executor writing the full content of a
+        table with the "fan_out" option in parts.
+        pipeline (list): A list the jobs of the files of the "async"
+        engine are appended to, for the run to extract them together;
+        without it they are extracted here.
+
+    Returns:
+        bool: True if every file of the table was uploaded, or queued
+        in the pipeline.
+
+    Raises:
+        psycopg2.Error: If a query fails.
+    """
+    engine = get_capture_option(event, 'engine', table_name, 'fetchall')
+    fetch_size = get_capture_option(
+        event, 'fetch_size', table_name, DEFAULT_FETCH_SIZE)
+    change_capture = get_capture_option(
+        event, 'change_capture', table_name, 'window')
+    compression = get_capture_option(event, 'compression', table_name)
+    file_format = get_capture_option(event, 'format', table_name, 'csv')
+    row_group_size = get_capture_option(
+        event, 'row_group_size', table_name, DEFAULT_ROW_GROUP_SIZE)
+    layout = get_capture_option(event, 'layout', table_name, 'root')
+    if layout not in LAYOUTS:
+        logger.error(f'Unknown layout for {table_name}: {layout}')
+        return False
+    delete_detection = get_capture_option(event, 'delete_detection',
+                                          table_name)
+    if delete_detection not in (None, 'key_diff'):
+        logger.error(f'Unknown delete detection for {table_name}: '
+                     f'{delete_detection}')
+        return False
+
+    if entries is None:
+        entries = []
+
+    # The columns used downstream, with the key and watermark columns
+    columns = project_columns(cursor, table_name,
+                              get_column_contract(event, table_name))
+
+    if change_capture == 'keyset':
+        timer = PhaseTimer()
+        try:
+            entry = capture_changes_by_keyset(
+                connection, cursor, table_name, upper_bound,
+                get_capture_option(event, 'keyset_chunk_size',
+                                   table_name, DEFAULT_CHUNK_SIZE),
+                get_capture_option(event, 'keyset_max_chunks',
+                                   table_name, DEFAULT_MAX_CHUNKS),
+                compression, file_format, row_group_size,
+                object_key(f'{table_name}_changes', file_format,
+                           upper_bound, layout), timer, columns)
+        except Exception as e:
+            # The table keeps its watermark and is retried next run
+            logger.error(f'Error extracting {table_name} changes: {e}')
+            connection.rollback()
+            return False
+        log_file_entry(entry)
+        emit_file_metrics(entry, timer)
+        entries.append(entry)
+        files = ()
+    elif change_capture == 'logical':
+        try:
+            logical_entries = write_logical_changes(
+                cursor, table_name, logical_changes or [], lower_bound,
+                upper_bound, compression, file_format, row_group_size,
+                object_key(f'{table_name}_changes', file_format,
+                           upper_bound, layout),
+                object_key(f'{table_name}_deletes', file_format,
+                           upper_bound, layout))
+        except Exception as e:
+            # The slot is not advanced, so the changes are read again
+            logger.error(f'Error writing {table_name} changes: {e}')
+            connection.rollback()
+            return False
+        for entry in logical_entries:
+            log_file_entry(entry)
+            emit_file_metrics(entry)
+        entries.extend(logical_entries)
+        files = ()
+    else:
+        files = ((f'{table_name}_changes', change_filter, lower_bound),)
+
+    if full_snapshot:
+        files += ((table_name, '', None),)
+
+    captured = True
+    output_options = {
+        'upload': get_capture_option(event, 'upload', table_name, 'file'),
+        'part_size': get_capture_option(
+            event, 'part_size', table_name, DEFAULT_PART_SIZE),
+        'max_in_flight': get_capture_option(
+            event, 'max_in_flight_parts', table_name, DEFAULT_MAX_IN_FLIGHT),
+        'compression': compression,
+        'file_format': file_format,
+        'row_group_size': row_group_size,
+        'columns': columns
+    }
+
+    max_shards = get_capture_option(event, 'fan_out', table_name)
+
+    for file_stem, row_filter, window_start in files:
+        try:
+            start = time.perf_counter()
+            if max_shards and executor is not None and not row_filter:
+                file_entries = capture_table_in_shards(
+                    cursor, table_name, file_stem, upper_bound, layout,
+                    dict(output_options, engine=engine,
+                         fetch_size=fetch_size),
+                    executor, max_shards,
+                    get_capture_option(event, 'rows_per_shard', table_name,
+                                       DEFAULT_ROWS_PER_SHARD))
+            elif engine == 'async' and pipeline is not None:
+                # The run extracts the file and records its entry
+                op_window = (window_start, upper_bound) \
+                    if window_start is not None else None
+                query = table_query(table_name, row_filter, columns,
+                                    op_window)
+                driver = get_capture_option(event, 'async_driver',
+                                            default=default_driver())
+                pipeline.append(file_job(
+                    table_name,
+                    object_key(file_stem, file_format, upper_bound, layout),
+                    query, window_start, upper_bound, file_format,
+                    compression, row_group_size,
+                    output_options['part_size'],
+                    output_options['max_in_flight'],
+                    describe_query(cursor, query)
+                    if driver == 'asyncpg' else None))
+                file_entries = []
+            else:
+                # Each part of a fan-out emits its own metrics
+                key = object_key(file_stem, file_format, upper_bound, layout)
+                timer = PhaseTimer()
+                op_window = (window_start, upper_bound) \
+                    if window_start is not None else None
+                counter = capture_table_file(connection, cursor, table_name,
+                                             file_stem, row_filter, engine,
+                                             fetch_size, key=key,
+                                             timer=timer, op_window=op_window,
+                                             **output_options)
+                entry = file_entry(table_name, key, window_start,
+                                   upper_bound, counter,
+                                   time.perf_counter() - start)
+                emit_file_metrics(entry, timer)
+                file_entries = [entry]
+            for entry in file_entries:
+                log_file_entry(entry)
+            entries.extend(file_entries)
+        except psycopg2.Error as e:
+            logger.critical(f'Query error: {e}')
+            raise e
+        except FileNotFoundError:
+            logger.error(f'File {file_stem}.{file_format} not found')
+            captured = False
+        except ClientError as e:
+            logger.error(f'Client error: {e}')
+            captured = False
+        except Exception:
+            logger.exception(f'Error writing {file_stem}.{file_format}')
+            captured = False
+
+    # The replication slot already reports the deletes of logical tables
+    if captured and delete_detection == 'key_diff' \
+            and change_capture != 'logical':
+        try:
+            entry = capture_deletes_by_key_diff(
+                connection, cursor, table_name, lower_bound, upper_bound,
+                compression, file_format, row_group_size,
+                object_key(f'{table_name}_deletes', file_format,
+                           upper_bound, layout))
+        except Exception as e:
+            # The key set is kept, so the deletes are found next run
+            logger.error(f'Error detecting {table_name} deletes: {e}')
+            connection.rollback()
+            return False
+        log_file_entry(entry)
+        emit_file_metrics(entry)
+        entries.append(entry)
+
+    return captured
+
+
+def capture_async_jobs(connection, connection_details, jobs, event, budget,
+                       checkpoints, entries, captured_tables, durations):
+    """
+    Extract the files of the "async" engine queued by `capture_table`,
+    and record which of their tables were captured.
+
+    Args:
+        connection (psycopg2 connection): An open database connection.
+        connection_details (dict): The arguments of psycopg2.connect.
+        jobs (list of dict): The files, from `file_job`.
+        event: Event data passed to the lambda, holding the options.
+        budget (RunBudget): The time left to the run.
+        checkpoints (dict): The checkpoints of the tables.
+        entries (list): A list the run manifest entries of the
+        uploaded files are appended to.
+        captured_tables (list of str): The tables captured by the run; a
+        table with a file that failed or was not started is removed.
+        durations (dict): The seconds taken by each captured table.
+
+    Returns:
+        None
+
+    Raises:
+        ValueError: If an option of the pipeline is invalid.
+        psycopg2.Error or asyncpg.PostgresError: If a query fails.
+    """
+    results = capture_files_async(
+        jobs, connection, connection_details,
+        get_capture_option(event, 'async_driver', default=default_driver()),
+        get_capture_option(event, 'fetch_size', default=DEFAULT_FETCH_SIZE),
+        get_capture_option(event, 'queue_depth',
+                           default=DEFAULT_QUEUE_DEPTH),
+        lambda table_name: budget.can_start(
+            expected_duration(checkpoints, table_name)))
+
+    extracted = set()
+    failed = set()
+    for result in results:
+        job = result['job']
+        table_name = job['table_name']
+        extracted.add(table_name)
+        if result['error'] is not None:
+            failed.add(table_name)
+            continue
+        entry = file_entry(table_name, job['key'], job['window_start'],
+                           job['upper_bound'], result['counter'],
+                           result['duration'])
+        emit_file_metrics(entry, result['timer'])
+        log_file_entry(entry)
+        entries.append(entry)
+        durations[table_name] = durations.get(table_name, 0) \
+            + result['duration']
+
+    # Tables left out for lack of time are pending, like failed ones
+    for table_name in {job['table_name'] for job in jobs}:
+        if table_name in failed or table_name not in extracted:
+            durations.pop(table_name, None)
+            if table_name in captured_tables:
+                captured_tables.remove(table_name)
+
+
+def select_changed_tables(cursor, table_names, change_filters, upper_bound,
+                          event, logical_changes=None):
+    """
+    Drop the tables with no changes from the list of tables to extract,
+    following the "skip_unchanged" option of each table.
+
+    Args:
+        cursor (psycopg2 cursor): A database cursor.
+        table_names (list of str): The tables to extract.
+        change_filters (dict): The WHERE clause selecting the changed
+        rows of each table.
+        upper_bound (str): The timestamp of the run.
+        event: Event data passed to the lambda, holding the options.
+        logical_changes (dict): The changes read from the replication
+        slot by table name; a "logical" table without any is unchanged.
+
+    Returns:
+        tuple: (list of the tables to extract, dict of the current
+        activity counters by table name, or None if no table uses the
+        "stats" check).
+    """
+    checks = {table_name: get_capture_option(
+        event, 'skip_unchanged', table_name) for table_name in table_names}
+
+    activity = None
+    if 'stats' in checks.values():
+        activity = get_table_activity(cursor)
+        stored = get_stored_table_activity()
+
+    changed = []
+    for table_name in table_names:
+        change_capture = get_capture_option(
+            event, 'change_capture', table_name, 'window')
+        if checks[table_name] and change_capture == 'logical':
+            is_changed = table_name in (logical_changes or {})
+        elif checks[table_name] == 'stats':
+            is_changed = has_activity(table_name, activity, stored)
+        elif checks[table_name] == 'exists':
+            if change_capture == 'keyset':
+                is_changed = has_changes_by_keyset(cursor, table_name,
+                                                   upper_bound)
+            else:
+                is_changed = table_has_changes(
+                    cursor, table_name, change_filters[table_name])
+        else:
+            is_changed = True
+
+        if is_changed:
+            changed.append(table_name)
+        else:
+            logger.info(f'Skipping unchanged table {table_name}')
+
+    return changed, activity
+
+
+def clean_run_timestamp(run_timestamp):
+    """
+    Remove the brackets earlier runs stored around their timestamp,
+    e.g. '[2022-11-03 14:20:49.962]' becomes '2022-11-03 14:20:49.962'.
+    """
+    return run_timestamp.strip('[]')
+
+
+def update_checkpoints(checkpoints, all_tables, table_names, durations,
+                       manifest_entries, window_starts, upper_bound, event):
+    """
+    Record the end of the change window every due table stored.
+
+    A table skipped on its "stats" counters keeps the start of its
+    window: the counters are flushed about once a second, so a change
+    committed just before the run may not have been counted yet, and it
+    is read by the next run instead of being passed over.
+
+    Args:
+        checkpoints (dict): The checkpoints by table name, updated in
+        place.
+        all_tables (list of str): The tables due in this run.
+        table_names (list of str): The tables found changed.
+        durations (dict): The seconds of every table extracted.
+        manifest_entries (list of dict): The files of the run.
+        window_starts (dict): The start of each table's change window.
+        upper_bound (str): The timestamp of the run.
+        event: Event data passed to the lambda, holding the options.
+
+    Returns:
+        None
+    """
+    for table_name in all_tables:
+        if table_name in durations:
+            record_checkpoint(checkpoints, table_name, upper_bound,
+                              durations[table_name],
+                              sum(entry['rows']
+                                  for entry in manifest_entries
+                                  if entry['table'] == table_name))
+        elif table_name in table_names:
+            mark_pending(checkpoints, table_name,
+                         window_starts[table_name])
+        elif get_capture_option(event, 'skip_unchanged',
+                                table_name) == 'stats' \
+                and get_capture_option(event, 'change_capture', table_name,
+                                       'window') != 'logical':
+            checkpoints.setdefault(table_name, {}).update(
+                window_end=window_starts[table_name], pending=False)
+        else:
+            # Skipped as unchanged: its window is read up to this run
+            checkpoints.setdefault(table_name, {}).update(
+                window_end=upper_bound, pending=False)
+
 
 def postgres_data_capture(event, context):
     """
@@ -53,10 +1036,15 @@ def postgres_data_capture(event, context):
     Returns:
         None
     """
+    if isinstance(event, dict) and 'fan_out_shard' in event:
+        return capture_shard_event(event['fan_out_shard'])
+
     try:
+        run_start = time.perf_counter()
         param_store = "postgres-datetime.txt"
         try:
-            old_datetime = get_s3_timestamp(param_store)
+            old_datetime = clean_run_timestamp(
+                get_s3_timestamp(param_store))
         except Exception as e:
             logger.error(e)
             raise e  # want to stop the program right now
@@ -67,128 +1055,256 @@ def postgres_data_capture(event, context):
 
             if e.response['Error']['Code'] == 'DecryptionFailure':
                 logger.error(
-                    "The requested secret can't be decrypted:", e)
+                    f"The requested secret can't be decrypted: {e}")
             elif e.response['Error']['Code'] == 'InternalServiceError':
-                logger.error('An error occurred on service side:', e)
+                logger.error(f'An error occurred on service side: {e}')
             else:
-                logger.error('Database credentials could not be retrieved:', e)
+                logger.error(
+                    f'Database credentials could not be retrieved: {e}')
             raise e
 
+        connection_details = connection_details_from(db_login_deets)
         try:
-            connection = psycopg2.connect(
-                host=db_login_deets['host'],
-                port=int(db_login_deets['port']),
-                database=db_login_deets['database'],
-                user=db_login_deets['username'],
-                password=db_login_deets['password']
-            )
+            connection = get_connection(connection_details)
             logger.info('Connected to Totesys database...')
 
         except psycopg2.Error as e:
 
-            logger.error('Unable to connect to the database:', e)
+            logger.error(f'Unable to connect to the database: {e}')
 
             raise e
 
+        workers = get_capture_option(event, 'workers', default=1)
+
+        # The snapshot must be exported before any other query
+        if workers > 1:
+            snapshot_id = export_snapshot(connection)
+
         # Create a cursor object to execute SQL queries
         cursor = connection.cursor()
 
         # Get current datetime
         datetime_query = "SELECT TO_CHAR(NOW(), 'YYYY-MM-DD HH24:MI:SS.MS');"
         cursor.execute(datetime_query)
-        current_datetime = str(cursor.fetchall())
-        current_datetime = re.sub(r"[,()']", "", current_datetime)
-
-        # SQL query to fetch all records from a table
-        query = '''SELECT table_name
-        FROM information_schema.tables
-        WHERE table_schema = 'public';'''
-        # Execute the query
-        cursor.execute(query)
-
-        # Fetch all records
-        table_list = cursor.fetchall()
-
-        for table_items in table_list:
-            table_name = str(table_items)
-
-            if table_name != "('_prisma_migrations',)":
-                # replace "(" or ")" with ""
-                table_name = re.sub(r"[,()']", "", table_name)
-
-                table_query = f'''SELECT *
-                FROM {table_name}
-                WHERE created_at
-                BETWEEN timestamp '{old_datetime}'
-                AND timestamp '{current_datetime}'
-                OR last_updated
-                BETWEEN timestamp '{old_datetime}'
-                AND timestamp '{current_datetime}';'''
-
-                full_table_query = f'''SELECT *
-                FROM {table_name};'''
-
-                try:
-                    cursor.execute(table_query)
-                except Exception as e:
-                    logger.critical('Query error:', e)
-
-                table_changes = cursor.fetchall()
-                columns = []
-                for col in cursor.description:
-                    columns.append(col[0])
-                table_changes.insert(0, tuple(columns))
-
-                try:
-                    write_table_to_csv(table_changes, f'{table_name}_changes')
-                except Exception:
-                    logger.error(f'Error writing {table_name}_changes.csv')
-
-                try:
-                    push_data_in_bucket('/tmp/csv_files/',
-                                        f'{table_name}_changes.csv')
-                except FileNotFoundError:
-                    logger.error(f'File {table_name}_changes.csv not found')
-                except ClientError as e:
-                    logger.error('Client error:', e)
-
-                try:
-                    cursor.execute(full_table_query)
-                except Exception as e:
-                    logger.critical('Query error:', e)
-
-                full_table = cursor.fetchall()
-                columns = []
-                for col in cursor.description:
-                    columns.append(col[0])
-                full_table.insert(0, tuple(columns))
-
-                try:
-                    write_table_to_csv(full_table, table_name)
-                except Exception:
-                    logger.error(f'Error writing {table_name}.csv')
-
-                try:
-                    push_data_in_bucket('/tmp/csv_files/', f'{table_name}.csv')
-                except FileNotFoundError:
-                    logger.error(f'File {table_name}.csv not found')
-                except ClientError as e:
-                    logger.error('Client error:', e)
-
-        # Close connections
+        current_datetime = cursor.fetchone()[0]
+
+        # The tables and their schema fingerprints, cached while warm
+        table_names, fingerprints = get_catalog(cursor)
+        registry = get_table_registry(event)
+
+        # A diagnostic run only reports how the change queries are served
+        if get_capture_option(event, 'index_report', default=False):
+            report = index_report(
+                cursor, [table_name for table_name in table_names
+                         if not is_excluded(registry, table_name)],
+                old_datetime, current_datetime)
+            logger.info(f'Change query index report: {report}')
+            cursor.close()
+            release_connection(connection)
+            return report
+
+        # Only the tables whose tier is due are extracted by this run;
+        # the slot cannot hold back changes, so logical tables always are
+        checkpoints = get_checkpoints()
+        for checkpoint in checkpoints.values():
+            if checkpoint.get('window_end'):
+                checkpoint['window_end'] = clean_run_timestamp(
+                    checkpoint['window_end'])
+        tolerance = timedelta(seconds=get_capture_option(
+            event, 'schedule_tolerance',
+            default=DEFAULT_TOLERANCE.total_seconds()))
+        table_names = [
+            table_name for table_name in table_names
+            if not is_excluded(registry, table_name)
+            and (is_due(registry, table_name, checkpoints, current_datetime,
+                        tolerance)
+                 or get_capture_option(event, 'change_capture', table_name,
+                                       'window') == 'logical')]
+
+        # Each table reads its changes from the end of the last window
+        # it stored, which is the last run unless it was left pending
+        window_starts = {
+            table_name: table_window_start(checkpoints, table_name,
+                                           old_datetime)
+            for table_name in table_names}
+        run_time = datetime.now(timezone.utc)
+        dry_run = get_capture_option(event, 'dry_run', default=False)
+        change_filters = choose_change_filters(
+            cursor, table_names, window_starts, current_datetime, event,
+            fingerprints, run_time, store_plans=not dry_run)
+
+        # A dry run only estimates the run from the planner's statistics
+        if dry_run:
+            snapshot_state = get_snapshot_state()
+            snapshot_tables = [
+                table_name for table_name in table_names
+                if snapshot_due(table_name,
+                                get_capture_option(event, 'snapshot_policy',
+                                                   table_name, 'always'),
+                                snapshot_state, run_time, fingerprints,
+                                get_capture_option(event, 'force_snapshot',
+                                                   table_name, False),
+                                tolerance)]
+            margin = get_capture_option(event, 'deadline_margin',
+                                        default=DEFAULT_DEADLINE_MARGIN)
+            budget_seconds = RunBudget(context, margin).remaining()
+            if budget_seconds is None:
+                budget_seconds = get_capture_option(
+                    event, 'time_budget',
+                    default=DEFAULT_TIME_BUDGET) - margin
+            report = estimate_run(cursor, table_names, change_filters,
+                                  snapshot_tables, event, checkpoints,
+                                  round(budget_seconds, 3))
+            logger.info(f'Dry run estimate: {report}')
+            cursor.close()
+            release_connection(connection)
+            return report
+
+        budget = RunBudget(context, get_capture_option(
+            event, 'deadline_margin', default=DEFAULT_DEADLINE_MARGIN))
+
+        # The replication slot is read once for every "logical" table
+        logical_tables = [
+            table_name for table_name in table_names
+            if get_capture_option(event, 'change_capture',
+                                  table_name, 'window') == 'logical']
+        logical_changes, logical_lsn = {}, None
+        slot = get_capture_option(event, 'replication_slot',
+                                  default=DEFAULT_SLOT)
+        if logical_tables:
+            plugin = get_capture_option(event, 'decoding_plugin',
+                                        default=DEFAULT_PLUGIN)
+            target_lsn = get_current_lsn(cursor)
+            stream = open_change_stream(
+                connection_details, slot, plugin,
+                get_capture_option(event, 'publication',
+                                   default=DEFAULT_PUBLICATION))
+            # At most half the time left is spent waiting on the stream
+            stream_timeout = DEFAULT_STREAM_TIMEOUT
+            if budget.remaining() is not None:
+                stream_timeout = min(stream_timeout,
+                                     max(budget.remaining() / 2, 0))
+            try:
+                logical_changes, logical_lsn = read_changes(
+                    stream, target_lsn, plugin, stream_timeout)
+            finally:
+                close_change_stream(stream)
+
+        all_tables = table_names
+        table_names, activity = select_changed_tables(
+            cursor, table_names, change_filters, current_datetime, event,
+            logical_changes)
+
+        snapshot_state = get_snapshot_state()
+        snapshot_tables = [
+            table_name for table_name in table_names
+            if snapshot_due(table_name,
+                            get_capture_option(event, 'snapshot_policy',
+                                               table_name, 'always'),
+                            snapshot_state, run_time, fingerprints,
+                            get_capture_option(event, 'force_snapshot',
+                                               table_name, False),
+                            tolerance)]
+
+        captured_tables = []
+        manifest_entries = []
+        durations = {}
+        executor = make_fan_out_executor(event, context, connection_details)
+        # The files of the "async" engine, extracted after the loop
+        async_jobs = [] if workers == 1 else None
+
+        def capture(connection, cursor, table_name):
+            if not budget.can_start(expected_duration(checkpoints,
+                                                      table_name)):
+                logger.warning(f'Not enough time left for {table_name}; '
+                               'it is left for the next run')
+                return
+            start = time.perf_counter()
+            if capture_table(connection, cursor, table_name,
+                             change_filters[table_name], current_datetime,
+                             event, table_name in snapshot_tables,
+                             window_starts[table_name], manifest_entries,
+                             logical_changes.get(table_name), executor,
+                             async_jobs):
+                captured_tables.append(table_name)
+                durations[table_name] = time.perf_counter() - start
+
+        table_names = order_tables_by_cost(table_names, checkpoints)
+        if workers > 1:
+            table_names = order_tables_by_size(cursor, table_names)
+            pool = ThreadedConnectionPool(1, workers, **connection_details)
+            try:
+                capture_tables_in_parallel(pool, snapshot_id, table_names,
+                                           capture, workers)
+            finally:
+                pool.closeall()
+        else:
+            for table_name in table_names:
+                capture(connection, cursor, table_name)
+
+        # One pipeline extracts the files of every "async" table, so the
+        # upload of a table overlaps the fetch of the next one
+        if async_jobs:
+            capture_async_jobs(connection, connection_details, async_jobs,
+                               event, budget, checkpoints, manifest_entries,
+                               captured_tables, durations)
+
+        # The slot only moves past changes every table has stored
+        if all(table_name in captured_tables for table_name in table_names
+               if table_name in logical_tables):
+            confirm_changes(connection, logical_lsn, slot)
+        elif logical_tables:
+            logger.error('Replication slot not advanced: some tables '
+                         'failed and their changes will be read again')
+
+        # The connection is kept open for the next warm invocation
         cursor.close()
-        connection.close()
+        release_connection(connection)
+
+        update_checkpoints(checkpoints, all_tables, table_names, durations,
+                           manifest_entries, window_starts, current_datetime,
+                           event)
+        put_checkpoints(checkpoints)
+
+        # Only the counters of the extracted tables move forward, so a
+        # failed table is picked up again by the next run
+        if activity is not None:
+            stored = get_stored_table_activity()
+            stored.update({table_name: activity[table_name]
+                           for table_name in captured_tables
+                           if table_name in activity})
+            put_stored_table_activity(stored)
+
+        record_snapshots(snapshot_state,
+                         [table_name for table_name in captured_tables
+                          if table_name in snapshot_tables],
+                         run_time, fingerprints)
+        put_snapshot_state(snapshot_state)
+
+        try:
+            put_run_manifest(current_datetime, old_datetime, manifest_entries,
+                             time.perf_counter() - run_start)
+        except ClientError as e:
+            logger.error(f'Run manifest could not be stored: {e}')
+
+        # The pointer only moves once every file of the run is uploaded
+        pointer = get_latest_pointer()
+        keys = [entry.get('parts_manifest', entry['file'])
+                for entry in manifest_entries]
+        if update_latest_pointer(pointer, current_datetime, keys):
+            put_latest_pointer(pointer)
 
-        with open(f'/tmp/csv_files/{param_store}', 'w') as f:
+        os.makedirs(CSV_DIRECTORY, exist_ok=True)
+        with open(f'{CSV_DIRECTORY}/{param_store}', 'w') as f:
             f.write(current_datetime)
 
         try:
-            push_data_in_bucket("/tmp/csv_files/", param_store)
+            push_data_in_bucket(f"{CSV_DIRECTORY}/", param_store)
         except FileNotFoundError:
             logger.error(f'File {param_store} not found...')
         except ClientError as e:
-            logger.error('Client error:', e)
+            logger.error(f'Client error: {e}')
 
     except Exception as e:
-        logger.error('Something unexpected went wrong:', e)
+        logger.exception(f'Something unexpected went wrong: {e}')
         raise e
@@ -1,29 +1,24 @@
 """
-This module contains functions for interacting with data: reading, processing,
-and uploading files to an S3 bucket, along with logging information
-about the process.
+This module contains a function for uploading files to an S3 bucket.
+
+The number of rows of each file is not read back from the file: it is
+counted while the file is written and logged by the caller (see
+`run_manifest`).
 
 Usage:
-1. Ensure the necessary libraries (boto3, pandas, logging) are installed.
+1. Ensure the necessary library (boto3) is installed.
 2. Use the push_data_in_bucket function to upload a file to an S3 bucket.
    - Provide the local directory and file name as arguments.
-   - Changes to the file are logged using the log_changes_to_db function.
-3. The logger records information about the upload and changes made.
 
 Example:
 Assuming a CSV file named 'data_changes.csv' is located in '/tmp/csv_files/'.
 push_data_in_bucket('/tmp/csv_files/', 'data_changes.csv')
 """
 import boto3
-import pandas as pd
-import logging
 from botocore.exceptions import ClientError
 
-logger = logging.getLogger('MyLogger')
-logger.setLevel(logging.INFO)
-
 
-def push_data_in_bucket(directory, file_name):
+def push_data_in_bucket(directory, file_name, extra_args=None, key=None):
     """
     Upload a file from the local directory to an S3 bucket.
 
@@ -33,6 +28,9 @@ def push_data_in_bucket(directory, file_name):
     Args:
         directory (str): The local directory path where the file is located.
         file_name (str): The name of the file to be uploaded.
+        extra_args (dict): Extra arguments of the object, such as its
+        ContentEncoding and Metadata.
+        key (str): The key of the object, the file name by default.
 
     Raises:
         FileNotFoundError: If the specified file is not
@@ -46,43 +44,14 @@ def push_data_in_bucket(directory, file_name):
 
         file_path = f'{directory}{file_name}'
 
-        log_changes_to_db(file_path, file_name)
         client = boto3.client("s3")
 
-        client.upload_file(file_path, "ingested-data-vox-indicium", file_name)
+        client.upload_file(file_path, "ingested-data-vox-indicium",
+                           key or file_name, ExtraArgs=extra_args)
 
-        print(f"The file {file_name} was uploaded")
+        print(f"The file {key or file_name} was uploaded")
 
     except FileNotFoundError as e:
         raise e
     except ClientError as e:
         raise e
-
-
-def log_changes_to_db(file_path, file_name):
-    """
-    Log the number of changes made to a file.
-
-    This function reads a CSV file from the specified path,
-    counts the number of rows, and logs the number of
-    changes made to the file.
-    Args:
-        file_path (str): The full path to the CSV file.
-        file_name (str): The name of the file being processed.
-
-    Raises:
-        Exception: If there's an error while processing the CSV file.
-
-    Returns:
-        None
-    """
-    try:
-
-        file = pd.read_csv(file_path)
-
-        num = len(file)
-
-        logger.info(f'Number of changes made to {file_name}: {num}')
-
-    except Exception as e:
-        raise e
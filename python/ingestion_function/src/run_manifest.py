@@ -0,0 +1,140 @@
+"""
+This module contains a counting writer and functions for recording what
+each run of the ingestion lambda uploaded in a JSON manifest.
+
+The primary purpose of this module is to describe every uploaded file
+without reading it back. A `CountingWriter` sits between the CSV
+encoder and the file or S3 upload, and counts the bytes and computes a
+SHA-256 checksum of the data as it goes through; the caller counts the
+rows it writes. At the end of a run, one entry per file is stored in
+'manifests/<run timestamp>.json' in the ingestion bucket, e.g.
+
+{"window": {"from": "2022-11-03 14:10:49.962",
+            "to": "2022-11-03 14:20:49.962"},
+ "duration": 12.5,
+ "files": [{"table": "currency", "file": "currency_changes.csv",
+            "window": {"from": "...", "to": "..."}, "rows": 3,
+            "bytes": 192, "checksum": "sha256:5e1f...",
+            "duration": 0.04}]}
+
+A full snapshot has no lower bound, so its window starts at null.
+
+Usage:
+1. Ensure the necessary library (boto3) is available.
+2. Wrap the output of a file in a `CountingWriter`, set its `rows` and
+use `file_entry` to describe it.
+3. Use `put_run_manifest` with the entries of the run.
+
+Example:
+counter = CountingWriter(stream)
+counter.rows = write_rows(counter)
+entry = file_entry("currency", "currency.csv", None, upper_bound,
+                   counter, duration)
+"""
+import hashlib
+import json
+
+import boto3
+
+MANIFEST_BUCKET = 'ingested-data-vox-indicium'
+MANIFEST_PREFIX = 'manifests/'
+
+
+class CountingWriter:
+    """
+    A file-like object that passes bytes through to another one while
+    counting them and computing their SHA-256 checksum.
+
+    Args:
+        raw: A file-like object accepting bytes.
+    """
+
+    closed = False
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.rows = 0
+        self.bytes_written = 0
+        self.hash = hashlib.sha256()
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.hash.update(data)
+        self.bytes_written += len(data)
+        self.raw.write(data)
+        return len(data)
+
+    @property
+    def checksum(self):
+        return f'sha256:{self.hash.hexdigest()}'
+
+
+def file_entry(table_name, file_name, window_start, window_end, counter,
+               duration):
+    """
+    Describe an uploaded file for the run manifest.
+
+    Args:
+        table_name (str): The name of the table the file comes from.
+        file_name (str): The key of the file in the ingestion bucket.
+        window_start (str): The start of the change window, or None
+        for a full snapshot.
+        window_end (str): The end of the change window.
+        counter (CountingWriter): The writer the file went through.
+        duration (float): The time taken to extract and upload the
+        file, in seconds.
+
+    Returns:
+        dict: The manifest entry of the file.
+    """
+    return {
+        'table': table_name,
+        'file': file_name,
+        'window': {'from': window_start, 'to': window_end},
+        'rows': counter.rows,
+        'bytes': counter.bytes_written,
+        'checksum': counter.checksum,
+        'duration': round(duration, 3)
+    }
+
+
+def manifest_key(run_timestamp):
+    """
+    Build the key of the manifest of a run.
+
+    Args:
+        run_timestamp (str): The timestamp of the run, as stored in
+        'postgres-datetime.txt'.
+
+    Returns:
+        str: The key, e.g. 'manifests/2022-11-03T14:20:49.962.json'.
+    """
+    timestamp = run_timestamp.replace(' ', 'T')
+    return f"{MANIFEST_PREFIX}{timestamp}.json"
+
+
+def put_run_manifest(run_timestamp, window_start, entries, duration):
+    """
+    Store the manifest of a run in the ingestion bucket.
+
+    Args:
+        run_timestamp (str): The timestamp of the run, the end of its
+        change window.
+        window_start (str): The start of the change window.
+        entries (list of dict): The entries of the uploaded files.
+        duration (float): The duration of the run, in seconds.
+
+    Returns:
+        str: The key of the manifest.
+    """
+    key = manifest_key(run_timestamp)
+    manifest = {
+        'window': {'from': window_start, 'to': run_timestamp},
+        'duration': round(duration, 3),
+        'files': sorted(entries, key=lambda entry: entry['file'])
+    }
+    s3 = boto3.client('s3')
+    s3.put_object(Bucket=MANIFEST_BUCKET, Key=key,
+                  Body=json.dumps(manifest, indent=2))
+    return key
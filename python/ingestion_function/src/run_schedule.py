@@ -0,0 +1,220 @@
+"""
+This module contains functions for scheduling the tables of an
+ingestion run within the time the Lambda has left, and for recording
+where each table got to.
+
+The primary purpose of this module is to stop one slow table from
+making the whole run time out and be redone. The run:
+   - reads the time left from `context.get_remaining_time_in_millis()`
+   and keeps a margin (the "deadline_margin" option, in seconds) for
+   storing its state at the end;
+   - starts the tables left over by the last run first, then the others
+   from the cheapest to the most expensive, by the time they took last;
+   - does not start a table that is not expected to finish before the
+   margin. Such a table, or one that failed, is left "pending" and
+   started first by the next run.
+Each table records a checkpoint in 'checkpoints.json' in the ingestion
+bucket, e.g.
+{"currency": {"window_end": "2022-11-03 14:20:49.962",
+              "duration": 0.412, "pending": false}}
+where "window_end" is the end of the last change window it stored, so
+the next run reads its changes from there rather than from the time of
+the last run, and "duration" the seconds it took.
+
+Usage:
+1. Ensure the necessary library (boto3) is available.
+2. Create a `RunBudget` from the Lambda context, order the tables with
+`order_tables_by_cost` and check `can_start` before each table.
+3. Use `table_window_start` for the start of a table's change window,
+and `record_checkpoint` or `mark_pending` and `put_checkpoints` at the
+end of the run.
+
+Example:
+checkpoints = get_checkpoints()
+budget = RunBudget(context, margin=10)
+for table_name in order_tables_by_cost(table_names, checkpoints):
+    if budget.can_start(expected_duration(checkpoints, table_name)):
+        ...
+"""
+import json
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+CHECKPOINT_BUCKET = 'ingested-data-vox-indicium'
+CHECKPOINT_KEY = 'checkpoints.json'
+DEFAULT_DEADLINE_MARGIN = 10
+
+
+class RunBudget:
+    """
+    The time a run has left before its deadline.
+
+    Args:
+        context: The AWS Lambda context. Without
+        `get_remaining_time_in_millis` (e.g. a local run) the run has no
+        deadline.
+        margin (float): The seconds kept for the end of the run.
+    """
+
+    def __init__(self, context, margin=DEFAULT_DEADLINE_MARGIN):
+        self.margin = margin
+        self.started = False
+        self.deadline = None
+        if hasattr(context, 'get_remaining_time_in_millis'):
+            self.deadline = time.monotonic() + \
+                context.get_remaining_time_in_millis() / 1000
+
+    def remaining(self):
+        """
+        Return the seconds left before the margin, or None without a
+        deadline.
+        """
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic() - self.margin
+
+    def can_start(self, expected_duration=None):
+        """
+        Check whether a table is expected to finish before the margin.
+        The first table of a run is started whatever its expected
+        duration while time is left, so a table slower than the whole
+        budget is still attempted.
+
+        Args:
+            expected_duration (float): The seconds the table is expected
+            to take, or None if unknown.
+
+        Returns:
+            bool: True if the table should be started.
+        """
+        remaining = self.remaining()
+        start = remaining is None or remaining > (expected_duration or 0) \
+            or (not self.started and remaining > 0)
+        self.started = self.started or start
+        return start
+
+
+def get_checkpoints():
+    """
+    Retrieve the checkpoint of every table.
+
+    Returns:
+        dict: The checkpoints by table name, empty if none exist.
+
+    Raises:
+        ClientError: If the checkpoints cannot be read for another
+        reason than them not existing.
+    """
+    s3 = boto3.client('s3')
+    try:
+        file = s3.get_object(Bucket=CHECKPOINT_BUCKET, Key=CHECKPOINT_KEY)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchKey':
+            return {}
+        raise e
+    return json.loads(file['Body'].read().decode('utf-8'))
+
+
+def put_checkpoints(checkpoints):
+    """
+    Store the checkpoint of every table.
+
+    Args:
+        checkpoints (dict): The checkpoints by table name.
+
+    Returns:
+        None
+    """
+    s3 = boto3.client('s3')
+    s3.put_object(Bucket=CHECKPOINT_BUCKET, Key=CHECKPOINT_KEY,
+                  Body=json.dumps(checkpoints, indent=2))
+
+
+def expected_duration(checkpoints, table_name):
+    """
+    Return the seconds a table took last time, or None if unknown.
+    """
+    return checkpoints.get(table_name, {}).get('duration')
+
+
+def order_tables_by_cost(table_names, checkpoints):
+    """
+    Sort tables in the order they should be started: the pending ones
+    first, then from the cheapest to the most expensive. Tables with no
+    known duration come before the others, to learn their cost.
+
+    Args:
+        table_names (list of str): The tables to sort.
+        checkpoints (dict): The checkpoints by table name.
+
+    Returns:
+        list of str: The sorted table names.
+    """
+    def cost(table_name):
+        checkpoint = checkpoints.get(table_name, {})
+        return (not checkpoint.get('pending', False),
+                checkpoint.get('duration') or 0)
+
+    return sorted(table_names, key=cost)
+
+
+def table_window_start(checkpoints, table_name, default):
+    """
+    Return the start of a table's change window: the end of the last
+    window it stored.
+
+    Args:
+        checkpoints (dict): The checkpoints by table name.
+        table_name (str): The name of the table.
+        default (str): The start for a table with no checkpoint, i.e.
+        the time of the last run.
+
+    Returns:
+        str: The timestamp.
+    """
+    return checkpoints.get(table_name, {}).get('window_end') or default
+
+
+def record_checkpoint(checkpoints, table_name, window_end, duration,
+                      rows=None):
+    """
+    Record that a table stored its changes up to the end of a window.
+
+    Args:
+        checkpoints (dict): The checkpoints by table name, updated in
+        place.
+        table_name (str): The name of the table.
+        window_end (str): The timestamp of the run.
+        duration (float): The seconds the table took.
+        rows (int): The rows the table wrote, if known.
+
+    Returns:
+        None
+    """
+    checkpoints[table_name] = {'window_end': window_end,
+                               'duration': round(duration, 3),
+                               'pending': False}
+    if rows is not None:
+        checkpoints[table_name]['rows'] = rows
+
+
+def mark_pending(checkpoints, table_name, window_start):
+    """
+    Record that a table was not stored by the run, so the next run
+    reads its changes from the start of this run's window.
+
+    Args:
+        checkpoints (dict): The checkpoints by table name, updated in
+        place.
+        table_name (str): The name of the table.
+        window_start (str): The start of the table's change window in
+        this run.
+
+    Returns:
+        None
+    """
+    checkpoint = checkpoints.setdefault(table_name, {})
+    checkpoint['window_end'] = window_start
+    checkpoint['pending'] = True
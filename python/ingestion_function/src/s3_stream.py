@@ -0,0 +1,174 @@
+"""
+This module contains a file-like writer that uploads what is written to
+it as an S3 multipart upload, without touching the local disk.
+
+The primary purpose of this module is to remove /tmp from the upload
+path of the ingestion lambda. Extracted rows can be encoded as CSV
+straight into an `S3MultipartWriter`, which cuts the bytes into parts
+of `part_size` and uploads each part on a background thread while the
+extraction carries on. At most `max_in_flight` parts are uploading at a
+time; when they are all busy, `write` waits, so the memory held is
+bounded by part_size x (max_in_flight + 1) whatever the size of the
+table. Objects smaller than one part are sent with a single PutObject.
+
+If anything fails, the multipart upload is aborted, so a partial object
+is never published.
+
+Usage:
+1. Ensure the necessary library (boto3) is available.
+2. Open an `S3MultipartWriter` in a `with` block and write str or bytes
+to it. The upload completes when the block ends, and is aborted if the
+block raises.
+
+Example:
+with S3MultipartWriter("sales_order.csv") as stream:
+    writer = csv.writer(stream)
+    writer.writerows(rows)
+"""
+from concurrent.futures import ThreadPoolExecutor, wait
+import threading
+
+import boto3
+
+STREAM_BUCKET = 'ingested-data-vox-indicium'
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+DEFAULT_MAX_IN_FLIGHT = 2
+
+
+class S3MultipartWriter:
+    """
+    A writable file-like object backed by an S3 multipart upload.
+
+    Args:
+        key (str): The key of the object to create.
+        bucket (str): The bucket of the object.
+        part_size (int): The size of every part but the last, in bytes.
+        S3 requires at least 5 MiB.
+        max_in_flight (int): The number of parts uploading at a time.
+        extra_args (dict): Extra arguments of the object, such as its
+        ContentEncoding and Metadata.
+
+    Raises:
+        ValueError: If part_size is below 5 MiB or max_in_flight is
+        not positive.
+    """
+
+    def __init__(self, key, bucket=STREAM_BUCKET,
+                 part_size=DEFAULT_PART_SIZE,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT, extra_args=None):
+        if part_size < MIN_PART_SIZE:
+            raise ValueError("part_size must be at least 5 MiB")
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be positive")
+
+        self.key = key
+        self.bucket = bucket
+        self.part_size = part_size
+        self.extra_args = extra_args or {}
+        self.client = boto3.client('s3')
+        self.buffer = bytearray()
+        self.bytes_written = 0
+        self.upload_id = None
+        self.futures = []
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self.closed = False
+
+    def write(self, data):
+        """
+        Add data to the object, uploading every full part.
+
+        Args:
+            data (str or bytes): The data; str is encoded as UTF-8.
+
+        Returns:
+            int: The length of the data given.
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.buffer += data
+        self.bytes_written += len(data)
+
+        while len(self.buffer) >= self.part_size:
+            part = bytes(self.buffer[:self.part_size])
+            del self.buffer[:self.part_size]
+            self._upload_part(part)
+        return len(data)
+
+    def _upload_part(self, body):
+        if self.upload_id is None:
+            response = self.client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, **self.extra_args)
+            self.upload_id = response['UploadId']
+
+        # Waits for a free slot, which bounds the memory held by parts
+        self.slots.acquire()
+        for future in self.futures:
+            if future.done() and future.exception() is not None:
+                self.slots.release()
+                raise future.exception()
+
+        part_number = len(self.futures) + 1
+        future = self.executor.submit(self._send_part, part_number, body)
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
+
+    def _send_part(self, part_number, body):
+        response = self.client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            PartNumber=part_number, Body=body)
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+    def close(self):
+        """
+        Upload the rest of the data and complete the object.
+
+        Raises:
+            ClientError: If an upload fails; the upload is then aborted.
+        """
+        if self.closed:
+            return
+        try:
+            if self.upload_id is None:
+                self.client.put_object(Bucket=self.bucket, Key=self.key,
+                                       Body=bytes(self.buffer),
+                                       **self.extra_args)
+            else:
+                if self.buffer:
+                    self._upload_part(bytes(self.buffer))
+                parts = [future.result() for future in self.futures]
+                self.client.complete_multipart_upload(
+                    Bucket=self.bucket, Key=self.key,
+                    UploadId=self.upload_id,
+                    MultipartUpload={'Parts': parts})
+        except Exception:
+            self.abort()
+            raise
+        self.buffer = bytearray()
+        self.closed = True
+        self.executor.shutdown()
+
+    def abort(self):
+        """
+        Abandon the upload, leaving no object behind.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        wait(self.futures)
+        self.executor.shutdown()
+        self.buffer = bytearray()
+        if self.upload_id is not None:
+            self.client.abort_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
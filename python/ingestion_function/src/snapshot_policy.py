@@ -0,0 +1,169 @@
+"""
+This module contains functions for deciding when the ingestion lambda
+exports the full content of a table ('<table>.csv') next to its changes.
+
+The primary purpose of this module is to stop re-exporting every whole
+table on every 10-minute run. Each table follows a snapshot policy:
+   - "always" (default): a full snapshot on every run;
+   - "hourly" / "daily": when the last snapshot is at least an hour /
+   a day old, less the "schedule_tolerance" option (a minute by
+   default) also given to the schedules of the table registry, so a run
+   starting a little early does not put the snapshot off to the next;
+   - "schema_change": when the table's columns or their types changed
+   since the last snapshot;
+   - "on_demand": only when requested with the "force_snapshot" option.
+A table with no recorded snapshot always gets one.
+
+The time and schema fingerprint of the last snapshot of every table are
+recorded in 'snapshots.json' in the ingestion bucket, e.g.
+{"currency": {"taken_at": "2022-11-03T14:20:49.962000+00:00",
+              "schema_fingerprint": "9f0c..."}}
+so the transformation side can tell how old the '<table>.csv' it joins
+against is.
+
+Usage:
+1. Ensure the necessary libraries (boto3, psycopg2) are available.
+2. Use `get_snapshot_state` and `snapshot_due` to decide which tables
+get a full snapshot, and `put_snapshot_state` to record them.
+
+Example:
+state = get_snapshot_state()
+fingerprints = get_schema_fingerprints(cursor)
+if snapshot_due("currency", "daily", state, now, fingerprints):
+    ...
+"""
+from datetime import datetime, timedelta
+import hashlib
+import json
+
+import boto3
+from botocore.exceptions import ClientError
+
+from .table_registry import DEFAULT_TOLERANCE
+
+SNAPSHOT_BUCKET = 'ingested-data-vox-indicium'
+SNAPSHOT_KEY = 'snapshots.json'
+
+POLICIES = ('always', 'hourly', 'daily', 'schema_change', 'on_demand')
+POLICY_INTERVALS = {'hourly': timedelta(hours=1), 'daily': timedelta(days=1)}
+
+SCHEMA_QUERY = '''SELECT table_name, column_name, data_type
+FROM information_schema.columns
+WHERE table_schema = 'public'
+ORDER BY table_name, ordinal_position;'''
+
+
+def get_snapshot_state():
+    """
+    Retrieve the record of the last snapshot of every table.
+
+    Returns:
+        dict: The last snapshot by table name, empty if none exist.
+
+    Raises:
+        ClientError: If the record cannot be read for another reason
+        than it not existing.
+    """
+    s3 = boto3.client('s3')
+    try:
+        file = s3.get_object(Bucket=SNAPSHOT_BUCKET, Key=SNAPSHOT_KEY)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchKey':
+            return {}
+        raise e
+    return json.loads(file['Body'].read().decode('utf-8'))
+
+
+def put_snapshot_state(state):
+    """
+    Store the record of the last snapshot of every table.
+
+    Args:
+        state (dict): The last snapshot by table name.
+
+    Returns:
+        None
+    """
+    s3 = boto3.client('s3')
+    s3.put_object(Bucket=SNAPSHOT_BUCKET, Key=SNAPSHOT_KEY,
+                  Body=json.dumps(state, indent=2))
+
+
+def get_schema_fingerprints(cursor):
+    """
+    Compute a fingerprint of the columns of every table.
+
+    Args:
+        cursor (psycopg2 cursor): A database cursor.
+
+    Returns:
+        dict: A SHA-256 hex digest of the column names and types,
+        by table name.
+    """
+    cursor.execute(SCHEMA_QUERY)
+    columns = {}
+    for table_name, column_name, data_type in cursor.fetchall():
+        columns.setdefault(table_name, []).append(
+            f'{column_name}:{data_type}')
+
+    return {table_name: hashlib.sha256(
+                ','.join(table_columns).encode('utf-8')).hexdigest()
+            for table_name, table_columns in columns.items()}
+
+
+def snapshot_due(table_name, policy, state, now, fingerprints=None,
+                 forced=False, tolerance=DEFAULT_TOLERANCE):
+    """
+    Decide whether a table gets a full snapshot in this run.
+
+    Args:
+        table_name (str): The name of the table.
+        policy (str): The table's snapshot policy, one of POLICIES.
+        state (dict): The last snapshot by table name.
+        now (datetime): The time of the run (timezone aware).
+        fingerprints (dict): The current schema fingerprints by table
+        name, needed by the "schema_change" policy.
+        forced (bool): True if a snapshot was requested for this run.
+        tolerance (timedelta): How early a run may be.
+
+    Returns:
+        bool: True if the full table should be exported.
+
+    Raises:
+        ValueError: If the policy is not one of POLICIES.
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown snapshot policy: {policy}")
+
+    last = state.get(table_name)
+    if forced or last is None or policy == 'always':
+        return True
+    if policy in POLICY_INTERVALS:
+        taken_at = datetime.fromisoformat(last['taken_at'])
+        return now - taken_at >= POLICY_INTERVALS[policy] - tolerance
+    if policy == 'schema_change':
+        return (fingerprints or {}).get(table_name) != \
+            last.get('schema_fingerprint')
+    return False
+
+
+def record_snapshots(state, table_names, now, fingerprints=None):
+    """
+    Record that tables got a full snapshot.
+
+    Args:
+        state (dict): The last snapshot by table name, updated in place.
+        table_names (list of str): The tables snapshotted in this run.
+        now (datetime): The time of the run (timezone aware).
+        fingerprints (dict): The current schema fingerprints by table
+        name, if they were computed.
+
+    Returns:
+        dict: The updated state.
+    """
+    for table_name in table_names:
+        state[table_name] = {
+            'taken_at': now.isoformat(),
+            'schema_fingerprint': (fingerprints or {}).get(table_name)
+        }
+    return state
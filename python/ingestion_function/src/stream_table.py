@@ -0,0 +1,76 @@
+"""
+This module contains a function for streaming the result of a query
+in batches using a PostgreSQL server-side cursor.
+
+The primary purpose of this module is to keep the memory used by the
+ingestion lambda constant whatever the size of a table. Instead of
+calling `cursor.fetchall()` and holding the whole table as Python
+tuples, the function `iter_query_batches` opens a named (server-side)
+cursor and fetches the rows in batches of `fetch_size`. The "stream"
+engine of `postgres_data_capture` writes each batch through its
+`TableWriter` and then discards it.
+
+Usage:
+1. Ensure the necessary library (psycopg2) is available.
+2. Use the `iter_query_batches` function with an open connection.
+   - Pass the connection, the query, a name for the cursor and
+   optionally the number of rows fetched per batch.
+   - The first batch starts with the column names (or the cursor's
+   description).
+
+Example:
+for batch in iter_query_batches(connection, "SELECT * FROM staff;",
+                                "staff_stream", fetch_size=5000):
+    writer.writerows(batch)
+
+This never holds more than 5000 rows in memory.
+"""
+
+DEFAULT_FETCH_SIZE = 2000
+
+
+def iter_query_batches(connection, query, cursor_name,
+                       fetch_size=DEFAULT_FETCH_SIZE, describe=False):
+    """
+    Run a query on a server-side cursor and yield its rows in batches.
+
+    The first batch starts with a tuple of the column names.
+
+    Args:
+        connection (psycopg2 connection): An open database connection.
+        query (str): The SQL query to execute.
+        cursor_name (str): The name of the server-side cursor.
+        fetch_size (int): The number of rows fetched at a time.
+        describe (bool): True to start the first batch with the
+        cursor's description instead of the column names.
+
+    Yields:
+        list of tuples: The rows of each batch.
+
+    Raises:
+        ValueError: If fetch_size is not a positive integer.
+    """
+    if not isinstance(fetch_size, int) or fetch_size < 1:
+        raise ValueError("fetch_size must be a positive integer")
+
+    # A named cursor is declared on the server, so rows are only
+    # transferred when they are fetched
+    cursor = connection.cursor(name=cursor_name)
+    cursor.itersize = fetch_size
+    try:
+        cursor.execute(query)
+
+        # The description of a named cursor is only known after
+        # the first fetch
+        batch = cursor.fetchmany(fetch_size)
+        if describe:
+            yield [cursor.description] + batch
+        else:
+            columns = [col[0] for col in cursor.description]
+            yield [tuple(columns)] + batch
+
+        while len(batch) == fetch_size:
+            batch = cursor.fetchmany(fetch_size)
+            yield batch
+    finally:
+        cursor.close()
@@ -0,0 +1,129 @@
+"""
+This module contains functions for finding the tables that have not
+changed since the last run, so the ingestion lambda can skip them.
+
+Two pre-flight checks are available:
+   - "stats" compares the insert, update and delete counters of
+   `pg_stat_user_tables` with the counters stored at the last run in
+   'table_activity.json' in the ingestion bucket. A single catalog
+   query covers every table. The counters are flushed by PostgreSQL
+   about once a second, so a change committed in the last second
+   before the run may only be seen by the next run. A skipped table
+   resumes from its own watermark with the keyset change capture, and
+   keeps the start of its change window otherwise.
+   - "exists" runs an indexed `SELECT EXISTS (...)` probe on the change
+   window of each table, which stops at the first changed row.
+
+Usage:
+1. Ensure the necessary libraries (boto3, psycopg2) are available.
+2. For "stats", use `get_table_activity` and `get_stored_table_activity`
+and keep the tables for which `has_activity` is True. Store the
+counters of the tables extracted with `put_stored_table_activity`.
+3. For "exists", use `table_has_changes` with the change filter.
+
+Example:
+activity = get_table_activity(cursor)
+stored = get_stored_table_activity()
+due = [t for t in table_names if has_activity(t, activity, stored)]
+"""
+import json
+
+import boto3
+from botocore.exceptions import ClientError
+
+ACTIVITY_BUCKET = 'ingested-data-vox-indicium'
+ACTIVITY_KEY = 'table_activity.json'
+
+ACTIVITY_QUERY = '''SELECT relname, n_tup_ins, n_tup_upd, n_tup_del
+FROM pg_stat_user_tables
+WHERE schemaname = 'public';'''
+
+
+def get_table_activity(cursor):
+    """
+    Read the insert, update and delete counters of every table.
+
+    Args:
+        cursor (psycopg2 cursor): A database cursor.
+
+    Returns:
+        dict: The counters [inserts, updates, deletes] by table name.
+    """
+    cursor.execute(ACTIVITY_QUERY)
+    return {name: [inserts, updates, deletes]
+            for name, inserts, updates, deletes in cursor.fetchall()}
+
+
+def get_stored_table_activity():
+    """
+    Retrieve the counters stored at the last run.
+
+    Returns:
+        dict: The counters by table name, empty if none are stored.
+
+    Raises:
+        ClientError: If the counters cannot be read for another reason
+        than them not existing.
+    """
+    s3 = boto3.client('s3')
+    try:
+        file = s3.get_object(Bucket=ACTIVITY_BUCKET, Key=ACTIVITY_KEY)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchKey':
+            return {}
+        raise e
+    return json.loads(file['Body'].read().decode('utf-8'))
+
+
+def put_stored_table_activity(activity):
+    """
+    Store the counters for the next run.
+
+    Args:
+        activity (dict): The counters by table name.
+
+    Returns:
+        None
+    """
+    s3 = boto3.client('s3')
+    s3.put_object(Bucket=ACTIVITY_BUCKET, Key=ACTIVITY_KEY,
+                  Body=json.dumps(activity))
+
+
+def has_activity(table_name, activity, stored):
+    """
+    Tell whether a table's counters moved since the last run.
+
+    A table without stored counters, or whose counters went down
+    (e.g. after a statistics reset), counts as changed.
+
+    Args:
+        table_name (str): The name of the table.
+        activity (dict): The current counters by table name.
+        stored (dict): The counters stored at the last run.
+
+    Returns:
+        bool: False only if the counters are exactly the stored ones.
+    """
+    if table_name not in activity or table_name not in stored:
+        return True
+    return list(activity[table_name]) != list(stored[table_name])
+
+
+def table_has_changes(cursor, table_name, row_filter):
+    """
+    Probe a table for at least one row matching the change filter.
+
+    Args:
+        cursor (psycopg2 cursor): A database cursor.
+        table_name (str): The name of the table.
+        row_filter (str): The WHERE clause selecting changed rows.
+
+    Returns:
+        bool: True if a changed row exists.
+    """
+    cursor.execute(f'''SELECT EXISTS (
+    SELECT 1
+    FROM {table_name}
+    {row_filter});''')
+    return cursor.fetchone()[0]
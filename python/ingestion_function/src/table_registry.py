@@ -0,0 +1,135 @@
+"""
+This module contains functions for deciding which tables the ingestion
+lambda extracts on each run, from a registry of tables and tiers.
+
+The primary purpose of this module is to stop treating every table of
+the database the same on every 10-minute EventBridge run. Each table
+belongs to a tier, and each tier has a schedule:
+   - "run": extracted on every run;
+   - "hourly" / "daily": extracted when its last extraction is at least
+   an hour / a day old;
+   - "never": not extracted at all.
+The registry is the "table_registry" option of the event, e.g.
+{"default_tier": "hot",
+ "tiers": {"hot": "run", "reference": "hourly", "excluded": "never"},
+ "tables": {"currency": "reference", "department": "reference",
+            "address": "reference", "_prisma_migrations": "excluded"}}
+Missing entries are taken from DEFAULT_REGISTRY, which is the registry
+above, so tables not listed are "hot".
+
+The last extraction of a table is the end of the change window of its
+checkpoint (see `run_schedule`). A table that is not due keeps its
+checkpoint, so its next extraction reads every change since the last
+one.
+
+Usage:
+1. Use `get_table_registry` with the event, drop the tables for which
+`is_excluded` is True, and keep the tables for which `is_due` is True.
+
+Example:
+registry = get_table_registry(event)
+due = [table for table in table_names
+       if is_due(registry, table, checkpoints, run_timestamp)]
+"""
+from datetime import datetime, timedelta
+
+SCHEDULES = ('run', 'hourly', 'daily', 'never')
+SCHEDULE_INTERVALS = {'hourly': timedelta(hours=1),
+                      'daily': timedelta(days=1)}
+# A run a little early, e.g. 59:58 after the last one, is still on time
+DEFAULT_TOLERANCE = timedelta(minutes=1)
+
+DEFAULT_REGISTRY = {
+    'default_tier': 'hot',
+    'tiers': {'hot': 'run', 'reference': 'hourly', 'excluded': 'never'},
+    'tables': {'currency': 'reference', 'department': 'reference',
+               'address': 'reference', '_prisma_migrations': 'excluded'}
+}
+
+
+def get_table_registry(event):
+    """
+    Build the registry of the run from the event and the defaults.
+
+    Args:
+        event: Event data passed to the lambda. Its "table_registry"
+        entries replace the default ones.
+
+    Returns:
+        dict: The registry.
+
+    Raises:
+        ValueError: If a tier has an unknown schedule, or a table an
+        unknown tier.
+    """
+    options = {}
+    if isinstance(event, dict):
+        options = event.get('table_registry') or {}
+
+    registry = {
+        'default_tier': options.get('default_tier',
+                                    DEFAULT_REGISTRY['default_tier']),
+        'tiers': {**DEFAULT_REGISTRY['tiers'], **options.get('tiers', {})},
+        'tables': {**DEFAULT_REGISTRY['tables'],
+                   **options.get('tables', {})}
+    }
+
+    for tier, schedule in registry['tiers'].items():
+        if schedule not in SCHEDULES:
+            raise ValueError(f"Unknown schedule for tier {tier}: {schedule}")
+    tiers = [registry['default_tier'], *registry['tables'].values()]
+    for tier in tiers:
+        if tier not in registry['tiers']:
+            raise ValueError(f"Unknown table tier: {tier}")
+    return registry
+
+
+def table_schedule(registry, table_name):
+    """
+    Return the schedule of a table's tier, one of SCHEDULES.
+    """
+    tier = registry['tables'].get(table_name, registry['default_tier'])
+    return registry['tiers'][tier]
+
+
+def is_excluded(registry, table_name):
+    """
+    Check whether a table is never extracted.
+    """
+    return table_schedule(registry, table_name) == 'never'
+
+
+def parse_run_timestamp(run_timestamp):
+    """
+    Parse a run timestamp, e.g. '2022-11-03 14:20:49.962'.
+    """
+    return datetime.fromisoformat(run_timestamp)
+
+
+def is_due(registry, table_name, checkpoints, run_timestamp,
+           tolerance=DEFAULT_TOLERANCE):
+    """
+    Check whether a table is due to be extracted by a run.
+
+    Args:
+        registry (dict): The registry, from `get_table_registry`.
+        table_name (str): The name of the table.
+        checkpoints (dict): The checkpoints by table name.
+        run_timestamp (str): The timestamp of the run.
+        tolerance (timedelta): How early a run may be.
+
+    Returns:
+        bool: True if the table should be extracted.
+    """
+    schedule = table_schedule(registry, table_name)
+    if schedule == 'never':
+        return False
+    if schedule == 'run':
+        return True
+
+    checkpoint = checkpoints.get(table_name, {})
+    if checkpoint.get('pending') or not checkpoint.get('window_end'):
+        return True
+    elapsed = parse_run_timestamp(run_timestamp) - \
+        parse_run_timestamp(checkpoint['window_end'])
+    return elapsed >= SCHEDULE_INTERVALS[schedule] - tolerance
@@ -0,0 +1,108 @@
+"""
+This module contains a writer encoding extracted rows as CSV or Parquet
+into a file or an S3 upload, while counting what it writes.
+
+The primary purpose of this module is to give every extraction path one
+place where the output format, its compression and the run manifest
+counters are put together:
+   - "csv" batches are encoded at once by a `CsvBatchEncoder`, then
+   written through a `CompressingWriter` ("gzip"/"zstd" recorded as the
+   object's Content-Encoding);
+   - "parquet" rows are written as typed row groups by a
+   `ParquetBatchWriter`, which uses the compression as its codec.
+In both cases a `CountingWriter` in front of the file or upload counts
+the bytes of the object as it is stored and computes its checksum.
+
+Usage:
+1. Create a `TableWriter` on a binary file or upload, call `writeheader`
+with the cursor's description, `writerows` with each batch of rows, and
+`close` before closing the file or upload.
+2. Use `object_args` for the arguments of the upload.
+
+Example:
+writer = TableWriter(stream, "parquet", "zstd")
+writer.writeheader(cursor.description)
+writer.writerows(cursor.fetchall())
+writer.close()
+"""
+from .compression import CompressingWriter, upload_args
+from .csv_encoder import CsvBatchEncoder
+from .parquet_output import ParquetBatchWriter, DEFAULT_ROW_GROUP_SIZE
+from .run_manifest import CountingWriter
+
+FORMATS = ('csv', 'parquet')
+
+
+def object_args(file_format, compression):
+    """
+    Build the S3 arguments of an object written by a TableWriter.
+
+    Args:
+        file_format (str): One of FORMATS.
+        compression (str): The compression of the object.
+
+    Returns:
+        dict: The upload arguments, or None.
+    """
+    # A Parquet file compresses its own pages, not the whole object
+    return upload_args(compression) if file_format == 'csv' else None
+
+
+class TableWriter:
+    """
+    Encode batches of rows into a binary stream as CSV or Parquet.
+
+    Args:
+        stream: A file-like object accepting bytes.
+        file_format (str): One of FORMATS.
+        compression (str): "gzip" or "zstd", or None.
+        row_group_size (int): The rows of each Parquet row group.
+
+    Raises:
+        ValueError: If the format or the compression is unknown.
+    """
+
+    def __init__(self, stream, file_format='csv', compression=None,
+                 row_group_size=DEFAULT_ROW_GROUP_SIZE):
+        if file_format not in FORMATS:
+            raise ValueError(f"Unknown output format: {file_format}")
+
+        self.file_format = file_format
+        self.compression = compression
+        self.row_group_size = row_group_size
+        self.counter = CountingWriter(stream)
+        self.writer = None
+        if file_format == 'csv':
+            self.compressor = CompressingWriter(self.counter, compression)
+
+    def writeheader(self, description):
+        """
+        Start the output with the columns of the result.
+
+        Args:
+            description (sequence of psycopg2 Column): cursor.description.
+        """
+        if self.file_format == 'csv':
+            self.writer = CsvBatchEncoder(description)
+            self.compressor.write(self.writer.header())
+        else:
+            self.writer = ParquetBatchWriter(
+                self.counter, description, self.row_group_size,
+                self.compression)
+
+    def writerows(self, rows):
+        if self.file_format == 'csv':
+            # One write per batch rather than per row
+            self.compressor.write(self.writer.encode(rows))
+        else:
+            self.writer.writerows(rows)
+        self.counter.rows += len(rows)
+
+    def close(self):
+        """
+        Write the end of the output.
+        """
+        if self.file_format == 'csv':
+            self.compressor.finish()
+        else:
+            self.writer.close()
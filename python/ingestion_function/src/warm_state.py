@@ -0,0 +1,183 @@
+"""
+This module keeps the database connection and the table catalog of the
+ingestion lambda alive between warm invocations.
+
+The primary purpose of this module is to take the fixed cost of every
+10-minute run out of the run itself. A Lambda container is reused while
+it is warm, and module-level state survives from one invocation to the
+next:
+   - the connection is kept open at the end of a run. The next run
+   checks it with `SELECT 1` and connects again if the check fails, the
+   connection was closed by the server, or the credentials changed.
+   - the list of tables and their schema fingerprints (see
+   `snapshot_policy.get_schema_fingerprints`) are cached. Each run only
+   computes a single fingerprint of the whole schema in the database;
+   the catalog is read again when that fingerprint changes, i.e. when a
+   table or a column is added, dropped, renamed or retyped.
+A cold start fills both, so the first run behaves as before.
+
+Usage:
+1. Ensure the necessary library (psycopg2) is available.
+2. Use `get_connection` instead of `psycopg2.connect`, and
+`release_connection` instead of closing the connection.
+3. Use `get_catalog` for the tables to extract and their fingerprints.
+
+Example:
+connection = get_connection(connection_details)
+cursor = connection.cursor()
+table_names, fingerprints = get_catalog(cursor)
+...
+release_connection(connection)
+"""
+import logging
+
+import psycopg2
+
+from .snapshot_policy import get_schema_fingerprints
+
+logger = logging.getLogger('MyLogger')
+
+# State kept between warm invocations of the lambda
+_connection = {'connection': None, 'details': None}
+_catalog = {'fingerprint': None, 'table_names': None, 'fingerprints': None}
+
+TABLES_QUERY = '''SELECT table_name
+FROM information_schema.tables
+WHERE table_schema = 'public';'''
+
+SCHEMA_FINGERPRINT_QUERY = '''SELECT md5(string_agg(
+    c.relname || '.' || a.attname || ':'
+    || format_type(a.atttypid, a.atttypmod),
+    ',' ORDER BY c.relname, a.attnum))
+FROM pg_attribute a
+JOIN pg_class c ON c.oid = a.attrelid
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p', 'v', 'f')
+AND a.attnum > 0 AND NOT a.attisdropped;'''
+
+
+def connection_is_healthy(connection):
+    """
+    Check that a kept connection can still run queries.
+
+    Any transaction left open by the last run is rolled back first.
+
+    Args:
+        connection (psycopg2 connection): The kept connection.
+
+    Returns:
+        bool: True if the connection answered `SELECT 1`.
+    """
+    if connection.closed:
+        return False
+    try:
+        connection.rollback()
+        cursor = connection.cursor()
+        cursor.execute('SELECT 1;')
+        cursor.fetchone()
+        cursor.close()
+        # The next statement starts a new transaction
+        connection.rollback()
+        return True
+    except psycopg2.Error as e:
+        logger.warning(f'Kept database connection failed its check: {e}')
+        return False
+
+
+def get_connection(connection_details):
+    """
+    Return the connection kept from the last invocation, or a new one.
+
+    Args:
+        connection_details (dict): The arguments of psycopg2.connect.
+
+    Returns:
+        psycopg2 connection: An open connection.
+
+    Raises:
+        psycopg2.Error: If a new connection cannot be opened.
+    """
+    connection = _connection['connection']
+    if connection is not None:
+        if (_connection['details'] == connection_details
+                and connection_is_healthy(connection)):
+            logger.info('Reusing the Totesys database connection...')
+            return connection
+        discard_connection()
+
+    connection = psycopg2.connect(**connection_details)
+    _connection['connection'] = connection
+    _connection['details'] = dict(connection_details)
+    return connection
+
+
+def release_connection(connection):
+    """
+    End the run's transaction and keep the connection for the next
+    invocation.
+
+    Args:
+        connection (psycopg2 connection): The connection of the run.
+
+    Returns:
+        None
+    """
+    try:
+        connection.rollback()
+    except psycopg2.Error as e:
+        logger.warning(f'Database connection dropped: {e}')
+        discard_connection()
+
+
+def discard_connection():
+    """
+    Close the kept connection, if any, so the next run connects again.
+
+    Returns:
+        None
+    """
+    connection = _connection['connection']
+    _connection['connection'] = None
+    _connection['details'] = None
+    if connection is not None and not connection.closed:
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+
+def get_catalog(cursor):
+    """
+    Return the tables to extract and their schema fingerprints, read
+    from the database only when the schema changed since the last call.
+
+    Args:
+        cursor (psycopg2 cursor): A database cursor.
+
+    Returns:
+        tuple: The list of table names and the dictionary of schema
+        fingerprints by table name.
+    """
+    cursor.execute(SCHEMA_FINGERPRINT_QUERY)
+    fingerprint = cursor.fetchone()[0]
+
+    if _catalog['table_names'] is None or \
+            _catalog['fingerprint'] != fingerprint:
+        logger.info('Reading the table catalog...')
+        cursor.execute(TABLES_QUERY)
+        _catalog['table_names'] = [
+            table_name for (table_name,) in cursor.fetchall()]
+        _catalog['fingerprints'] = get_schema_fingerprints(cursor)
+        _catalog['fingerprint'] = fingerprint
+
+    return list(_catalog['table_names']), dict(_catalog['fingerprints'])
+
+
+def clear_catalog():
+    """
+    Forget the cached catalog, so the next call reads it again.
+
+    Returns:
+        None
+    """
+    _catalog.update(fingerprint=None, table_names=None, fingerprints=None)
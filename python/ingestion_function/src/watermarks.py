@@ -0,0 +1,90 @@
+"""
+This module contains functions for storing a high-water mark for each
+table in the ingestion bucket.
+
+The primary purpose of this module is to let every table keep its own
+position in its change history, instead of sharing the single
+'postgres-datetime.txt' timestamp. A watermark is the pair
+(last_updated, primary key) of the last row extracted, which is the
+position keyset pagination resumes from. A table that fails keeps its
+old watermark without holding back any other table.
+
+Each watermark is stored as a small JSON object under the
+'watermarks/' prefix of the ingestion bucket, e.g.
+'watermarks/sales_order.json' holds
+{"last_updated": "2022-11-03 14:20:49.962000", "primary_key": 1234}
+
+Usage:
+1. Ensure the necessary library (boto3) is available.
+2. Use `get_table_watermark` to read the position of a table. If the
+table has no watermark yet, the default timestamp
+('1901-01-01 01:01:01.001') and a primary key of None are returned.
+3. Use `put_table_watermark` once the rows up to a position are safely
+uploaded.
+
+Example:
+last_updated, primary_key = get_table_watermark("sales_order")
+put_table_watermark("sales_order", "2022-11-03 14:20:49.962000", 1234)
+"""
+import json
+
+import boto3
+from botocore.exceptions import ClientError
+
+WATERMARK_BUCKET = 'ingested-data-vox-indicium'
+WATERMARK_PREFIX = 'watermarks/'
+DEFAULT_TIMESTAMP = '1901-01-01 01:01:01.001'
+
+
+def get_table_watermark(table_name):
+    """
+    Retrieve the watermark of a table.
+
+    Args:
+        table_name (str): The name of the table.
+
+    Returns:
+        tuple: (last_updated (str), primary_key), with a primary key of
+        None when the table has no watermark yet.
+
+    Raises:
+        ValueError: If the table name is an empty string.
+        ClientError: If the watermark cannot be read for another reason
+        than it not existing.
+    """
+    if len(table_name) == 0:
+        raise ValueError("No input name")
+
+    s3 = boto3.client('s3')
+    try:
+        file = s3.get_object(Bucket=WATERMARK_BUCKET,
+                             Key=f'{WATERMARK_PREFIX}{table_name}.json')
+    except ClientError as e:
+        # the whole history is extracted for a table seen for the first time
+        if e.response['Error']['Code'] == 'NoSuchKey':
+            return DEFAULT_TIMESTAMP, None
+        raise e
+
+    watermark = json.loads(file['Body'].read().decode('utf-8'))
+    return watermark['last_updated'], watermark['primary_key']
+
+
+def put_table_watermark(table_name, last_updated, primary_key):
+    """
+    Store the watermark of a table.
+
+    Args:
+        table_name (str): The name of the table.
+        last_updated (str or datetime): The last_updated value of the
+        last row extracted.
+        primary_key: The primary key of the last row extracted.
+
+    Returns:
+        None
+    """
+    body = json.dumps({'last_updated': str(last_updated),
+                       'primary_key': primary_key})
+    s3 = boto3.client('s3')
+    s3.put_object(Bucket=WATERMARK_BUCKET,
+                  Key=f'{WATERMARK_PREFIX}{table_name}.json',
+                  Body=body)
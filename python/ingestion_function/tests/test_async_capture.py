@@ -0,0 +1,154 @@
+from python.ingestion_function.src import async_capture
+from python.ingestion_function.src.async_capture import (
+    capture_files_async,
+    extract_files,
+    file_job,
+    FileUpload)
+from moto import mock_s3
+import asyncio
+import boto3
+import pytest
+
+TABLES = {
+    'currency': [[('currency_id',), ('currency_code',)],
+                 [(1, 'GBP'), (2, 'USD')], [(3, 'EUR')]],
+    'staff': [[('staff_id',)], [(1,), (2,)], [(3,), (4,)], [(5,)]]
+}
+
+
+@mock_s3
+def create_s3_mock_bucket():
+    client = boto3.client("s3")
+    client.create_bucket(Bucket="ingested-data-vox-indicium",
+                         CreateBucketConfiguration={
+                             'LocationConstraint': 'eu-west-2'})
+
+
+def list_keys():
+    response = boto3.client("s3").list_objects(
+        Bucket="ingested-data-vox-indicium")
+    return [item['Key'] for item in response.get('Contents', [])]
+
+
+def read_object(key):
+    return boto3.client("s3").get_object(
+        Bucket="ingested-data-vox-indicium", Key=key)['Body'].read()
+
+
+def fake_source(tables, log=None, fail_after=None):
+    async def batches_of(job):
+        description, *batches = tables[job['table_name']]
+        for number, batch in enumerate(batches):
+            if number == fail_after:
+                raise RuntimeError('connection lost')
+            if log is not None:
+                log.append(('fetch', job['table_name']))
+            yield [description] + batch if number == 0 else batch
+            await asyncio.sleep(0)
+
+    return batches_of
+
+
+def jobs():
+    return [file_job('currency', 'currency.csv', 'SELECT * FROM currency;'),
+            file_job('staff', 'staff.csv', 'SELECT * FROM staff;')]
+
+
+@mock_s3
+def test_every_file_is_encoded_and_uploaded_in_order():
+    create_s3_mock_bucket()
+
+    results = asyncio.run(extract_files(jobs(), fake_source(TABLES)))
+
+    assert [result['job']['key'] for result in results] == \
+        ['currency.csv', 'staff.csv']
+    assert [result['counter'].rows for result in results] == [3, 5]
+    assert read_object('currency.csv') == \
+        b'currency_id,currency_code\r\n1,GBP\r\n2,USD\r\n3,EUR\r\n'
+    assert read_object('staff.csv') == \
+        b'staff_id\r\n1\r\n2\r\n3\r\n4\r\n5\r\n'
+    assert results[0]['timer'].seconds['query'] > 0
+    assert results[0]['timer'].seconds['upload'] > 0
+
+
+@mock_s3
+def test_queue_depth_holds_back_the_fetch(monkeypatch):
+    create_s3_mock_bucket()
+    log = []
+    write = FileUpload.write
+
+    def logged_write(self, rows):
+        log.append(('write', self.job['table_name']))
+        write(self, rows)
+
+    monkeypatch.setattr(FileUpload, 'write', logged_write)
+    tables = {'staff': [[('staff_id',)]] + [[(n,)] for n in range(20)]}
+
+    asyncio.run(extract_files([file_job('staff', 'staff.csv', '')],
+                              fake_source(tables, log), queue_depth=1))
+
+    ahead = 0
+    most_ahead = 0
+    for event, _ in log:
+        ahead += 1 if event == 'fetch' else -1
+        most_ahead = max(most_ahead, ahead)
+    # One batch on the queue, one being put and one being written
+    assert most_ahead <= 3
+    assert read_object('staff.csv').count(b'\r\n') == 21
+
+
+@mock_s3
+def test_failed_upload_leaves_no_object_and_other_files_carry_on(
+        monkeypatch):
+    create_s3_mock_bucket()
+    write = FileUpload.write
+
+    def failing_write(self, rows):
+        if self.job['table_name'] == 'currency':
+            raise OSError('disk full')
+        write(self, rows)
+
+    monkeypatch.setattr(FileUpload, 'write', failing_write)
+
+    results = asyncio.run(extract_files(jobs(), fake_source(TABLES)))
+
+    assert isinstance(results[0]['error'], OSError)
+    assert results[0]['counter'] is None
+    assert results[1]['error'] is None
+    assert list_keys() == ['staff.csv']
+
+
+@mock_s3
+def test_failed_query_stops_the_pipeline():
+    create_s3_mock_bucket()
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(extract_files(jobs(),
+                                  fake_source(TABLES, fail_after=1)))
+
+    assert list_keys() == []
+
+
+@mock_s3
+def test_tables_without_time_left_are_not_started():
+    create_s3_mock_bucket()
+
+    results = asyncio.run(extract_files(
+        jobs(), fake_source(TABLES),
+        can_start=lambda table_name: table_name != 'currency'))
+
+    assert [result['job']['table_name'] for result in results] == ['staff']
+    assert list_keys() == ['staff.csv']
+
+
+def test_asyncpg_driver_needs_asyncpg_and_descriptions(monkeypatch):
+    monkeypatch.setattr(async_capture, 'asyncpg', None)
+    with pytest.raises(ValueError):
+        capture_files_async(jobs(), driver='asyncpg')
+
+    monkeypatch.setattr(async_capture, 'asyncpg', object())
+    with pytest.raises(ValueError):
+        capture_files_async(jobs(), driver='asyncpg')
+
+    with pytest.raises(ValueError):
+        capture_files_async(jobs(), driver='aiopg')
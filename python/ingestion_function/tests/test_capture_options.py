@@ -0,0 +1,28 @@
+from python.ingestion_function.src.capture_options import get_capture_option
+
+
+def test_returns_default_when_event_is_not_a_dictionary():
+    assert get_capture_option('egg', 'engine', 'staff', 'fetchall') == \
+        'fetchall'
+
+
+def test_returns_default_when_option_is_missing():
+    assert get_capture_option({}, 'engine', 'staff', 'fetchall') == \
+        'fetchall'
+
+
+def test_single_value_applies_to_every_table():
+    event = {'engine': 'stream'}
+    assert get_capture_option(event, 'engine', 'staff') == 'stream'
+    assert get_capture_option(event, 'engine', 'currency') == 'stream'
+
+
+def test_dictionary_value_is_selected_per_table():
+    event = {'engine': {'default': 'fetchall', 'sales_order': 'stream'}}
+    assert get_capture_option(event, 'engine', 'sales_order') == 'stream'
+    assert get_capture_option(event, 'engine', 'staff') == 'fetchall'
+
+
+def test_dictionary_without_default_falls_back_to_argument():
+    event = {'fetch_size': {'sales_order': 5000}}
+    assert get_capture_option(event, 'fetch_size', 'staff', 2000) == 2000
@@ -0,0 +1,190 @@
+from python.ingestion_function.src.change_query import (
+    change_filter,
+    choose_change_filters,
+    get_query_plans,
+    index_report,
+    plan_change_query,
+    plan_is_current,
+    window_filter)
+from datetime import datetime, timezone
+from moto import mock_s3
+import boto3
+import psycopg2.errors
+import pytest
+
+NOW = datetime(2022, 11, 3, 14, 20, 49, tzinfo=timezone.utc)
+LOWER = '2022-11-03 14:10:49.962'
+UPPER = '2022-11-03 14:20:49.962'
+
+
+def explain(cost, node_type='Index Scan'):
+    return [{'Plan': {'Node Type': node_type, 'Relation Name': 'sales_order',
+                      'Total Cost': cost, 'Plan Rows': 12}}]
+
+
+class FakeCursor:
+    def __init__(self, costs, primary_key='sales_order_id'):
+        self.costs = costs
+        self.primary_key = primary_key
+        self.queries = []
+        self.result = []
+
+    def execute(self, query, params=None):
+        self.queries.append(query)
+        if query.startswith('EXPLAIN'):
+            if ' IN (SELECT' in query:
+                self.result = [(explain(self.costs['union']),)]
+            elif 'created_at' in query:
+                self.result = [(explain(self.costs['or'], 'Seq Scan'),)]
+            else:
+                self.result = [(explain(self.costs['last_updated']),)]
+        elif 'indisprimary' in query:
+            self.result = [(self.primary_key,)] if self.primary_key else []
+        elif 'indkey[0]' in query:
+            self.result = [('sales_order_id',), ('last_updated',)]
+        else:
+            self.result = [(-1.0,)]
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return self.result
+
+
+@mock_s3
+def create_s3_mock_bucket():
+    client = boto3.client("s3")
+    client.create_bucket(Bucket="ingested-data-vox-indicium",
+                         CreateBucketConfiguration={
+                             'LocationConstraint': 'eu-west-2'})
+
+
+def test_change_filter_shapes():
+    assert change_filter('or', 'staff', LOWER, UPPER) == \
+        window_filter(LOWER, UPPER)
+    assert change_filter('last_updated', 'staff', LOWER, UPPER) == \
+        (f"WHERE last_updated BETWEEN timestamp '{LOWER}' "
+         f"AND timestamp '{UPPER}'")
+    union = change_filter('union', 'staff', LOWER, UPPER, 'staff_id')
+    assert union.startswith('WHERE staff_id IN (SELECT staff_id FROM staff '
+                            'WHERE created_at BETWEEN')
+    assert 'UNION SELECT staff_id FROM staff WHERE last_updated' in union
+    with pytest.raises(ValueError):
+        change_filter('union', 'staff', LOWER, UPPER)
+    with pytest.raises(ValueError):
+        change_filter('intersect', 'staff', LOWER, UPPER)
+
+
+def test_cheapest_shape_is_chosen():
+    cursor = FakeCursor({'or': 3571.0, 'union': 24.6})
+
+    plan = plan_change_query(cursor, 'sales_order', ['or', 'union'],
+                             LOWER, UPPER)
+
+    assert plan == {'shape': 'union', 'costs': {'or': 3571.0, 'union': 24.6},
+                    'shapes': ['or', 'union']}
+
+
+def test_union_is_not_a_candidate_without_a_primary_key():
+    cursor = FakeCursor({'or': 3571.0, 'union': 24.6}, primary_key=None)
+
+    plan = plan_change_query(cursor, 'sales_order', ['or', 'union'],
+                             LOWER, UPPER)
+
+    assert plan['shape'] == 'or'
+    assert list(plan['costs']) == ['or']
+
+
+def test_plan_is_kept_until_it_expires_or_the_table_changes():
+    plan = {'shape': 'union', 'costs': {'or': 1, 'union': 0},
+            'shapes': ['or', 'union'], 'schema_fingerprint': 'abc',
+            'planned_at': '2022-11-03T10:00:00+00:00'}
+
+    assert plan_is_current(plan, ['union', 'or'], 'abc', NOW)
+    assert not plan_is_current(plan, ['union', 'or'], 'abc', NOW, ttl=3600)
+    assert not plan_is_current(plan, ['union', 'or'], 'def', NOW)
+    assert not plan_is_current(plan, ['or', 'union', 'last_updated'],
+                               'abc', NOW)
+    assert not plan_is_current(None, ['or'], 'abc', NOW)
+
+
+@mock_s3
+def test_choice_is_cached_in_the_bucket():
+    create_s3_mock_bucket()
+    cursor = FakeCursor({'or': 3571.0, 'union': 24.6})
+
+    filters = choose_change_filters(
+        cursor, ['sales_order'], {'sales_order': LOWER}, UPPER, {},
+        {'sales_order': 'abc'}, NOW)
+
+    assert filters['sales_order'].startswith(
+        'WHERE sales_order_id IN (SELECT')
+    assert get_query_plans()['sales_order']['shape'] == 'union'
+
+    cursor.queries = []
+    assert choose_change_filters(
+        cursor, ['sales_order'], {'sales_order': LOWER}, UPPER, {},
+        {'sales_order': 'abc'}, NOW) == filters
+    assert not any(query.startswith('EXPLAIN') for query in cursor.queries)
+
+
+@mock_s3
+def test_failed_plan_only_rolls_back_to_its_savepoint():
+    create_s3_mock_bucket()
+
+    class FailingCursor(FakeCursor):
+        def execute(self, query, params=None):
+            super().execute(query, params)
+            if query.startswith('EXPLAIN'):
+                raise psycopg2.errors.InsufficientPrivilege('denied')
+
+    cursor = FailingCursor({'or': 3571.0, 'union': 24.6})
+
+    filters = choose_change_filters(
+        cursor, ['sales_order'], {'sales_order': LOWER}, UPPER, {},
+        {'sales_order': 'abc'}, NOW)
+
+    assert filters['sales_order'] == window_filter(LOWER, UPPER)
+    # The transaction, and the snapshot it exports, are kept
+    assert cursor.queries[0] == 'SAVEPOINT plan_change_query;'
+    assert 'ROLLBACK TO SAVEPOINT plan_change_query;' in cursor.queries
+
+
+@mock_s3
+def test_plans_of_a_dry_run_are_not_cached():
+    create_s3_mock_bucket()
+    cursor = FakeCursor({'or': 3571.0, 'union': 24.6})
+
+    filters = choose_change_filters(
+        cursor, ['sales_order'], {'sales_order': LOWER}, UPPER, {},
+        {'sales_order': 'abc'}, NOW, store_plans=False)
+
+    assert filters['sales_order'].startswith(
+        'WHERE sales_order_id IN (SELECT')
+    assert get_query_plans() == {}
+
+
+@mock_s3
+def test_fixed_shape_is_used_without_planning():
+    create_s3_mock_bucket()
+    cursor = FakeCursor({'or': 3571.0, 'union': 24.6})
+
+    filters = choose_change_filters(
+        cursor, ['sales_order'], {'sales_order': LOWER}, UPPER,
+        {'change_query': 'last_updated'}, {}, NOW)
+
+    assert filters['sales_order'] == change_filter(
+        'last_updated', 'sales_order', LOWER, UPPER)
+    assert cursor.queries == []
+
+
+def test_index_report_lists_missing_indexes():
+    cursor = FakeCursor({'or': 3571.0, 'union': 4000.0})
+
+    report = index_report(cursor, ['sales_order'], LOWER, UPPER)
+
+    assert report == [{'table': 'sales_order',
+                       'missing_indexes': ['created_at'],
+                       'table_rows': 0, 'shape': 'or', 'cost': 3571.0,
+                       'rows': 12, 'seq_scan': True}]
@@ -0,0 +1,74 @@
+from python.ingestion_function.src.column_contract import (
+    get_column_contract,
+    project_columns,
+    select_list)
+from python.ingestion_function.src.copy_table import build_copy_query
+from python.ingestion_function.src.keyset_capture import keyset_query
+
+COUNTERPARTY_COLUMNS = [
+    ('counterparty_id', 'integer'),
+    ('counterparty_legal_name', 'character varying'),
+    ('legal_address_id', 'integer'),
+    ('commercial_contact', 'character varying'),
+    ('delivery_contact', 'character varying'),
+    ('created_at', 'timestamp without time zone'),
+    ('last_updated', 'timestamp without time zone')]
+
+
+class FakeCursor:
+    def execute(self, query, params=None):
+        if 'indisprimary' in query:
+            self.result = [('counterparty_id',)]
+        else:
+            self.result = COUNTERPARTY_COLUMNS
+
+    def fetchall(self):
+        return self.result
+
+
+def test_default_contracts_follow_the_transformation():
+    assert get_column_contract({}, 'counterparty') == [
+        'counterparty_id', 'counterparty_legal_name', 'legal_address_id']
+    assert get_column_contract({}, 'sales_order') is None
+    assert get_column_contract({'columns': {'counterparty': '*'}},
+                               'counterparty') is None
+    assert get_column_contract(
+        {'columns': {'sales_order': ['units_sold']}}, 'sales_order') == \
+        ['units_sold']
+
+
+def test_projection_keeps_the_key_and_watermark_columns_in_order():
+    columns = project_columns(FakeCursor(), 'counterparty',
+                              ['legal_address_id'])
+
+    assert columns == ['counterparty_id', 'legal_address_id',
+                       'created_at', 'last_updated']
+    assert select_list(columns) == \
+        'counterparty_id, legal_address_id, created_at, last_updated'
+
+
+def test_projection_of_every_column_selects_all():
+    assert project_columns(FakeCursor(), 'counterparty', None) is None
+    assert project_columns(FakeCursor(), 'counterparty',
+                           [name for name, _ in COUNTERPARTY_COLUMNS]) \
+        is None
+    assert select_list(None) == '*'
+
+
+def test_unknown_column_extracts_the_whole_table():
+    assert project_columns(FakeCursor(), 'counterparty',
+                           ['counterparty_legal_name', 'iban']) is None
+
+
+def test_projection_reaches_the_copy_and_keyset_queries():
+    columns = ['counterparty_id', 'legal_address_id', 'last_updated']
+
+    copy_query = build_copy_query(FakeCursor(), 'counterparty', '', '',
+                                  columns)
+    query = keyset_query('counterparty', 'counterparty_id', True,
+                         columns=columns)
+
+    assert '"legal_address_id"' in copy_query
+    assert 'commercial_contact' not in copy_query
+    assert query.startswith(
+        'SELECT counterparty_id, legal_address_id, last_updated\n')
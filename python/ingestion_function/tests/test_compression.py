@@ -0,0 +1,48 @@
+from python.ingestion_function.src.compression import (
+    CompressingWriter,
+    upload_args)
+import python.ingestion_function.src.compression as compression
+import csv
+import gzip
+import io
+import pytest
+from pytest import raises
+
+ROWS = [('staff_id', 'first_name')] + [(i, f'name {i}') for i in range(1000)]
+
+
+def write_rows(method):
+    raw = io.BytesIO()
+    compressor = CompressingWriter(raw, method)
+    csv.writer(compressor).writerows(ROWS)
+    compressor.finish()
+    return raw.getvalue()
+
+
+def test_no_compression_passes_the_bytes_through():
+    assert write_rows(None).startswith(b'staff_id,first_name\r\n0,name 0\r\n')
+
+
+def test_gzip_output_decompresses_to_the_csv():
+    assert gzip.decompress(write_rows('gzip')) == write_rows(None)
+
+
+def test_zstd_output_is_split_in_independent_frames(monkeypatch):
+    cramjam = pytest.importorskip('cramjam')
+    monkeypatch.setattr(compression, 'FRAME_SIZE', 1024)
+
+    output = write_rows('zstd')
+
+    assert output.count(b'\x28\xb5\x2f\xfd') > 1
+    assert bytes(cramjam.zstd.decompress(output)) == write_rows(None)
+
+
+def test_unknown_compression_raises_value_error():
+    with raises(ValueError):
+        CompressingWriter(io.BytesIO(), 'lzma')
+
+
+def test_upload_args_record_the_compression():
+    assert upload_args(None) is None
+    assert upload_args('gzip') == {'ContentEncoding': 'gzip',
+                                   'Metadata': {'compression': 'gzip'}}
@@ -0,0 +1,145 @@
+from python.ingestion_function.src.copy_table import (
+    CsvLineEndingWriter,
+    build_copy_query,
+    copy_table_to_s3,
+    python_rendering)
+from moto import mock_s3
+import boto3
+import io
+import psycopg2
+from pytest import raises
+
+
+class FakeCopyCursor:
+    def __init__(self, columns, chunks, error=None):
+        self.columns = columns
+        self.chunks = chunks
+        self.error = error
+        self.queries = []
+        self.rowcount = -1
+
+    def execute(self, query, params=None):
+        self.queries.append((query, params))
+
+    def fetchall(self):
+        return self.columns
+
+    def copy_expert(self, query, file):
+        self.queries.append((query, None))
+        for chunk in self.chunks:
+            file.write(chunk)
+        if self.error:
+            raise self.error
+        # Every record but the header is a row
+        self.rowcount = b''.join(self.chunks).count(b'\n') - 1
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self.fake_cursor = cursor
+
+    def cursor(self):
+        return self.fake_cursor
+
+
+@mock_s3
+def create_s3_mock_bucket():
+    client = boto3.client("s3")
+    client.create_bucket(Bucket="ingested-data-vox-indicium",
+                         CreateBucketConfiguration={
+                             'LocationConstraint': 'eu-west-2'})
+
+
+def test_line_endings_are_rewritten_outside_quotes_only():
+    raw = io.BytesIO()
+    writer = CsvLineEndingWriter(raw)
+
+    writer.write(b'id,address\n1,"multi\nline"\n2,plain\n')
+
+    assert raw.getvalue() == \
+        b'id,address\r\n1,"multi\nline"\r\n2,plain\r\n'
+
+
+def test_quote_state_is_kept_across_writes():
+    raw = io.BytesIO()
+    writer = CsvLineEndingWriter(raw)
+
+    for chunk in (b'1,"a', b'\nb', b'""c"\n2', b',d\n'):
+        writer.write(chunk)
+
+    assert raw.getvalue() == b'1,"a\nb""c"\r\n2,d\r\n'
+
+
+def test_python_rendering_of_columns():
+    assert python_rendering('currency_id', 'integer') == \
+        '"currency_id" AS "currency_id"'
+    assert "'True'" in python_rendering('paid', 'boolean')
+    assert "NULLIF" in python_rendering('city', 'character varying')
+    assert "HH24:MI:SS.US" in python_rendering(
+        'created_at', 'timestamp without time zone')
+
+
+def test_float_columns_are_rendered_as_python_floats():
+    rendering = python_rendering('ratio', 'double precision')
+
+    assert rendering.endswith(' AS "ratio"')
+    assert "THEN 'nan'" in rendering and "THEN '-inf'" in rendering
+    # Whole floats keep '.0', e.g. 1 is written '1.0'
+    assert "\"ratio\"::text::numeric::text || '.0'" in rendering
+    assert python_rendering('ratio', 'real') == rendering
+
+    cursor = FakeCopyCursor([('currency_id', 'integer'),
+                             ('ratio', 'double precision')], [])
+    assert rendering in build_copy_query(cursor, 'currency')
+
+
+def test_unsupported_column_type_raises_value_error():
+    with raises(ValueError):
+        python_rendering('payload', 'jsonb')
+
+
+def test_build_copy_query_uses_columns_and_filter():
+    cursor = FakeCopyCursor([('currency_id', 'integer'),
+                             ('currency_code', 'character varying')], [])
+
+    query = build_copy_query(cursor, 'currency', 'WHERE currency_id > 1')
+
+    assert cursor.queries[0][1] == ('currency',)
+    assert query.startswith('COPY (SELECT "currency_id" AS "currency_id",')
+    assert 'FROM "currency" WHERE currency_id > 1)' in query
+    assert query.endswith('TO STDOUT WITH CSV HEADER')
+
+
+@mock_s3
+def test_copy_output_is_uploaded_to_the_bucket():
+    create_s3_mock_bucket()
+    cursor = FakeCopyCursor([('currency_id', 'integer')],
+                            [b'currency_id\n', b'1\n2\n'])
+
+    counter = copy_table_to_s3(FakeConnection(cursor), 'currency',
+                               'currency.csv')
+
+    client = boto3.client("s3")
+    body = client.get_object(Bucket="ingested-data-vox-indicium",
+                             Key='currency.csv')['Body'].read()
+    assert body == b'currency_id\r\n1\r\n2\r\n'
+    assert counter.rows == 2
+    assert counter.bytes_written == len(body)
+
+
+@mock_s3
+def test_failed_copy_raises_and_uploads_nothing():
+    create_s3_mock_bucket()
+    cursor = FakeCopyCursor([('currency_id', 'integer')],
+                            [b'currency_id\n', b'1\n'],
+                            error=psycopg2.OperationalError('lost'))
+
+    with raises(psycopg2.OperationalError):
+        copy_table_to_s3(FakeConnection(cursor), 'currency', 'currency.csv')
+
+    client = boto3.client("s3")
+    assert 'Contents' not in client.list_objects(
+        Bucket="ingested-data-vox-indicium")
@@ -0,0 +1,148 @@
+from python.ingestion_function.src.cost_estimate import (
+    estimate_run,
+    estimate_table,
+    predict_seconds,
+    recommend_parallelism,
+    row_width,
+    table_rows)
+import pytest
+
+CHANGE_FILTER = ("WHERE created_at BETWEEN timestamp '2022-11-03 14:10:49' "
+                 "AND timestamp '2022-11-03 14:20:49'")
+
+# name, type, avg_width and null_frac of pg_stats
+STAFF_COLUMNS = [('staff_id', 'integer', 4, 0.0),
+                 ('first_name', 'character varying', 7, 0.0),
+                 ('email_address', 'character varying', 30, 0.5),
+                 ('department_id', 'integer', 4, 0.0),
+                 ('created_at', 'timestamp without time zone', 8, 0.0),
+                 ('last_updated', 'timestamp without time zone', 8, 0.0)]
+
+
+def explain(rows):
+    return [{'Plan': {'Node Type': 'Seq Scan', 'Relation Name': 'staff',
+                      'Total Cost': 18.5, 'Plan Rows': rows}}]
+
+
+class FakeCursor:
+    def __init__(self, reltuples=1000.0, change_rows=12, table_plan_rows=900):
+        self.reltuples = reltuples
+        self.change_rows = change_rows
+        self.table_plan_rows = table_plan_rows
+        self.queries = []
+        self.result = []
+
+    def execute(self, query, params=None):
+        self.queries.append(query)
+        if query.startswith('EXPLAIN'):
+            rows = self.change_rows if 'WHERE' in query \
+                else self.table_plan_rows
+            self.result = [(explain(rows),)]
+        elif 'pg_stats' in query:
+            self.result = STAFF_COLUMNS
+        elif 'reltuples' in query:
+            self.result = [(self.reltuples,)]
+        elif 'information_schema.columns' in query:
+            self.result = [(name, type_name)
+                           for name, type_name, _, _ in STAFF_COLUMNS]
+        elif 'indisprimary' in query:
+            self.result = [('staff_id',)]
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return self.result
+
+
+def test_row_width_is_found_from_the_column_statistics():
+    cursor = FakeCursor()
+
+    # Half of the email addresses are null
+    assert row_width(cursor, 'staff') == \
+        6 + 7 + 15 + 6 + 26 + 26 + 5 + 2
+    assert row_width(cursor, 'staff', ['staff_id', 'first_name',
+                                       'created_at', 'last_updated']) == \
+        6 + 7 + 26 + 26 + 3 + 2
+
+
+def test_table_rows_fall_back_to_the_planner_before_analyze():
+    assert table_rows(FakeCursor(reltuples=1000.0), 'staff') == 1000
+    assert table_rows(FakeCursor(reltuples=-1.0), 'staff') == 900
+
+
+def test_table_is_estimated_without_fetching_its_rows():
+    cursor = FakeCursor()
+
+    estimate = estimate_table(cursor, 'staff', CHANGE_FILTER, True, {}, {})
+
+    assert estimate['change_rows'] == 12
+    assert estimate['table_rows'] == 1000
+    assert estimate['rows'] == 1012
+    # The change file has the "op" column too
+    assert estimate['bytes'] == 12 * (93 + 7) + 1000 * 93
+    assert estimate['seconds'] == pytest.approx(0.2 + 1012 / 50000,
+                                                abs=0.001)
+    assert estimate['seq_scan']
+    assert all(query.startswith('EXPLAIN') or 'FROM staff' not in query
+               for query in cursor.queries)
+
+
+def test_estimate_follows_the_column_contract_and_last_runs_speed():
+    event = {'columns': {'staff': ['first_name']}}
+    checkpoints = {'staff': {'rows': 1000, 'duration': 2.0}}
+
+    estimate = estimate_table(FakeCursor(), 'staff', CHANGE_FILTER, False,
+                              event, checkpoints)
+
+    assert estimate['rows'] == 12
+    assert estimate['bytes'] == 12 * (70 + 7)
+    assert estimate['seconds'] == pytest.approx(0.1 + 12 / 500, abs=0.001)
+
+
+def test_tables_are_spread_over_the_least_busy_worker():
+    assert predict_seconds([10, 20, 30, 20], 1) == 80
+    assert predict_seconds([10, 20, 30, 20], 2) == 40
+    assert predict_seconds([10, 20, 30, 20], 8) == 30
+
+
+def test_fewest_workers_that_fit_the_budget_are_recommended():
+    estimates = [{'table': table_name, 'seconds': seconds,
+                  'snapshot': False}
+                 for table_name, seconds in [('staff', 10), ('design', 20),
+                                             ('sales_order', 30),
+                                             ('payment', 20)]]
+
+    assert recommend_parallelism(estimates, 40) == {
+        'workers': 2, 'fan_out': {}, 'predicted_seconds': 40,
+        'fits': True}
+    assert recommend_parallelism(estimates, 25)['fits'] is False
+    assert recommend_parallelism(estimates, 25, max_workers=4)['workers'] \
+        == 4
+
+
+def test_snapshots_slower_than_the_budget_are_fanned_out():
+    estimates = [{'table': 'sales_order', 'seconds': 200, 'snapshot': True},
+                 {'table': 'payment', 'seconds': 200, 'snapshot': False}]
+
+    plan = recommend_parallelism(estimates, 40)
+
+    assert plan['fan_out'] == {'sales_order': 5}
+    assert plan['predicted_seconds'] == 200
+    assert not plan['fits']
+    assert recommend_parallelism(estimates[:1], 10)['fan_out'] == \
+        {'sales_order': 8}
+
+
+def test_run_estimate_totals_every_table():
+    report = estimate_run(FakeCursor(), ['staff', 'department'],
+                          {'staff': CHANGE_FILTER,
+                           'department': CHANGE_FILTER},
+                          ['staff'], {}, {}, 50)
+
+    assert [estimate['table'] for estimate in report['tables']] == \
+        ['staff', 'department']
+    assert report['rows'] == 1012 + 12
+    assert report['budget_seconds'] == 50
+    assert report['workers'] == 1
+    assert report['fits']
@@ -0,0 +1,172 @@
+from python.ingestion_function.src import csv_encoder
+from python.ingestion_function.src.csv_encoder import CsvBatchEncoder
+from collections import namedtuple
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+import csv
+import io
+import numpy as np
+import pyarrow as pa
+
+Column = namedtuple('Column', ['name', 'type_code', 'display_size',
+                               'internal_size', 'precision', 'scale',
+                               'null_ok'])
+
+
+def column(name, type_code, precision=None, scale=None):
+    return Column(name, type_code, None, None, precision, scale, None)
+
+
+DESCRIPTION = [column('staff_id', 23), column('first_name', 1043),
+               column('created_at', 1114), column('unit_price', 1700, 10, 2),
+               column('agreed_payment_date', 1082),
+               column('paid', 16), column('ratio', 701),
+               column('details', 114)]
+
+ROWS = [
+    (1, 'Jeremie', datetime(2022, 11, 3, 14, 20, 51, 563000),
+     Decimal('3.94'), date(2022, 11, 8), True, 0.1, {'a': 1}),
+    (2, 'Deron, "Jr"', datetime(2022, 11, 3, 14, 20, 51),
+     Decimal('-1.00'), None, False, 100.0, None),
+    (3, '', None, None, date(2023, 1, 1), None, None, 'x,y'),
+    (4, None, datetime(1999, 1, 1, 0, 0, 0, 1), Decimal('0.00'),
+     date(2022, 1, 1), True, -2.5e-07, ''),
+    (5, 'line\nbreak', datetime(2022, 1, 1), Decimal('12345678.90'),
+     date(2022, 1, 1), False, float('nan'), 'carriage\rreturn')
+]
+
+
+def csv_writer_bytes(rows):
+    output = io.StringIO()
+    csv.writer(output).writerows(rows)
+    return output.getvalue().encode('utf-8')
+
+
+def test_batches_are_encoded_as_csv_writer_does():
+    encoder = CsvBatchEncoder(DESCRIPTION)
+
+    assert encoder.header() == csv_writer_bytes(
+        [[column.name for column in DESCRIPTION]])
+    assert encoder.encode(ROWS) == csv_writer_bytes(ROWS)
+    assert encoder.encode([]) == b''
+
+
+def test_column_types_are_found_from_the_values_without_a_description():
+    rows = [row[:3] + row[4:] for row in ROWS]
+
+    assert CsvBatchEncoder().encode(rows) == csv_writer_bytes(rows)
+
+
+def test_values_arrow_cannot_convert_are_formatted_with_str():
+    rows = [(1, 'a'), ('two', 2), (None, datetime(2022, 1, 1))]
+
+    assert CsvBatchEncoder().encode(rows) == csv_writer_bytes(rows)
+
+
+def test_columns_mixing_types_are_formatted_with_str():
+    rows = [(1, date(2022, 1, 1), True, datetime(2022, 1, 1)),
+            (2.5, datetime(2022, 1, 2, 9, 30), 1, None),
+            (None, None, 0, datetime(2022, 1, 1, tzinfo=timezone.utc)),
+            (Decimal('3.10'), date(2022, 1, 3), False,
+             datetime(2022, 1, 2))]
+
+    assert CsvBatchEncoder().encode(rows) == csv_writer_bytes(rows)
+    assert CsvBatchEncoder().encode([(1, 'x'), (2.5, 'y')]) == \
+        b'1,x\r\n2.5,y\r\n'
+    # A column of one type is still converted by Arrow
+    assert csv_encoder.value_kind([None, 1, 2]) == 'integer'
+    assert csv_encoder.value_kind([date(2022, 1, 1),
+                                   datetime(2022, 1, 1)]) == 'other'
+
+
+def test_unconstrained_numerics_are_formatted_with_str():
+    # psycopg2 reports an unconstrained numeric column as numeric(65535)
+    rows = [(Decimal('552548.62'),), (Decimal('1.5E+3'),), (None,)]
+    encoder = CsvBatchEncoder([column('payment_amount', 1700, 65535, 65535)])
+
+    assert encoder.encode(rows) == csv_writer_bytes(rows)
+
+
+def test_an_empty_field_alone_on_a_line_is_quoted():
+    rows = [('',), (None,), ('GBP',)]
+
+    assert CsvBatchEncoder([column('code', 1043)]).encode(rows) == \
+        b'""\r\n""\r\nGBP\r\n'
+
+
+def test_batches_are_split_into_chunks():
+    encoder = CsvBatchEncoder(DESCRIPTION, chunk_rows=2)
+
+    assert encoder.encode(ROWS) == csv_writer_bytes(ROWS)
+
+
+def test_columns_can_be_arrow_or_numpy_arrays():
+    timestamps = [datetime(2022, 11, 3, 14, 20, 51, 563000),
+                  datetime(2022, 11, 3, 14, 20, 51)]
+    table = pa.table({'id': [1, 2], 'created_at': timestamps})
+    encoder = CsvBatchEncoder()
+
+    expected = csv_writer_bytes(zip([1, 2], timestamps))
+    assert encoder.encode_columns(table) == expected
+    assert encoder.encode_columns(
+        [np.array([1, 2]),
+         np.array(timestamps, dtype='datetime64[us]')]) == expected
+
+
+def test_an_iterator_of_row_and_column_batches_is_encoded():
+    encoder = CsvBatchEncoder(DESCRIPTION[:2])
+    batches = [[(1, 'Jeremie')], [], [pa.array([2]), pa.array(['Deron'])],
+               pa.table({'staff_id': [3], 'first_name': [None]})]
+
+    assert list(encoder.encode_batches(iter(batches))) == \
+        [b'1,Jeremie\r\n', b'', b'2,Deron\r\n', b'3,\r\n']
+
+
+def test_timestamps_are_converted_by_arrow_without_pandas(monkeypatch):
+    monkeypatch.setattr(csv_encoder, 'pd', None)
+
+    assert CsvBatchEncoder(DESCRIPTION).encode(ROWS) == \
+        csv_writer_bytes(ROWS)
+
+
+def test_rows_are_encoded_with_csv_writer_without_pyarrow(monkeypatch):
+    monkeypatch.setattr(csv_encoder, 'pa', None)
+
+    assert CsvBatchEncoder(DESCRIPTION).encode(ROWS) == \
+        csv_writer_bytes(ROWS)
+
+
+def wide_table(rows):
+    # Three sales_order tables side by side
+    description = []
+    for number in range(3):
+        description += [
+            column(f'sales_order_id_{number}', 23),
+            column(f'created_at_{number}', 1114),
+            column(f'last_updated_{number}', 1114),
+            column(f'design_id_{number}', 23),
+            column(f'staff_id_{number}', 23),
+            column(f'counterparty_id_{number}', 23),
+            column(f'units_sold_{number}', 23),
+            column(f'unit_price_{number}', 1700, 10, 2),
+            column(f'currency_id_{number}', 23),
+            column(f'agreed_delivery_date_{number}', 1043),
+            column(f'agreed_payment_date_{number}', 1043),
+            column(f'agreed_delivery_location_id_{number}', 23)]
+    start = datetime(2022, 11, 3, 14, 20, 49, 962000)
+    table = []
+    for i in range(rows):
+        created = start + timedelta(seconds=i, microseconds=i * 1000)
+        table.append((i, created, created, i % 50, i % 20, i % 30,
+                      i * 7 % 100000, Decimal(i % 500).scaleb(-2), 1 + i % 3,
+                      str(date(2023, 1, 1 + i % 28)),
+                      str(date(2023, 2, 1 + i % 28)), i % 30) * 3)
+    return description, table
+
+
+def test_wide_tables_are_encoded_as_csv_writer_does():
+    # The speed of the encoder is measured by benchmarks/csv_encoder_speed
+    description, rows = wide_table(2000)
+
+    assert CsvBatchEncoder(description, chunk_rows=700).encode(rows) == \
+        csv_writer_bytes(rows)
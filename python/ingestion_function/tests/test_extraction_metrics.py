@@ -0,0 +1,98 @@
+from python.ingestion_function.src import extraction_metrics
+from python.ingestion_function.src.extraction_metrics import (
+    PhaseTimer,
+    TimedWriter,
+    collect_metrics,
+    emit_file_metrics,
+    metrics_record)
+import io
+import json
+
+ENTRY = {'table': 'currency', 'file': 'currency.csv',
+         'window': {'from': None, 'to': '2022-11-03 14:20:49.962'},
+         'rows': 300, 'bytes': 9000, 'checksum': 'sha256:00',
+         'duration': 1.5}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_nested_phases_only_count_their_own_time(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(extraction_metrics.time, 'perf_counter', clock)
+    timer = PhaseTimer()
+
+    with timer.phase('serialize'):
+        clock.now += 1
+        with timer.phase('upload'):
+            clock.now += 3
+        clock.now += 1
+
+    assert timer.seconds == {'query': 0.0, 'fetch': 0.0,
+                             'serialize': 2.0, 'upload': 3.0}
+
+
+def test_timed_writer_counts_writes_as_a_phase(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(extraction_metrics.time, 'perf_counter', clock)
+
+    class SlowStream(io.BytesIO):
+        def write(self, data):
+            clock.now += 2
+            return super().write(data)
+
+    timer = PhaseTimer()
+    stream = SlowStream()
+    writer = TimedWriter(stream, timer)
+
+    assert writer.write(b'a,b\r\n') == 5
+    assert stream.getvalue() == b'a,b\r\n'
+    assert timer.seconds['upload'] == 2.0
+
+
+def test_record_is_in_embedded_metric_format():
+    timer = PhaseTimer()
+    timer.seconds.update(query=0.25, upload=1.0)
+
+    record = metrics_record(ENTRY, timer, timestamp=1667485249.962)
+
+    assert record['_aws']['Timestamp'] == 1667485249962
+    directive = record['_aws']['CloudWatchMetrics'][0]
+    assert directive['Namespace'] == 'TotesysIngestion'
+    assert directive['Dimensions'] == [['Table']]
+    names = [metric['Name'] for metric in directive['Metrics']]
+    assert all(name in record for name in names)
+    assert record['Table'] == 'currency'
+    assert record['RowsPerSecond'] == 200.0
+    assert record['QuerySeconds'] == 0.25
+    assert record['UploadSeconds'] == 1.0
+
+
+def test_record_without_timings_has_no_phases():
+    record = metrics_record(dict(ENTRY, duration=0))
+
+    assert 'QuerySeconds' not in record
+    assert record['RowsPerSecond'] == 0
+
+
+def test_records_are_logged_as_json_lines(capsys):
+    emit_file_metrics(ENTRY)
+
+    line = capsys.readouterr().out.strip()
+    assert json.loads(line)['File'] == 'currency.csv'
+
+
+def test_collector_keeps_the_records(capsys):
+    with collect_metrics() as collector:
+        emit_file_metrics(ENTRY, PhaseTimer())
+        emit_file_metrics(dict(ENTRY, table='staff'))
+
+    assert capsys.readouterr().out == ''
+    assert len(collector.for_table('currency')) == 1
+    emit_file_metrics(ENTRY)
+    assert len(collector.records) == 2
@@ -0,0 +1,153 @@
+from python.ingestion_function.src import fan_out
+from python.ingestion_function.src.fan_out import (
+    LambdaExecutor,
+    LocalExecutor,
+    part_key,
+    parts_manifest_key,
+    plan_key_ranges,
+    plan_shards,
+    put_parts_manifest,
+    range_filter)
+from moto import mock_s3
+import boto3
+import io
+import json
+import pytest
+
+
+class FakeCursor:
+    def __init__(self, low, high, reltuples):
+        self.low = low
+        self.high = high
+        self.reltuples = reltuples
+        self.result = []
+
+    def execute(self, query, params=None):
+        if 'pg_index' in query:
+            self.result = [('sales_order_id',)]
+        elif 'min(' in query:
+            self.result = [(self.low, self.high)]
+        else:
+            self.result = [(self.reltuples,)]
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return self.result
+
+
+@mock_s3
+def create_s3_mock_bucket():
+    client = boto3.client("s3")
+    client.create_bucket(Bucket="ingested-data-vox-indicium",
+                         CreateBucketConfiguration={
+                             'LocationConstraint': 'eu-west-2'})
+
+
+def test_key_range_is_split_by_the_row_estimate():
+    key, ranges = plan_key_ranges(FakeCursor(1, 1000, 1000.0), 'sales_order',
+                                  rows_per_shard=300, max_shards=8)
+
+    assert key == 'sales_order_id'
+    assert ranges == [(None, 251), (251, 501), (501, 751), (751, None)]
+
+
+def test_number_of_ranges_is_capped():
+    _, ranges = plan_key_ranges(FakeCursor(1, 10 ** 6, -1), 'sales_order',
+                                rows_per_shard=1000, max_shards=4)
+
+    assert len(ranges) == 4
+
+
+def test_empty_table_is_a_single_range():
+    _, ranges = plan_key_ranges(FakeCursor(None, None, 0), 'sales_order')
+
+    assert ranges == [(None, None)]
+
+
+def test_range_filter_combines_the_row_filter():
+    assert range_filter('sales_order_id', None, None) == ''
+    assert range_filter('sales_order_id', 10, None) == \
+        'WHERE sales_order_id >= 10'
+    assert range_filter('sales_order_id', 10, 20,
+                        "WHERE last_updated > '2022-11-03'") == \
+        ("WHERE sales_order_id >= 10 AND sales_order_id < 20 "
+         "AND (last_updated > '2022-11-03')")
+
+
+def test_part_keys_follow_the_layout():
+    timestamp = '2022-11-03 14:20:49.962'
+
+    assert part_key('sales_order', 'csv', timestamp, 'root', 3) == \
+        'sales_order.part-0003.csv'
+    assert part_key('sales_order', 'csv', timestamp, 'partitioned', 3) == \
+        ('table=sales_order/ingest_date=2022-11-03/'
+         'run=20221103T142049962/part-3.csv')
+    assert parts_manifest_key('sales_order', timestamp, 'root') == \
+        'sales_order.parts.json'
+    assert parts_manifest_key('sales_order', timestamp, 'partitioned') == \
+        ('table=sales_order/ingest_date=2022-11-03/'
+         'run=20221103T142049962/_parts.json')
+
+
+def test_local_executor_runs_every_shard_in_order():
+    shards = plan_shards('sales_order', 'sales_order', 'sales_order_id',
+                         [(None, 10), (10, 20), (20, None)],
+                         '2022-11-03 14:20:49.962', 'csv', 'root',
+                         {'engine': 'stream'})
+
+    entries = LocalExecutor(lambda shard: {'file': shard['key']},
+                            max_workers=2).map(shards)
+
+    assert [entry['file'] for entry in entries] == [
+        'sales_order.part-0000.csv', 'sales_order.part-0001.csv',
+        'sales_order.part-0002.csv']
+    assert shards[1]['row_filter'] == \
+        'WHERE sales_order_id >= 10 AND sales_order_id < 20'
+    assert shards[1]['options'] == {'engine': 'stream',
+                                    'file_format': 'csv'}
+
+
+def test_lambda_executor_raises_when_a_worker_fails(monkeypatch):
+    class FakeLambda:
+        def invoke(self, FunctionName, InvocationType, Payload):
+            shard = json.loads(Payload)['fan_out_shard']
+            if shard['range'][0] == 10:
+                return {'FunctionError': 'Unhandled',
+                        'Payload': io.BytesIO(
+                            b'{"errorMessage": "timeout"}')}
+            return {'Payload': io.BytesIO(
+                json.dumps({'file': shard['key']}).encode())}
+
+    monkeypatch.setattr(fan_out.boto3, 'client',
+                        lambda service: FakeLambda())
+    executor = LambdaExecutor('ingestion')
+    shards = plan_shards('sales_order', 'sales_order', 'sales_order_id',
+                         [(None, 10), (10, None)], '2022-11-03 14:20:49.962')
+
+    assert executor.invoke(shards[0]) == \
+        {'file': 'sales_order.part-0000.csv'}
+    with pytest.raises(RuntimeError):
+        executor.map(shards)
+
+
+@mock_s3
+def test_completion_manifest_lists_the_parts():
+    create_s3_mock_bucket()
+    shards = plan_shards('sales_order', 'sales_order', 'sales_order_id',
+                         [(None, 10), (10, None)], '2022-11-03 14:20:49.962')
+    entries = [{'file': shard['key'], 'rows': 5, 'bytes': 100,
+                'checksum': 'sha256:00'} for shard in shards]
+
+    key = put_parts_manifest('sales_order', 'sales_order',
+                             '2022-11-03 14:20:49.962', 'root', shards,
+                             entries)
+
+    manifest = json.loads(boto3.client('s3').get_object(
+        Bucket='ingested-data-vox-indicium', Key=key)['Body'].read())
+    assert key == 'sales_order.parts.json'
+    assert manifest['rows'] == 10
+    assert [part['key'] for part in manifest['parts']] == [
+        'sales_order.part-0000.csv', 'sales_order.part-0001.csv']
+    assert manifest['parts'][1]['range'] == [10, None]
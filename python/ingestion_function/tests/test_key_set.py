@@ -0,0 +1,143 @@
+from python.ingestion_function.src import key_set
+from python.ingestion_function.src.key_set import (
+    capture_deletes_by_key_diff,
+    decode_key_set,
+    deleted_keys,
+    encode_key_set,
+    get_stored_key_set,
+    put_key_set)
+from python.ingestion_function.src.partition_layout import (
+    object_key,
+    update_latest_pointer)
+from array import array
+from moto import mock_s3
+import boto3
+import pytest
+
+
+class FakeCursor:
+    def __init__(self):
+        self.description = None
+
+    def execute(self, query, params=None):
+        self.result = [('sales_order_id',)]
+        self.description = [('sales_order_id',)]
+
+    def fetchall(self):
+        return self.result
+
+
+@mock_s3
+def create_s3_mock_bucket():
+    client = boto3.client("s3")
+    client.create_bucket(Bucket="ingested-data-vox-indicium",
+                         CreateBucketConfiguration={
+                             'LocationConstraint': 'eu-west-2'})
+
+
+def test_key_set_round_trips_compactly():
+    keys = list(range(1, 100001)) + [200000, 200005]
+
+    data = encode_key_set(keys)
+
+    assert decode_key_set(data) == array('q', keys)
+    assert len(data) < 2000
+    assert decode_key_set(encode_key_set([])) == array('q')
+    assert decode_key_set(encode_key_set(array('q', [-5, 3]))) == \
+        array('q', [-5, 3])
+
+
+def test_deleted_keys_are_the_ones_gone_from_the_new_set():
+    assert deleted_keys([1, 2, 3, 5, 8], [1, 3, 8, 9]) == [2, 5]
+    assert deleted_keys([], [1]) == []
+    assert deleted_keys(array('q', [4, 6]), array('q')) == [4, 6]
+
+
+@mock_s3
+def test_key_set_is_stored_in_the_bucket():
+    create_s3_mock_bucket()
+    assert get_stored_key_set('sales_order') is None
+
+    put_key_set('sales_order', [1, 2, 4])
+
+    assert get_stored_key_set('sales_order') == array('q', [1, 2, 4])
+
+
+@mock_s3
+def test_deletes_file_lists_the_missing_keys(monkeypatch):
+    create_s3_mock_bucket()
+    current = [[1, 2, 3, 4]]
+    monkeypatch.setattr(key_set, 'fetch_key_set',
+                        lambda connection, table, key: current[0])
+
+    first = capture_deletes_by_key_diff(None, FakeCursor(), 'sales_order',
+                                        None, '2022-11-03 14:10:49.962')
+    current[0] = [1, 3, 5]
+    entry = capture_deletes_by_key_diff(None, FakeCursor(), 'sales_order',
+                                        '2022-11-03 14:10:49.962',
+                                        '2022-11-03 14:20:49.962')
+
+    body = boto3.client('s3').get_object(
+        Bucket='ingested-data-vox-indicium',
+        Key='sales_order_deletes.csv')['Body'].read()
+    assert first['rows'] == 0
+    assert entry['rows'] == 2
+    assert body == b'sales_order_id\r\n2\r\n4\r\n'
+    assert get_stored_key_set('sales_order') == array('q', [1, 3, 5])
+
+    # A run without deletes replaces the file of the previous run
+    assert capture_deletes_by_key_diff(None, FakeCursor(), 'sales_order',
+                                       '2022-11-03 14:20:49.962',
+                                       '2022-11-03 14:30:49.962')['rows'] == 0
+    assert boto3.client('s3').get_object(
+        Bucket='ingested-data-vox-indicium',
+        Key='sales_order_deletes.csv')['Body'].read() == \
+        b'sales_order_id\r\n'
+
+
+@mock_s3
+def test_latest_pointer_moves_off_the_deletes_of_the_previous_run(
+        monkeypatch):
+    create_s3_mock_bucket()
+    current = [[1, 2, 3]]
+    monkeypatch.setattr(key_set, 'fetch_key_set',
+                        lambda connection, table, key: current[0])
+    pointer = {'run': None, 'files': {}}
+
+    for run, keys in [('2022-11-03 14:10:49.962', [1, 2, 3]),
+                      ('2022-11-03 14:20:49.962', [1, 3]),
+                      ('2022-11-03 14:30:49.962', [1, 3])]:
+        current[0] = keys
+        entry = capture_deletes_by_key_diff(
+            None, FakeCursor(), 'sales_order', None, run,
+            s3_key=object_key('sales_order_deletes', 'csv', run,
+                              'partitioned'))
+        update_latest_pointer(pointer, run, [entry['file']])
+
+    latest = pointer['files']['sales_order_deletes']
+    assert 'run=20221103T143049962' in latest
+    assert boto3.client('s3').get_object(
+        Bucket='ingested-data-vox-indicium', Key=latest)['Body'].read() == \
+        b'sales_order_id\r\n'
+
+
+def test_only_integer_keys_can_be_compared():
+    class FakeConnection:
+        def cursor(self, name=None):
+            return FakeNamedCursor()
+
+    class FakeNamedCursor:
+        description = [('currency_code',)]
+        itersize = 0
+
+        def execute(self, query):
+            pass
+
+        def fetchmany(self, size):
+            return [('EUR',)]
+
+        def close(self):
+            pass
+
+    with pytest.raises(ValueError):
+        key_set.fetch_key_set(FakeConnection(), 'currency', 'currency_code')
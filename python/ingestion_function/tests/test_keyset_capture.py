@@ -0,0 +1,141 @@
+from python.ingestion_function.src.keyset_capture import (
+    capture_changes_by_keyset,
+    get_primary_key,
+    has_changes_by_keyset,
+    keyset_query)
+from python.ingestion_function.src.watermarks import (
+    get_table_watermark,
+    put_table_watermark)
+from moto import mock_s3
+import boto3
+from pytest import raises
+
+
+class FakeKeysetCursor:
+    """Serves rows of a table ordered by (last_updated, design_id)."""
+
+    def __init__(self, rows):
+        self.rows = sorted(rows, key=lambda row: (row[1], row[0]))
+        self.description = [('design_id',), ('last_updated',)]
+        self.queries = []
+
+    def execute(self, query, params):
+        self.queries.append((query, params))
+        if 'AS op' in query:
+            params = params[1:]
+        if 'pg_index' in query:
+            self.result = [('design_id',)]
+        elif len(params) == 3:
+            last_updated, upper_bound, limit = params
+            self.result = [row for row in self.rows
+                           if last_updated <= row[1] <= upper_bound][:limit]
+        else:
+            last_updated, key, upper_bound, limit = params
+            self.result = [row for row in self.rows
+                           if (row[1], row[0]) > (last_updated, key)
+                           and row[1] <= upper_bound][:limit]
+
+    def fetchall(self):
+        return self.result
+
+
+@mock_s3
+def create_mock_s3():
+    mock_client = boto3.client('s3')
+    mock_client.create_bucket(Bucket='ingested-data-vox-indicium',
+                              CreateBucketConfiguration={
+                                  'LocationConstraint': 'eu-west-2', })
+
+
+def uploaded_ids():
+    body = boto3.client('s3').get_object(
+        Bucket='ingested-data-vox-indicium',
+        Key='design_changes.csv')['Body'].read().decode('utf-8')
+    return [int(line.split(',')[0]) for line in body.splitlines()[1:]]
+
+
+def test_keyset_query_compares_the_row_position():
+    query = keyset_query('design', 'design_id', False)
+
+    assert '(last_updated, design_id) > (%s::timestamp, %s)' in query
+    assert 'ORDER BY last_updated, design_id' in query
+    assert 'LIMIT %s' in query
+    assert 'AS op' not in query
+    assert "THEN 'insert' ELSE 'update' END AS op" in \
+        keyset_query('design', 'design_id', False, with_op=True)
+
+
+def test_composite_primary_key_raises_value_error():
+    cursor = FakeKeysetCursor([])
+    cursor.execute = lambda query, params: None
+    cursor.fetchall = lambda: [('a',), ('b',)]
+
+    with raises(ValueError):
+        get_primary_key(cursor, 'design')
+
+
+@mock_s3
+def test_backlog_is_drained_in_bounded_chunks_across_runs():
+    create_mock_s3()
+    # Rows sharing a timestamp are told apart by their primary key
+    rows = [(i, f'2022-01-01 00:0{i // 4}:00') for i in range(1, 11)]
+    cursor = FakeKeysetCursor(rows)
+
+    first = capture_changes_by_keyset(None, cursor, 'design',
+                                      '2030-01-01', 3, 2)
+    first_ids = uploaded_ids()
+    second = capture_changes_by_keyset(None, cursor, 'design',
+                                       '2030-01-01', 3, 2)
+    second_ids = uploaded_ids()
+
+    assert first['rows'] == 6 and second['rows'] == 4
+    assert second['window'] == {'from': '2022-01-01 00:01:00',
+                                'to': '2030-01-01'}
+    assert first_ids + second_ids == list(range(1, 11))
+    assert get_table_watermark('design') == ('2022-01-01 00:02:00', 10)
+
+
+@mock_s3
+def test_projection_is_kept_for_every_chunk():
+    create_mock_s3()
+    rows = [(i, f'2022-01-01 00:0{i}:00', 'update') for i in range(1, 6)]
+    cursor = FakeKeysetCursor(rows)
+    cursor.description = [('design_id',), ('last_updated',), ('op',)]
+
+    entry = capture_changes_by_keyset(None, cursor, 'design', '2030-01-01',
+                                      2, 3, columns=['design_id',
+                                                     'last_updated'])
+
+    assert entry['rows'] == 5
+    queries = [query for query, _ in cursor.queries if 'AS op' in query]
+    assert len(queries) == 3
+    for query in queries:
+        assert query.startswith('SELECT design_id, last_updated, CASE')
+
+
+@mock_s3
+def test_nothing_new_keeps_the_watermark():
+    create_mock_s3()
+    put_table_watermark('design', '2022-01-01 00:02:00', 10)
+    cursor = FakeKeysetCursor([(10, '2022-01-01 00:02:00')])
+
+    entry = capture_changes_by_keyset(None, cursor, 'design',
+                                      '2030-01-01', 3, 2)
+
+    assert entry['rows'] == 0
+    assert uploaded_ids() == []
+    assert get_table_watermark('design') == ('2022-01-01 00:02:00', 10)
+
+
+@mock_s3
+def test_probe_finds_only_rows_after_the_watermark():
+    create_mock_s3()
+    put_table_watermark('design', '2022-01-01 00:02:00', 10)
+    cursor = FakeKeysetCursor([(10, '2022-01-01 00:02:00')])
+
+    assert not has_changes_by_keyset(cursor, 'design', '2030-01-01')
+
+    cursor.rows.append((11, '2022-01-01 00:02:00'))
+    assert has_changes_by_keyset(cursor, 'design', '2030-01-01')
+    assert cursor.queries[-1][1] == ('2022-01-01 00:02:00', 10,
+                                     '2030-01-01', 1)
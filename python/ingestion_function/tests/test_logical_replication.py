@@ -0,0 +1,257 @@
+from python.ingestion_function.src.logical_replication import (
+    Change,
+    UNCHANGED,
+    change_ops,
+    close_change_stream,
+    confirm_changes,
+    decode_pgoutput,
+    decode_test_decoding,
+    fold_changes,
+    get_current_lsn,
+    lsn_to_int,
+    open_change_stream,
+    read_changes,
+    write_logical_changes)
+from collections import namedtuple
+import os
+import shutil
+import socket
+import struct
+import subprocess
+import time
+import pytest
+import psycopg2
+from moto import mock_s3
+import boto3
+
+
+def relation_message(oid, name, columns):
+    message = b'R' + struct.pack('!I', oid) + b'public\x00' + \
+        name.encode() + b'\x00' + b'd' + struct.pack('!H', len(columns))
+    for column in columns:
+        message += b'\x00' + column.encode() + b'\x00' + \
+            struct.pack('!Ii', 25, -1)
+    return message
+
+
+def tuple_data(values):
+    data = struct.pack('!H', len(values))
+    for value in values:
+        if value is None:
+            data += b'n'
+        elif value is UNCHANGED:
+            data += b'u'
+        else:
+            data += b't' + struct.pack('!I', len(value)) + value.encode()
+    return data
+
+
+def test_lsn_is_read_from_its_text_form():
+    assert lsn_to_int('0/37E1220') == 0x37E1220
+    assert lsn_to_int('1/0') == 1 << 32
+
+
+def test_pgoutput_messages_are_decoded():
+    relations = {}
+    assert decode_pgoutput(relation_message(
+        16384, 'currency', ['currency_id', 'currency_code']),
+        relations) is None
+
+    insert = b'I' + struct.pack('!I', 16384) + b'N' + \
+        tuple_data(['1', 'GBP'])
+    update = b'U' + struct.pack('!I', 16384) + b'K' + \
+        tuple_data(['1', None]) + b'N' + tuple_data(['2', UNCHANGED])
+    delete = b'D' + struct.pack('!I', 16384) + b'K' + \
+        tuple_data(['2', None])
+
+    assert decode_pgoutput(b'B' + bytes(20), relations) == 'begin'
+    assert decode_pgoutput(insert, relations) == Change(
+        'insert', 'currency', {'currency_id': '1', 'currency_code': 'GBP'})
+    assert decode_pgoutput(update, relations) == Change(
+        'update', 'currency',
+        {'currency_id': '2', 'currency_code': UNCHANGED})
+    assert decode_pgoutput(delete, relations).values == \
+        {'currency_id': '2', 'currency_code': None}
+    assert decode_pgoutput(b'C' + bytes(25), relations) == 'commit'
+
+
+def test_test_decoding_lines_are_decoded():
+    line = ("table public.staff: UPDATE: staff_id[integer]:3 "
+            "first_name[character varying]:'O''Neil' "
+            "email_address[text]:null "
+            "last_updated[timestamp without time zone]:"
+            "'2022-11-03 14:20:51.563'")
+
+    assert decode_test_decoding('BEGIN 529') == 'begin'
+    assert decode_test_decoding(line) == Change('update', 'staff', {
+        'staff_id': '3', 'first_name': "O'Neil", 'email_address': None,
+        'last_updated': '2022-11-03 14:20:51.563'})
+    assert decode_test_decoding(
+        'table public.staff: DELETE: staff_id[integer]:3') == \
+        Change('delete', 'staff', {'staff_id': '3'})
+    assert decode_test_decoding('COMMIT 529') == 'commit'
+
+
+def test_changes_of_a_row_are_folded_into_its_last_state():
+    changes = [
+        Change('insert', 'staff', {'staff_id': '1', 'notes': 'long'}),
+        Change('update', 'staff', {'staff_id': '1', 'notes': UNCHANGED}),
+        Change('insert', 'staff', {'staff_id': '2', 'notes': 'a'}),
+        Change('delete', 'staff', {'staff_id': '2', 'notes': None}),
+        Change('delete', 'staff', {'staff_id': '3', 'notes': None}),
+        Change('insert', 'staff', {'staff_id': '3', 'notes': 'b'})]
+
+    rows, deletes = fold_changes(changes, ['staff_id'])
+
+    assert rows == [{'staff_id': '1', 'notes': 'long'},
+                    {'staff_id': '3', 'notes': 'b'}]
+    assert deletes == [{'staff_id': '2', 'notes': None}]
+    # Row 3 existed before the window, so it is not a new row
+    assert change_ops(changes, rows, ['staff_id']) == ['insert', 'update']
+
+
+Message = namedtuple('Message', ['payload', 'data_start'])
+
+
+class BusyStream:
+    """A stream of a database that never stops writing."""
+
+    def __init__(self):
+        self.wal_end = 0
+        self.relation = relation_message(16384, 'currency',
+                                         ['currency_id'])
+
+    def read_message(self):
+        self.wal_end += 10
+        if self.relation:
+            payload, self.relation = self.relation, None
+        else:
+            payload = [b'B' + bytes(20),
+                       b'I' + struct.pack('!I', 16384) + b'N' +
+                       tuple_data([str(self.wal_end)]),
+                       b'C' + bytes(25)][self.wal_end // 10 % 3]
+        return Message(payload, self.wal_end)
+
+
+def test_busy_stream_is_read_up_to_the_start_of_the_run():
+    changes, lsn = read_changes(BusyStream(), 100, timeout=5)
+
+    assert lsn == 110
+    assert [change.values['currency_id']
+            for change in changes['currency']] == ['40', '70', '100']
+
+
+def test_busy_stream_is_left_at_the_deadline():
+    started = time.monotonic()
+
+    _, lsn = read_changes(BusyStream(), 1 << 62, timeout=0.2)
+
+    assert time.monotonic() - started < 1
+    # The reading stops on a whole transaction
+    assert lsn % 30 == 20
+
+
+Column = namedtuple('Column', ['name', 'type_code'])
+
+
+class FakeTableCursor:
+    """Describes a currency table keyed on currency_id."""
+
+    def execute(self, query, params=None):
+        self.description = [Column('currency_id', 25),
+                            Column('currency_code', 25), Column('op', 25)]
+        self.result = [('currency_id',)]
+
+    def fetchall(self):
+        return self.result
+
+
+@mock_s3
+def test_run_without_deletes_replaces_the_deletes_file():
+    boto3.client('s3').create_bucket(
+        Bucket='ingested-data-vox-indicium',
+        CreateBucketConfiguration={'LocationConstraint': 'eu-west-2'})
+    delete = Change('delete', 'currency',
+                    {'currency_id': '2', 'currency_code': None})
+    insert = Change('insert', 'currency',
+                    {'currency_id': '3', 'currency_code': 'EUR'})
+
+    write_logical_changes(FakeTableCursor(), 'currency', [delete],
+                          '2022-11-03 14:10:49.962',
+                          '2022-11-03 14:20:49.962')
+    entries = write_logical_changes(FakeTableCursor(), 'currency', [insert],
+                                    '2022-11-03 14:20:49.962',
+                                    '2022-11-03 14:30:49.962')
+
+    assert [(entry['file'], entry['rows']) for entry in entries] == \
+        [('currency_changes.csv', 1), ('currency_deletes.csv', 0)]
+    assert boto3.client('s3').get_object(
+        Bucket='ingested-data-vox-indicium',
+        Key='currency_deletes.csv')['Body'].read() == b'currency_id\r\n'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture(scope='module')
+def cluster(tmp_path_factory):
+    """
+    A throwaway PostgreSQL cluster with wal_level = logical.
+    """
+    initdb = shutil.which('initdb')
+    pg_ctl = shutil.which('pg_ctl')
+    if initdb is None or pg_ctl is None:
+        pytest.skip('initdb and pg_ctl are needed for a local cluster')
+    if hasattr(os, 'geteuid') and os.geteuid() == 0:
+        pytest.skip('PostgreSQL cannot be run as root')
+
+    directory = tmp_path_factory.mktemp('cluster')
+    data = directory / 'data'
+    port = free_port()
+    subprocess.run([initdb, '-D', str(data), '-U', 'postgres', '-A', 'trust'],
+                   check=True, capture_output=True)
+    subprocess.run([pg_ctl, '-D', str(data), '-w', '-l',
+                    str(directory / 'log'), '-o',
+                    f'-p {port} -k {directory} -c wal_level=logical '
+                    '-c listen_addresses=""', 'start'],
+                   check=True, capture_output=True)
+    try:
+        yield {'host': str(directory), 'port': port,
+               'database': 'postgres', 'user': 'postgres'}
+    finally:
+        subprocess.run([pg_ctl, '-D', str(data), '-m', 'fast', 'stop'],
+                       capture_output=True)
+
+
+def test_committed_changes_are_read_from_the_slot(cluster):
+    connection = psycopg2.connect(**cluster)
+    connection.autocommit = True
+    cursor = connection.cursor()
+    cursor.execute('''CREATE TABLE currency (
+        currency_id SERIAL PRIMARY KEY, currency_code TEXT);''')
+    close_change_stream(open_change_stream(cluster, 'test_slot'))
+
+    cursor.execute("INSERT INTO currency (currency_code) "
+                   "VALUES ('GBP'), ('USD');")
+    cursor.execute("UPDATE currency SET currency_code = 'EUR' "
+                   "WHERE currency_id = 2;")
+    cursor.execute('DELETE FROM currency WHERE currency_id = 1;')
+
+    stream = open_change_stream(cluster, 'test_slot')
+    changes, lsn = read_changes(stream, get_current_lsn(cursor), timeout=10)
+    close_change_stream(stream)
+
+    assert [change.op for change in changes['currency']] == \
+        ['insert', 'insert', 'update', 'delete']
+    assert changes['currency'][2].values == \
+        {'currency_id': '2', 'currency_code': 'EUR'}
+
+    confirm_changes(connection, lsn, 'test_slot')
+    stream = open_change_stream(cluster, 'test_slot')
+    changes, _ = read_changes(stream, get_current_lsn(cursor), timeout=10)
+    close_change_stream(stream)
+    assert changes == {}
+    connection.close()
@@ -0,0 +1,111 @@
+from python.ingestion_function.src.parallel_capture import (
+    capture_tables_in_parallel,
+    export_snapshot,
+    order_tables_by_size)
+import threading
+from pytest import raises
+
+
+class FakeCursor:
+    def __init__(self, log, result=None):
+        self.log = log
+        self.result = result
+
+    def execute(self, query, params=None):
+        self.log.append((query, params))
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, result=None):
+        self.log = []
+        self.result = result
+        self.rolled_back = False
+
+    def cursor(self):
+        return FakeCursor(self.log, self.result)
+
+    def rollback(self):
+        self.rolled_back = True
+
+
+class FakePool:
+    def __init__(self, size):
+        self.free = [FakeConnection() for _ in range(size)]
+        self.used = []
+        self.lock = threading.Lock()
+
+    def getconn(self):
+        with self.lock:
+            connection = self.free.pop()
+            self.used.append(connection)
+            return connection
+
+    def putconn(self, connection):
+        with self.lock:
+            self.free.append(connection)
+
+
+def test_export_snapshot_returns_snapshot_id():
+    connection = FakeConnection([('00000003-0000001B-1',)])
+
+    assert export_snapshot(connection) == '00000003-0000001B-1'
+    assert 'REPEATABLE READ' in connection.log[0][0]
+    assert 'pg_export_snapshot' in connection.log[1][0]
+
+
+def test_order_tables_by_size_puts_largest_first():
+    cursor = FakeCursor([], [('staff', 10), ('sales_order', 500),
+                             ('currency', 1)])
+
+    result = order_tables_by_size(cursor, ['currency', 'staff',
+                                           'sales_order', 'unknown'])
+
+    assert result == ['sales_order', 'staff', 'currency', 'unknown']
+
+
+def test_every_worker_imports_the_snapshot_before_capturing():
+    pool = FakePool(2)
+    captured = []
+
+    def capture(connection, cursor, table_name):
+        captured.append(table_name)
+        cursor.execute(f'SELECT * FROM {table_name}')
+
+    capture_tables_in_parallel(pool, 'snap-1', ['staff', 'currency',
+                                                'design'], capture, 2)
+
+    assert sorted(captured) == ['currency', 'design', 'staff']
+    for connection in pool.used:
+        assert connection.rolled_back
+        for i in range(0, len(connection.log), 3):
+            assert 'REPEATABLE READ' in connection.log[i][0]
+            assert connection.log[i + 1] == \
+                ('SET TRANSACTION SNAPSHOT %s;', ('snap-1',))
+            assert connection.log[i + 2][0].startswith('SELECT * FROM')
+    assert len(pool.free) == 2
+
+
+def test_a_failing_table_does_not_stop_the_others():
+    pool = FakePool(2)
+    captured = []
+
+    def capture(connection, cursor, table_name):
+        if table_name == 'staff':
+            raise ValueError('broken table')
+        captured.append(table_name)
+
+    with raises(ValueError, match='broken table'):
+        capture_tables_in_parallel(pool, 'snap-1', ['staff', 'currency',
+                                                    'design'], capture, 2)
+
+    assert sorted(captured) == ['currency', 'design']
+    assert len(pool.free) == 2
@@ -0,0 +1,77 @@
+from python.ingestion_function.src.parquet_output import (
+    arrow_schema,
+    ParquetBatchWriter)
+from collections import namedtuple
+from datetime import datetime, date
+from decimal import Decimal
+import io
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+pq = pytest.importorskip('pyarrow.parquet')
+
+Column = namedtuple('Column', ['name', 'type_code', 'precision', 'scale'])
+
+DESCRIPTION = [
+    Column('sales_order_id', 23, None, None),
+    Column('created_at', 1114, None, None),
+    Column('units_sold', 20, None, None),
+    Column('unit_price', 1700, 10, 2),
+    Column('agreed_delivery_date', 1043, None, None),
+    Column('paid', 16, None, None),
+    Column('payment_date', 1082, None, None),
+    Column('amount', 1700, None, None)
+]
+
+
+def sales_row(i):
+    return (i, datetime(2022, 11, 3, 14, 20, 49, 962000), 10 * i,
+            Decimal('3.50'), '2022-11-07', i % 2 == 0, date(2022, 11, 9),
+            Decimal('1.5E+3'))
+
+
+def test_schema_follows_the_postgres_types():
+    schema = arrow_schema(DESCRIPTION)
+
+    assert schema.types == [pa.int32(), pa.timestamp('us'), pa.int64(),
+                            pa.decimal128(10, 2), pa.string(), pa.bool_(),
+                            pa.date32(), pa.string()]
+    assert schema.names[0] == 'sales_order_id'
+
+
+def test_numerics_wider_than_a_decimal128_are_kept_as_text():
+    # psycopg2 reports an unconstrained numeric column as numeric(65535)
+    schema = arrow_schema([Column('payment_amount', 1700, 65535, 65535),
+                           Column('total', 1700, 50, 2)])
+
+    assert schema.types == [pa.string(), pa.string()]
+
+
+def test_rows_are_written_in_row_groups_of_the_given_size():
+    stream = io.BytesIO()
+    writer = ParquetBatchWriter(stream, DESCRIPTION, row_group_size=4)
+
+    writer.writerows([sales_row(i) for i in range(3)])
+    writer.writerows([sales_row(i) for i in range(3, 10)])
+    writer.close()
+
+    parquet_file = pq.ParquetFile(io.BytesIO(stream.getvalue()))
+    assert parquet_file.metadata.num_row_groups == 3
+    table = parquet_file.read()
+    assert table.num_rows == 10
+    assert table.column('unit_price')[0].as_py() == Decimal('3.50')
+    assert table.column('created_at')[0].as_py() == \
+        datetime(2022, 11, 3, 14, 20, 49, 962000)
+    assert table.column('amount')[0].as_py() == '1.5E+3'
+
+
+def test_nulls_are_kept():
+    stream = io.BytesIO()
+    writer = ParquetBatchWriter(stream, DESCRIPTION[:2])
+
+    writer.writerows([(1, None), (None, None)])
+    writer.close()
+
+    table = pq.read_table(io.BytesIO(stream.getvalue()))
+    assert table.column('sales_order_id').to_pylist() == [1, None]
+    assert table.column('created_at').null_count == 2
@@ -0,0 +1,74 @@
+from python.ingestion_function.src.partition_layout import (
+    get_latest_pointer,
+    object_key,
+    put_latest_pointer,
+    run_id,
+    update_latest_pointer)
+from moto import mock_s3
+import boto3
+import pytest
+
+
+@mock_s3
+def create_s3_mock_bucket():
+    client = boto3.client("s3")
+    client.create_bucket(Bucket="ingested-data-vox-indicium",
+                         CreateBucketConfiguration={
+                             'LocationConstraint': 'eu-west-2'})
+
+
+def test_run_id_sorts_like_the_run_timestamps():
+    assert run_id('2022-11-03 14:20:49.962') == '20221103T142049962'
+    assert run_id('2022-11-03 09:00:00') < run_id('2022-11-03 14:20:49.962')
+
+
+def test_root_layout_keeps_the_file_name():
+    assert object_key('currency_changes', 'csv',
+                      '2022-11-03 14:20:49.962') == 'currency_changes.csv'
+
+
+def test_partitioned_layout_gives_each_run_its_own_key():
+    key = object_key('currency_changes', 'parquet',
+                     '2022-11-03 14:20:49.962', 'partitioned')
+
+    assert key == ('table=currency_changes/ingest_date=2022-11-03/'
+                   'run=20221103T142049962/part-0.parquet')
+
+
+def test_unknown_layout_raises_value_error():
+    with pytest.raises(ValueError):
+        object_key('currency', 'csv', '2022-11-03 14:20:49.962', 'flat')
+
+
+def test_pointer_only_moves_for_partitioned_keys():
+    pointer = {'run': None, 'files': {}}
+
+    assert not update_latest_pointer(pointer, '2022-11-03 14:20:49.962',
+                                     ['currency.csv'])
+    assert pointer == {'run': None, 'files': {}}
+
+
+@mock_s3
+def test_pointer_keeps_the_files_not_written_by_a_run():
+    create_s3_mock_bucket()
+    assert get_latest_pointer() == {'run': None, 'files': {}}
+
+    first = '2022-11-03 14:20:49.962'
+    pointer = get_latest_pointer()
+    update_latest_pointer(pointer, first, [
+        object_key('currency', 'csv', first, 'partitioned'),
+        object_key('currency_changes', 'csv', first, 'partitioned')])
+    put_latest_pointer(pointer)
+
+    second = '2022-11-03 14:30:49.962'
+    pointer = get_latest_pointer()
+    assert update_latest_pointer(pointer, second, [
+        object_key('currency_changes', 'csv', second, 'partitioned')])
+    put_latest_pointer(pointer)
+
+    assert get_latest_pointer() == {
+        'run': '20221103T143049962',
+        'files': {
+            'currency': object_key('currency', 'csv', first, 'partitioned'),
+            'currency_changes': object_key('currency_changes', 'csv',
+                                           second, 'partitioned')}}
@@ -4,3 +4,48 @@
 #     postgres_data_capture('egg', 'egg')
 
 #     assert False
+from python.ingestion_function.src import postgres_data_capture as capture
+from python.ingestion_function.src.run_schedule import table_window_start
+
+LOWER = '2022-11-03 14:10:49.962'
+UPPER = '2022-11-03 14:20:49.962'
+
+
+class FakeStatsCursor:
+    """Reports counters that have not yet counted the last commits."""
+
+    def execute(self, query, params=None):
+        self.result = [('staff', 10, 4, 0), ('currency', 3, 0, 0)]
+
+    def fetchall(self):
+        return self.result
+
+
+def test_table_skipped_on_lagging_counters_keeps_its_window(monkeypatch):
+    # staff had a row written at 14:20:49.5, not yet in the counters
+    monkeypatch.setattr(capture, 'get_stored_table_activity',
+                        lambda: {'staff': [10, 4, 0], 'currency': [3, 0, 0]})
+    event = {'skip_unchanged': {'staff': 'stats', 'currency': 'exists'}}
+    monkeypatch.setattr(capture, 'table_has_changes',
+                        lambda cursor, table_name, row_filter: False)
+    tables = ['staff', 'currency']
+
+    changed, _ = capture.select_changed_tables(
+        FakeStatsCursor(), tables, {'staff': '', 'currency': ''}, UPPER,
+        event)
+    checkpoints = {}
+    capture.update_checkpoints(checkpoints, tables, changed, {}, [],
+                               {'staff': LOWER, 'currency': LOWER}, UPPER,
+                               event)
+
+    assert changed == []
+    # The next run reads staff from the start of this run's window
+    assert table_window_start(checkpoints, 'staff', UPPER) == LOWER
+    assert not checkpoints['staff']['pending']
+    # The EXISTS probe read the window itself
+    assert table_window_start(checkpoints, 'currency', UPPER) == UPPER
+
+
+def test_stored_run_timestamps_lose_the_brackets_of_earlier_runs():
+    assert capture.clean_run_timestamp(f'[{UPPER}]') == UPPER
+    assert capture.clean_run_timestamp(UPPER) == UPPER
@@ -0,0 +1,75 @@
+from python.ingestion_function.src.run_manifest import (
+    CountingWriter,
+    file_entry,
+    manifest_key,
+    put_run_manifest)
+from moto import mock_s3
+import boto3
+import csv
+import hashlib
+import io
+import json
+
+
+@mock_s3
+def create_s3_mock_bucket():
+    client = boto3.client("s3")
+    client.create_bucket(Bucket="ingested-data-vox-indicium",
+                         CreateBucketConfiguration={
+                             'LocationConstraint': 'eu-west-2'})
+
+
+def test_counting_writer_counts_the_bytes_passed_through():
+    raw = io.BytesIO()
+    counter = CountingWriter(raw)
+
+    csv.writer(counter).writerows([('currency_id', 'currency_code'),
+                                   (1, 'GBP'), (2, 'EUR')])
+
+    content = raw.getvalue()
+    assert content == b'currency_id,currency_code\r\n1,GBP\r\n2,EUR\r\n'
+    assert counter.bytes_written == len(content)
+    assert counter.checksum == \
+        f'sha256:{hashlib.sha256(content).hexdigest()}'
+
+
+def test_file_entry_describes_the_file():
+    counter = CountingWriter(io.BytesIO())
+    counter.write('a,b\r\n')
+    counter.rows = 0
+
+    entry = file_entry('currency', 'currency.csv', None,
+                       '2022-11-03 14:20:49.962', counter, 0.12345)
+
+    assert entry == {
+        'table': 'currency',
+        'file': 'currency.csv',
+        'window': {'from': None, 'to': '2022-11-03 14:20:49.962'},
+        'rows': 0,
+        'bytes': 5,
+        'checksum': counter.checksum,
+        'duration': 0.123
+    }
+
+
+@mock_s3
+def test_run_manifest_is_stored_by_run_timestamp():
+    create_s3_mock_bucket()
+    counter = CountingWriter(io.BytesIO())
+    entries = [file_entry(table, f'{table}.csv', None,
+                          '2022-11-03 14:20:49.962', counter, 0.1)
+               for table in ('staff', 'currency')]
+
+    key = put_run_manifest('2022-11-03 14:20:49.962',
+                           '2022-11-03 14:10:49.962', entries, 2.5)
+
+    assert key == manifest_key('2022-11-03 14:20:49.962') == \
+        'manifests/2022-11-03T14:20:49.962.json'
+    body = boto3.client("s3").get_object(
+        Bucket="ingested-data-vox-indicium", Key=key)['Body'].read()
+    manifest = json.loads(body)
+    assert manifest['window'] == {'from': '2022-11-03 14:10:49.962',
+                                  'to': '2022-11-03 14:20:49.962'}
+    assert manifest['duration'] == 2.5
+    assert [entry['file'] for entry in manifest['files']] == \
+        ['currency.csv', 'staff.csv']
@@ -0,0 +1,97 @@
+from python.ingestion_function.src.run_schedule import (
+    RunBudget,
+    get_checkpoints,
+    mark_pending,
+    order_tables_by_cost,
+    put_checkpoints,
+    record_checkpoint,
+    table_window_start)
+from moto import mock_s3
+import boto3
+
+
+class FakeContext:
+    def __init__(self, remaining_millis):
+        self.remaining_millis = remaining_millis
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_millis
+
+
+@mock_s3
+def create_s3_mock_bucket():
+    client = boto3.client("s3")
+    client.create_bucket(Bucket="ingested-data-vox-indicium",
+                         CreateBucketConfiguration={
+                             'LocationConstraint': 'eu-west-2'})
+
+
+def test_run_without_a_deadline_starts_every_table():
+    budget = RunBudget(None)
+
+    assert budget.remaining() is None
+    assert budget.can_start(1000)
+
+
+def test_table_not_expected_to_finish_is_not_started():
+    budget = RunBudget(FakeContext(30000), margin=10)
+
+    assert budget.can_start(5)
+    assert budget.can_start(None)
+    assert not budget.can_start(25)
+
+
+def test_first_table_is_started_even_when_slower_than_the_budget():
+    budget = RunBudget(FakeContext(30000), margin=10)
+
+    assert budget.can_start(60)
+    assert not budget.can_start(60)
+
+
+def test_nothing_is_started_inside_the_margin():
+    budget = RunBudget(FakeContext(5000), margin=10)
+
+    assert not budget.can_start(None)
+
+
+def test_pending_tables_come_first_then_the_cheapest():
+    checkpoints = {'design': {'duration': 30.0},
+                   'sales_order': {'duration': 12.0, 'pending': True},
+                   'currency': {'duration': 0.2}}
+
+    assert order_tables_by_cost(
+        ['design', 'currency', 'staff', 'sales_order'], checkpoints) == \
+        ['sales_order', 'staff', 'currency', 'design']
+
+
+def test_pending_table_reads_its_changes_from_its_checkpoint():
+    checkpoints = {}
+    record_checkpoint(checkpoints, 'currency', '2022-11-03 14:20:49.962',
+                      0.41234)
+    record_checkpoint(checkpoints, 'address', '2022-11-03 14:20:49.962',
+                      2.5, rows=20)
+    mark_pending(checkpoints, 'design', '2022-11-03 14:10:49.962')
+
+    assert checkpoints['currency'] == {
+        'window_end': '2022-11-03 14:20:49.962',
+        'duration': 0.412,
+        'pending': False}
+    assert checkpoints['address']['rows'] == 20
+    assert table_window_start(checkpoints, 'design',
+                              '2022-11-03 14:20:49.962') == \
+        '2022-11-03 14:10:49.962'
+    assert table_window_start(checkpoints, 'staff',
+                              '2022-11-03 14:20:49.962') == \
+        '2022-11-03 14:20:49.962'
+
+
+@mock_s3
+def test_checkpoints_are_stored_in_the_bucket():
+    create_s3_mock_bucket()
+    assert get_checkpoints() == {}
+
+    checkpoints = {}
+    record_checkpoint(checkpoints, 'currency', '2022-11-03 14:20:49.962', 1)
+    put_checkpoints(checkpoints)
+
+    assert get_checkpoints() == checkpoints
@@ -0,0 +1,113 @@
+from python.ingestion_function.src.s3_stream import (
+    S3MultipartWriter,
+    MIN_PART_SIZE)
+from moto import mock_s3
+import boto3
+import csv
+import threading
+import time
+from pytest import raises
+
+
+@mock_s3
+def create_s3_mock_bucket():
+    client = boto3.client("s3")
+    client.create_bucket(Bucket="ingested-data-vox-indicium",
+                         CreateBucketConfiguration={
+                             'LocationConstraint': 'eu-west-2'})
+
+
+def read_object(key):
+    return boto3.client("s3").get_object(
+        Bucket="ingested-data-vox-indicium", Key=key)['Body'].read()
+
+
+def list_keys():
+    response = boto3.client("s3").list_objects(
+        Bucket="ingested-data-vox-indicium")
+    return [item['Key'] for item in response.get('Contents', [])]
+
+
+@mock_s3
+def test_small_object_is_uploaded_in_one_request():
+    create_s3_mock_bucket()
+
+    with S3MultipartWriter('currency.csv') as stream:
+        csv.writer(stream).writerows([('currency_id',), (1,), (2,)])
+
+    assert stream.upload_id is None
+    assert read_object('currency.csv') == b'currency_id\r\n1\r\n2\r\n'
+
+
+@mock_s3
+def test_large_object_is_uploaded_in_parts():
+    create_s3_mock_bucket()
+    chunk = b'x' * (1024 * 1024)
+
+    with S3MultipartWriter('design.csv', part_size=MIN_PART_SIZE) as stream:
+        for _ in range(12):
+            stream.write(chunk)
+
+    assert len(stream.futures) == 3
+    assert stream.bytes_written == 12 * len(chunk)
+    assert read_object('design.csv') == chunk * 12
+
+
+@mock_s3
+def test_failure_while_writing_aborts_the_upload():
+    create_s3_mock_bucket()
+
+    with raises(RuntimeError):
+        with S3MultipartWriter('design.csv', part_size=MIN_PART_SIZE) as s:
+            s.write(b'x' * (MIN_PART_SIZE + 1))
+            raise RuntimeError('extraction failed')
+
+    assert list_keys() == []
+    assert boto3.client("s3").list_multipart_uploads(
+        Bucket="ingested-data-vox-indicium").get('Uploads', []) == []
+
+
+@mock_s3
+def test_parts_in_flight_are_bounded():
+    create_s3_mock_bucket()
+    writer = S3MultipartWriter('design.csv', part_size=MIN_PART_SIZE,
+                               max_in_flight=2)
+    send_part = writer._send_part
+    in_flight = []
+    peak = []
+    lock = threading.Lock()
+
+    def slow_send_part(part_number, body):
+        with lock:
+            in_flight.append(part_number)
+            peak.append(len(in_flight))
+        time.sleep(0.05)
+        with lock:
+            in_flight.remove(part_number)
+        return send_part(part_number, body)
+
+    writer._send_part = slow_send_part
+    with writer:
+        for _ in range(6):
+            writer.write(b'x' * MIN_PART_SIZE)
+
+    assert max(peak) <= 2
+    assert len(read_object('design.csv')) == 6 * MIN_PART_SIZE
+
+
+@mock_s3
+def test_extra_args_are_set_on_the_object():
+    create_s3_mock_bucket()
+
+    with S3MultipartWriter('currency.csv', part_size=MIN_PART_SIZE,
+                           extra_args={'ContentEncoding': 'gzip'}) as stream:
+        stream.write(b'x' * (MIN_PART_SIZE + 1))
+
+    head = boto3.client("s3").head_object(
+        Bucket="ingested-data-vox-indicium", Key='currency.csv')
+    assert head['ContentEncoding'] == 'gzip'
+
+
+def test_part_size_below_the_s3_minimum_raises_value_error():
+    with raises(ValueError):
+        S3MultipartWriter('design.csv', part_size=1024)
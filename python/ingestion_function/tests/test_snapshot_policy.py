@@ -0,0 +1,108 @@
+from python.ingestion_function.src.snapshot_policy import (
+    get_schema_fingerprints,
+    get_snapshot_state,
+    put_snapshot_state,
+    record_snapshots,
+    snapshot_due)
+from datetime import datetime, timedelta, timezone
+from moto import mock_s3
+import boto3
+from pytest import raises
+
+NOW = datetime(2022, 11, 3, 14, 0, tzinfo=timezone.utc)
+
+
+class FakeCursor:
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self, query):
+        pass
+
+    def fetchall(self):
+        return self.result
+
+
+@mock_s3
+def create_mock_s3():
+    mock_client = boto3.client('s3')
+    mock_client.create_bucket(Bucket='ingested-data-vox-indicium',
+                              CreateBucketConfiguration={
+                                  'LocationConstraint': 'eu-west-2', })
+
+
+def state_taken(ago, fingerprint='abc'):
+    return {'staff': {'taken_at': (NOW - ago).isoformat(),
+                      'schema_fingerprint': fingerprint}}
+
+
+def test_table_without_snapshot_is_always_due():
+    for policy in ('hourly', 'daily', 'schema_change', 'on_demand'):
+        assert snapshot_due('staff', policy, {}, NOW)
+
+
+def test_always_policy_is_due_every_run():
+    assert snapshot_due('staff', 'always', state_taken(timedelta(0)), NOW)
+
+
+def test_interval_policies_follow_snapshot_age():
+    assert not snapshot_due('staff', 'hourly',
+                            state_taken(timedelta(minutes=50)), NOW)
+    assert snapshot_due('staff', 'hourly',
+                        state_taken(timedelta(minutes=60)), NOW)
+    assert not snapshot_due('staff', 'daily',
+                            state_taken(timedelta(hours=23)), NOW)
+    assert snapshot_due('staff', 'daily', state_taken(timedelta(days=1)), NOW)
+
+
+def test_interval_policies_allow_a_run_starting_early():
+    early = state_taken(timedelta(minutes=59, seconds=58))
+
+    assert snapshot_due('staff', 'hourly', early, NOW)
+    assert not snapshot_due('staff', 'hourly', early, NOW,
+                            tolerance=timedelta(0))
+    assert not snapshot_due('staff', 'hourly',
+                            state_taken(timedelta(minutes=58)), NOW)
+
+
+def test_schema_change_policy_compares_fingerprints():
+    state = state_taken(timedelta(days=30), 'abc')
+
+    assert not snapshot_due('staff', 'schema_change', state, NOW,
+                            {'staff': 'abc'})
+    assert snapshot_due('staff', 'schema_change', state, NOW,
+                        {'staff': 'def'})
+
+
+def test_on_demand_policy_needs_a_forced_snapshot():
+    state = state_taken(timedelta(days=30))
+
+    assert not snapshot_due('staff', 'on_demand', state, NOW)
+    assert snapshot_due('staff', 'on_demand', state, NOW, forced=True)
+
+
+def test_unknown_policy_raises_value_error():
+    with raises(ValueError):
+        snapshot_due('staff', 'weekly', {}, NOW)
+
+
+def test_fingerprints_change_with_column_types():
+    before = get_schema_fingerprints(FakeCursor(
+        [('staff', 'staff_id', 'integer'), ('staff', 'name', 'text')]))
+    after = get_schema_fingerprints(FakeCursor(
+        [('staff', 'staff_id', 'bigint'), ('staff', 'name', 'text')]))
+
+    assert before['staff'] != after['staff']
+
+
+@mock_s3
+def test_recorded_snapshots_round_trip():
+    create_mock_s3()
+
+    state = record_snapshots(get_snapshot_state(), ['staff'], NOW,
+                             {'staff': 'abc'})
+    put_snapshot_state(state)
+
+    assert get_snapshot_state() == {
+        'staff': {'taken_at': '2022-11-03T14:00:00+00:00',
+                  'schema_fingerprint': 'abc'}}
@@ -0,0 +1,72 @@
+from python.ingestion_function.src.stream_table import iter_query_batches
+from pytest import raises
+
+
+class FakeNamedCursor:
+    def __init__(self, rows, columns):
+        self.rows = rows
+        self.columns = columns
+        self.description = None
+        self.fetch_sizes = []
+        self.closed = False
+
+    def execute(self, query):
+        self.position = 0
+
+    def fetchmany(self, size):
+        self.fetch_sizes.append(size)
+        self.description = [(column,) for column in self.columns]
+        batch = self.rows[self.position:self.position + size]
+        self.position += size
+        return batch
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self.fake_cursor = cursor
+        self.cursor_names = []
+
+    def cursor(self, name=None):
+        self.cursor_names.append(name)
+        return self.fake_cursor
+
+
+def test_streams_rows_in_batches_with_header():
+    rows = [(i, f'name_{i}') for i in range(7)]
+    cursor = FakeNamedCursor(rows, ['staff_id', 'first_name'])
+    connection = FakeConnection(cursor)
+
+    batches = list(iter_query_batches(connection, 'SELECT 1;',
+                                      'stream_test', 3))
+
+    assert batches[0][0] == ('staff_id', 'first_name')
+    assert [row for batch in batches for row in batch][1:] == rows
+    assert cursor.fetch_sizes == [3, 3, 3]
+    assert connection.cursor_names == ['stream_test']
+    assert cursor.closed
+
+
+def test_first_batch_can_start_with_the_description():
+    cursor = FakeNamedCursor([(1,)], ['currency_id'])
+
+    batches = list(iter_query_batches(FakeConnection(cursor), 'SELECT 1;',
+                                      'stream_test', 10, describe=True))
+
+    assert batches == [[[('currency_id',)], (1,)]]
+
+
+def test_streaming_an_empty_result_yields_only_the_header():
+    cursor = FakeNamedCursor([], ['currency_id'])
+
+    batches = list(iter_query_batches(FakeConnection(cursor), 'SELECT 1;',
+                                      'stream_empty_test', 10))
+
+    assert batches == [[('currency_id',)]]
+
+
+def test_invalid_fetch_size_raises_value_error():
+    with raises(ValueError):
+        list(iter_query_batches(FakeConnection(None), 'SELECT 1;', 'x', 0))
@@ -0,0 +1,74 @@
+from python.ingestion_function.src.table_activity import (
+    get_stored_table_activity,
+    get_table_activity,
+    has_activity,
+    put_stored_table_activity,
+    table_has_changes)
+from moto import mock_s3
+import boto3
+
+
+class FakeCursor:
+    def __init__(self, result):
+        self.result = result
+        self.queries = []
+
+    def execute(self, query):
+        self.queries.append(query)
+
+    def fetchall(self):
+        return self.result
+
+    def fetchone(self):
+        return self.result[0]
+
+
+@mock_s3
+def create_mock_s3():
+    mock_client = boto3.client('s3')
+    mock_client.create_bucket(Bucket='ingested-data-vox-indicium',
+                              CreateBucketConfiguration={
+                                  'LocationConstraint': 'eu-west-2', })
+
+
+def test_get_table_activity_returns_counters_by_table():
+    cursor = FakeCursor([('staff', 10, 2, 0), ('currency', 3, 0, 0)])
+
+    assert get_table_activity(cursor) == {'staff': [10, 2, 0],
+                                          'currency': [3, 0, 0]}
+    assert 'pg_stat_user_tables' in cursor.queries[0]
+
+
+def test_has_activity_compares_counters():
+    activity = {'staff': [10, 2, 0], 'currency': [3, 0, 0]}
+    stored = {'staff': [10, 2, 0], 'currency': [3, 0, 1]}
+
+    assert not has_activity('staff', activity, stored)
+    assert has_activity('currency', activity, stored)
+
+
+def test_tables_without_stored_counters_count_as_changed():
+    assert has_activity('staff', {'staff': [1, 0, 0]}, {})
+    assert has_activity('staff', {}, {'staff': [1, 0, 0]})
+
+
+def test_reset_counters_count_as_changed():
+    assert has_activity('staff', {'staff': [0, 0, 0]}, {'staff': [5, 1, 0]})
+
+
+@mock_s3
+def test_stored_activity_round_trip():
+    create_mock_s3()
+
+    assert get_stored_table_activity() == {}
+    put_stored_table_activity({'staff': [10, 2, 0]})
+    assert get_stored_table_activity() == {'staff': [10, 2, 0]}
+
+
+def test_exists_probe_uses_the_change_filter():
+    cursor = FakeCursor([(False,)])
+
+    assert not table_has_changes(cursor, 'staff', 'WHERE last_updated > 1')
+    assert 'SELECT EXISTS' in cursor.queries[0]
+    assert 'FROM staff' in cursor.queries[0]
+    assert 'WHERE last_updated > 1' in cursor.queries[0]
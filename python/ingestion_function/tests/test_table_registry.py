@@ -0,0 +1,56 @@
+from python.ingestion_function.src.table_registry import (
+    get_table_registry,
+    is_due,
+    is_excluded,
+    table_schedule)
+import pytest
+
+RUN = '2022-11-03 14:20:49.962'
+
+
+def test_default_registry_tiers():
+    registry = get_table_registry({})
+
+    assert table_schedule(registry, 'sales_order') == 'run'
+    assert table_schedule(registry, 'currency') == 'hourly'
+    assert is_excluded(registry, '_prisma_migrations')
+    assert not is_excluded(registry, 'staff')
+
+
+def test_event_entries_replace_the_defaults():
+    registry = get_table_registry({'table_registry': {
+        'tiers': {'reference': 'daily'},
+        'tables': {'staff': 'reference', 'currency': 'hot'}}})
+
+    assert table_schedule(registry, 'staff') == 'daily'
+    assert table_schedule(registry, 'currency') == 'run'
+    assert table_schedule(registry, 'address') == 'daily'
+
+
+def test_unknown_tiers_and_schedules_are_rejected():
+    with pytest.raises(ValueError):
+        get_table_registry({'table_registry': {'tables': {'staff': 'warm'}}})
+    with pytest.raises(ValueError):
+        get_table_registry({'table_registry': {'tiers': {'hot': 'weekly'}}})
+
+
+def test_hot_tables_are_due_on_every_run():
+    registry = get_table_registry({})
+    checkpoints = {'sales_order': {'window_end': RUN}}
+
+    assert is_due(registry, 'sales_order', checkpoints, RUN)
+    assert not is_due(registry, '_prisma_migrations', {}, RUN)
+
+
+def test_reference_tables_are_due_once_their_interval_has_passed():
+    registry = get_table_registry({})
+    checkpoints = {
+        'currency': {'window_end': '2022-11-03 14:10:49.962'},
+        'department': {'window_end': '2022-11-03 13:21:00.000'},
+        'address': {'window_end': '2022-11-03 14:10:49.962',
+                    'pending': True}}
+
+    assert not is_due(registry, 'currency', checkpoints, RUN)
+    assert is_due(registry, 'department', checkpoints, RUN)
+    assert is_due(registry, 'address', checkpoints, RUN)
+    assert is_due(registry, 'currency', {}, RUN)
@@ -0,0 +1,56 @@
+from python.ingestion_function.src.table_writer import (
+    TableWriter,
+    object_args)
+from collections import namedtuple
+import gzip
+import io
+import pytest
+from pytest import raises
+
+Column = namedtuple('Column', ['name', 'type_code', 'precision', 'scale'])
+DESCRIPTION = [Column('currency_id', 23, None, None),
+               Column('currency_code', 1043, None, None)]
+
+
+def test_csv_output_is_headed_by_the_column_names():
+    stream = io.BytesIO()
+    writer = TableWriter(stream)
+
+    writer.writeheader(DESCRIPTION)
+    writer.writerows([(1, 'GBP'), (2, 'USD')])
+    writer.close()
+
+    assert stream.getvalue() == b'currency_id,currency_code\r\n' \
+        b'1,GBP\r\n2,USD\r\n'
+    assert writer.counter.rows == 2
+
+
+def test_counters_describe_the_compressed_object():
+    stream = io.BytesIO()
+    writer = TableWriter(stream, 'csv', 'gzip')
+
+    writer.writeheader(DESCRIPTION)
+    writer.writerows([(i, 'GBP') for i in range(1000)])
+    writer.close()
+
+    assert gzip.decompress(stream.getvalue()).count(b'\r\n') == 1001
+    assert writer.counter.bytes_written == len(stream.getvalue())
+
+
+def test_parquet_output_uses_the_compression_as_codec():
+    pq = pytest.importorskip('pyarrow.parquet')
+    stream = io.BytesIO()
+    writer = TableWriter(stream, 'parquet', 'zstd')
+
+    writer.writeheader(DESCRIPTION)
+    writer.writerows([(1, 'GBP')])
+    writer.close()
+
+    metadata = pq.ParquetFile(io.BytesIO(stream.getvalue())).metadata
+    assert metadata.row_group(0).column(0).compression == 'ZSTD'
+    assert object_args('parquet', 'zstd') is None
+
+
+def test_unknown_format_raises_value_error():
+    with raises(ValueError):
+        TableWriter(io.BytesIO(), 'json')
@@ -0,0 +1,132 @@
+from python.ingestion_function.src import warm_state
+from python.ingestion_function.src.warm_state import (
+    clear_catalog,
+    discard_connection,
+    get_catalog,
+    get_connection,
+    release_connection)
+import psycopg2
+import pytest
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.result = []
+
+    def execute(self, query, params=None):
+        self.connection.queries.append(query)
+        if self.connection.broken:
+            raise psycopg2.OperationalError('server closed the connection')
+        if query == warm_state.SCHEMA_FINGERPRINT_QUERY:
+            self.result = [(self.connection.fingerprint,)]
+        elif query == warm_state.TABLES_QUERY:
+            self.result = [('currency',), ('_prisma_migrations',),
+                           ('staff',)]
+        elif query == 'SELECT 1;':
+            self.result = [(1,)]
+        else:
+            self.result = [('currency', 'currency_id', 'integer'),
+                           ('staff', 'staff_id', 'integer')]
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, **details):
+        self.details = details
+        self.closed = 0
+        self.broken = False
+        self.fingerprint = 'a'
+        self.queries = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        if self.broken:
+            raise psycopg2.OperationalError('server closed the connection')
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture(autouse=True)
+def fake_connect(monkeypatch):
+    connections = []
+
+    def connect(**details):
+        connections.append(FakeConnection(**details))
+        return connections[-1]
+
+    monkeypatch.setattr(psycopg2, 'connect', connect)
+    yield connections
+    discard_connection()
+    clear_catalog()
+
+
+DETAILS = {'host': 'localhost', 'port': 5432, 'database': 'totesys',
+           'user': 'user', 'password': 'password'}
+
+
+def test_connection_is_reused_by_warm_invocations(fake_connect):
+    connection = get_connection(DETAILS)
+    release_connection(connection)
+
+    assert get_connection(DETAILS) is connection
+    assert len(fake_connect) == 1
+    assert 'SELECT 1;' in connection.queries
+
+
+def test_failed_connection_is_replaced(fake_connect):
+    connection = get_connection(DETAILS)
+    connection.broken = True
+
+    assert get_connection(DETAILS) is not connection
+    assert len(fake_connect) == 2
+    assert connection.closed
+
+
+def test_closed_connection_is_replaced(fake_connect):
+    connection = get_connection(DETAILS)
+    connection.closed = 2
+
+    assert get_connection(DETAILS) is not connection
+
+
+def test_new_credentials_open_a_new_connection(fake_connect):
+    connection = get_connection(DETAILS)
+
+    assert get_connection({**DETAILS, 'password': 'rotated'}) \
+        is not connection
+    assert fake_connect[-1].details['password'] == 'rotated'
+
+
+def test_catalog_is_read_once_while_the_schema_is_unchanged():
+    connection = get_connection(DETAILS)
+
+    table_names, fingerprints = get_catalog(connection.cursor())
+    assert table_names == ['currency', '_prisma_migrations', 'staff']
+    assert set(fingerprints) == {'currency', 'staff'}
+
+    connection.queries = []
+    assert get_catalog(connection.cursor()) == (table_names, fingerprints)
+    assert connection.queries == [warm_state.SCHEMA_FINGERPRINT_QUERY]
+
+
+def test_catalog_is_read_again_when_the_schema_changes():
+    connection = get_connection(DETAILS)
+    get_catalog(connection.cursor())
+
+    connection.fingerprint = 'b'
+    connection.queries = []
+    get_catalog(connection.cursor())
+
+    assert warm_state.TABLES_QUERY in connection.queries
@@ -0,0 +1,46 @@
+from python.ingestion_function.src.watermarks import (
+    get_table_watermark,
+    put_table_watermark)
+from moto import mock_s3
+import boto3
+from pytest import raises
+
+
+@mock_s3
+def create_mock_s3():
+    mock_client = boto3.client('s3')
+    mock_client.create_bucket(Bucket='ingested-data-vox-indicium',
+                              CreateBucketConfiguration={
+                                  'LocationConstraint': 'eu-west-2', })
+
+
+@mock_s3
+def test_returns_default_watermark_for_a_new_table():
+    create_mock_s3()
+
+    assert get_table_watermark('staff') == ('1901-01-01 01:01:01.001', None)
+
+
+@mock_s3
+def test_reads_back_a_stored_watermark():
+    create_mock_s3()
+
+    put_table_watermark('staff', '2022-11-03 14:20:49.962000', 12)
+
+    assert get_table_watermark('staff') == ('2022-11-03 14:20:49.962000', 12)
+
+
+@mock_s3
+def test_watermarks_are_kept_per_table():
+    create_mock_s3()
+
+    put_table_watermark('staff', '2022-11-03 14:20:49.962000', 12)
+
+    assert get_table_watermark('currency')[1] is None
+
+
+@mock_s3
+def test_empty_table_name_raises_value_error():
+    create_mock_s3()
+    with raises(ValueError, match="No input name"):
+        get_table_watermark('')
@@ -10,8 +10,8 @@ main - runs all functions to create the final parquet file.
 
 import boto3
 import pandas as pd
-import io
 from botocore.exceptions import ClientError
+from .ingested_file import read_ingested_table
 
 
 def dim_counterparty_data_frame(counterparty_table, address_table):
@@ -41,24 +41,12 @@ def dim_counterparty_data_frame(counterparty_table, address_table):
         if len(counterparty_table) == 0 or len(address_table) == 0:
             raise ValueError("No input name")
 
-        # Define file name
-        counterparty_name = counterparty_table + ".csv"
-        address_name = address_table + ".csv"
-
         # Connect to S3 client
         s3 = boto3.client('s3')
 
-        # Get the objects from ingested-data-vox-indicium S3 bucket
-        counterparty_file = s3.get_object(
-            Bucket='ingested-data-vox-indicium', Key=counterparty_name)
-        address_file = s3.get_object(
-            Bucket='ingested-data-vox-indicium', Key=address_name)
-
-        # Read the CSV file using the column names
-        counterparty_df = pd.read_csv(io.StringIO(
-            counterparty_file['Body'].read().decode('utf-8')))
-        address_df = pd.read_csv(io.StringIO(
-            address_file['Body'].read().decode('utf-8')))
+        # Read the tables from ingested-data-vox-indicium S3 bucket
+        counterparty_df = read_ingested_table(s3, counterparty_table)
+        address_df = read_ingested_table(s3, address_table)
 
         # Merge counterparty_df and address_df DataFrames
         # on matching 'legal_address_id' and 'address_id',
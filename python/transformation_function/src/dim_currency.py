@@ -10,10 +10,9 @@ main - runs both functions to create and transfer the final parquet file.
 FYI: ccy-1.3.1-py3-none-any.whl
 """
 import boto3
-import pandas as pd
-import io
 import ccy
 from botocore.exceptions import ClientError
+from .ingested_file import read_ingested_table
 
 
 def dim_currency_data_frame(table_name):
@@ -42,12 +41,8 @@ def dim_currency_data_frame(table_name):
         # Connect to S3 client
         s3 = boto3.client('s3')
 
-        file = s3.get_object(
-            Bucket='ingested-data-vox-indicium', Key=file_name)
-
-        # Read the CSV file using the column names
-        data_frame = pd.read_csv(io.StringIO(
-            file['Body'].read().decode('utf-8')))
+        # Read the table
+        data_frame = read_ingested_table(s3, table_name)
 
         # Drop the original datetime columns
         data_frame = data_frame.drop(columns=['created_at', 'last_updated'])
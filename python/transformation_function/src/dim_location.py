@@ -8,9 +8,8 @@ the parquet file in the process data bucket
 main - runs all functions to create the final parquet file.
 """
 import boto3
-import pandas as pd
-import io
 from botocore.exceptions import ClientError
+from .ingested_file import read_ingested_table
 
 
 def dim_address_data_frame(address_table):
@@ -41,12 +40,8 @@ def dim_address_data_frame(address_table):
         # Connect to S3 client
         s3 = boto3.client('s3')
 
-        file = s3.get_object(
-            Bucket='ingested-data-vox-indicium', Key=file_name)
-
-        # Read the CSV file using the column names
-        data_frame = pd.read_csv(io.StringIO(
-            file['Body'].read().decode('utf-8')))
+        # Read the table
+        data_frame = read_ingested_table(s3, address_table)
 
         # Drop the original datetime columns
         data_frame = data_frame.drop(columns=['created_at', 'last_updated'])
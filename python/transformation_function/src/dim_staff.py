@@ -10,8 +10,8 @@ main - runs all functions to create the final parquet file.
 
 import boto3
 import pandas as pd
-import io
 from botocore.exceptions import ClientError
+from .ingested_file import read_ingested_table
 
 
 def dim_staff_data_frame(staff_table, department_table):
@@ -40,24 +40,12 @@ def dim_staff_data_frame(staff_table, department_table):
         if len(staff_table) == 0 or len(department_table) == 0:
             raise ValueError("No input name")
 
-        # Define file name
-        staff_name = staff_table + ".csv"
-        department_name = department_table + ".csv"
-
         # Connect to S3 client
         s3 = boto3.client('s3')
 
-        # Get the objects from ingested-data-vox-indicium S3 bucket
-        staff_file = s3.get_object(
-            Bucket='ingested-data-vox-indicium', Key=staff_name)
-        department_file = s3.get_object(
-            Bucket='ingested-data-vox-indicium', Key=department_name)
-
-        # Read the CSV files using the column names
-        staff_df = pd.read_csv(io.StringIO(
-            staff_file['Body'].read().decode('utf-8')))
-        department_df = pd.read_csv(io.StringIO(
-            department_file['Body'].read().decode('utf-8')))
+        # Read the tables from ingested-data-vox-indicium S3 bucket
+        staff_df = read_ingested_table(s3, staff_table)
+        department_df = read_ingested_table(s3, department_table)
 
         # Merge staff_df and department_df DataFrames on matching
         # 'department_id' and 'department_id',
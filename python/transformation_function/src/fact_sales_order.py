@@ -16,6 +16,7 @@ import pandas as pd
 import io
 from botocore.exceptions import ClientError
 import logging
+from .ingested_file import read_ingested_table
 
 logger = logging.getLogger('MyLogger')
 logger.setLevel(logging.INFO)
@@ -54,27 +55,28 @@ def fact_sales_order_data_frame(sales_order_table):
         # Connect to S3 client
         s3 = boto3.client('s3')
 
-        file = s3.get_object(
-            Bucket='ingestion-data-vox-indicium', Key=file_name)
+        # Read the table
+        data_frame = read_ingested_table(
+            s3, sales_order_table, 'ingestion-data-vox-indicium')
 
-        # Read the CSV file using the column names
-        data_frame = pd.read_csv(io.StringIO(
-            file['Body'].read().decode('utf-8')))
+        # Parquet tables hold timestamps, CSV tables their text
+        created_at = [str(x) for x in data_frame['created_at']]
+        last_updated = [str(x) for x in data_frame['last_updated']]
 
         # Extract the date and time parts for both
         # 'created_at' and 'last_updated' columns
         data_frame['created_date'] = pd.DataFrame(
             data={'created_at':
-                  [x.split(' ')[0] for x in list(data_frame['created_at'])]})
+                  [x.split(' ')[0] for x in created_at]})
         data_frame['created_time'] = pd.DataFrame(
             data={'created_at':
-                  [x.split(' ')[1] for x in list(data_frame['created_at'])]})
+                  [x.split(' ')[1] for x in created_at]})
         data_frame['last_updated_date'] = pd.DataFrame(
             data={'last_updated':
-                  [x.split(' ')[0] for x in list(data_frame['last_updated'])]})
+                  [x.split(' ')[0] for x in last_updated]})
         data_frame['last_updated_time'] = pd.DataFrame(
             data={'last_updated':
-                  [x.split(' ')[1] for x in list(data_frame['last_updated'])]})
+                  [x.split(' ')[1] for x in last_updated]})
 
         # Drop the original 'created_at' and 'last_updated' columns
         data_frame = data_frame.drop(columns=['created_at', 'last_updated'])
@@ -0,0 +1,298 @@
+"""
+This module reads the tables of our ingestion bucket, decoding the
+compressed objects while they are streamed.
+
+The ingestion lambda writes each table as '<table>.csv' or, in its
+Parquet output mode, as '<table>.parquet' with typed columns. In its
+partitioned layout each run writes its own objects under
+'table=<table>/ingest_date=<date>/run=<run id>/', and 'latest.json'
+points at the newest complete one of every table. A large table can be
+written in parts, listed by a completion manifest ('<table>.parts.json'
+or '_parts.json' next to the parts). CSV
+objects can be compressed with gzip or zstd under the same key; the
+compression is recorded in the object's Content-Encoding (and in a
+'compression' metadata entry).
+This module contains:
+read_ingested_table - reads the most recent of '<table>.parquet',
+'<table>.csv', '<table>.parts.json' and the partitioned object of
+'latest.json' into a DataFrame.
+read_ingested_object - reads one CSV or Parquet object into a
+DataFrame.
+get_latest_key - finds the partitioned object of a table in
+'latest.json'.
+list_new_partitions - lists the partitioned objects of a table written
+after a given run.
+open_ingested_file - returns a file-like object reading the decoded
+bytes of a get_object response, for pd.read_csv.
+zstd_frame_length - finds the length of the first zstd frame of a
+buffer.
+ZstdFrameReader - decodes a stream of zstd frames one at a time.
+
+gzip is decoded with the standard library. zstd needs cramjam, which
+is shipped with fastparquet; cramjam can only decode whole frames, so
+the ingestion lambda writes zstd objects as a series of small frames.
+Errors:
+    ValueError - if the object uses an unknown compression, or zstd
+    without cramjam installed
+"""
+import gzip
+import io
+import json
+import re
+import pandas as pd
+from botocore.exceptions import ClientError
+
+try:
+    import cramjam
+except ImportError:
+    cramjam = None
+
+INGESTION_BUCKET = 'ingested-data-vox-indicium'
+CHUNK_SIZE = 1024 * 1024
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+OP_COLUMN = 'op'
+LATEST_KEY = 'latest.json'
+PARTITION_RUN = re.compile(r'/run=([^/]+)/')
+
+
+def read_ingested_table(s3, file_stem, bucket=INGESTION_BUCKET,
+                        keep_op=False):
+    """
+    The function read_ingested_table reads a table of the ingestion
+    bucket into a DataFrame. The candidates are '<file_stem>.parquet',
+    '<file_stem>.csv', the completion manifest '<file_stem>.parts.json'
+    of a table written in parts, and the partitioned object
+    'latest.json' points at; the most recently written one is read, so
+    a table can move between formats and layouts.
+    Arguments:
+    s3 - a boto3 S3 client.
+    file_stem (string) - the name of the object without extension,
+    e.g. 'currency_changes'.
+    bucket (string) - the name of the ingestion bucket.
+    keep_op (bool) - True to keep the 'op' column ('insert' or
+    'update') of a change file, which is dropped by default as the
+    warehouse tables do not have it.
+    Output:
+    data_frame (DataFrame) - the table; Parquet columns keep the types
+    written by the ingestion lambda.
+    Errors:
+    ClientError - NoSuchKey if no object exists
+    """
+    response = s3.list_objects_v2(Bucket=bucket, Prefix=f'{file_stem}.')
+    written = {item['Key']: item['LastModified']
+               for item in response.get('Contents', [])}
+    pointer_key = get_latest_key(s3, file_stem, bucket)
+    if pointer_key is not None:
+        written[pointer_key] = s3.head_object(
+            Bucket=bucket, Key=pointer_key)['LastModified']
+
+    candidates = [key for key in (f'{file_stem}.parquet',
+                                  f'{file_stem}.csv',
+                                  f'{file_stem}.parts.json', pointer_key)
+                  if key in written]
+    # On a tie the order above wins: Parquet, then the root CSV
+    key = max(candidates, key=lambda key: written[key],
+              default=f'{file_stem}.csv')
+
+    if key.endswith('.json'):
+        # A table written in parts by the fan-out workers
+        file = s3.get_object(Bucket=bucket, Key=key)
+        manifest = json.loads(file['Body'].read().decode('utf-8'))
+        data_frame = pd.concat([read_ingested_object(s3, part['key'], bucket)
+                                for part in manifest['parts']],
+                               ignore_index=True)
+    else:
+        data_frame = read_ingested_object(s3, key, bucket)
+
+    if keep_op:
+        return data_frame
+    return data_frame.drop(columns=[OP_COLUMN], errors='ignore')
+
+
+def read_ingested_object(s3, key, bucket=INGESTION_BUCKET):
+    """
+    The function read_ingested_object reads one CSV or Parquet object
+    of the ingestion bucket into a DataFrame.
+    Arguments:
+    s3 - a boto3 S3 client.
+    key (string) - the key of the object.
+    bucket (string) - the name of the ingestion bucket.
+    Output:
+    data_frame (DataFrame) - the content of the object.
+    """
+    file = s3.get_object(Bucket=bucket, Key=key)
+    if key.endswith('.parquet'):
+        # The Parquet footer is at the end, so the object is read whole
+        return pd.read_parquet(io.BytesIO(file['Body'].read()))
+    return pd.read_csv(open_ingested_file(file))
+
+
+def get_latest_key(s3, file_stem, bucket=INGESTION_BUCKET):
+    """
+    The function get_latest_key finds the partitioned object of a file
+    in 'latest.json', which the ingestion lambda updates once all the
+    files of a run are uploaded.
+    Arguments:
+    s3 - a boto3 S3 client.
+    file_stem (string) - the name of the object without extension.
+    bucket (string) - the name of the ingestion bucket.
+    Output:
+    key (string) - the key of the object, or None.
+    Errors:
+    ClientError - if the pointer cannot be read for another reason than
+    it not existing
+    """
+    try:
+        file = s3.get_object(Bucket=bucket, Key=LATEST_KEY)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchKey':
+            return None
+        raise e
+    pointer = json.loads(file['Body'].read().decode('utf-8'))
+    return pointer.get('files', {}).get(file_stem)
+
+
+def list_new_partitions(s3, file_stem, after_run=None,
+                        bucket=INGESTION_BUCKET):
+    """
+    The function list_new_partitions lists the partitioned objects of a
+    file written by the runs after a given one, oldest first, so they
+    can be processed incrementally.
+    Arguments:
+    s3 - a boto3 S3 client.
+    file_stem (string) - the name of the object without extension.
+    after_run (string) - the id of the last run processed, e.g.
+    '20221103T142049962', or None for every run.
+    bucket (string) - the name of the ingestion bucket.
+    Output:
+    keys (list) - the keys of the objects, in run order.
+    """
+    paginator = s3.get_paginator('list_objects_v2')
+    runs = []
+    for page in paginator.paginate(Bucket=bucket,
+                                   Prefix=f'table={file_stem}/'):
+        for item in page.get('Contents', []):
+            match = PARTITION_RUN.search(item['Key'])
+            if match and (after_run is None or
+                          match.group(1) > after_run):
+                runs.append((match.group(1), item['Key']))
+    return [key for _, key in sorted(runs)]
+
+
+def open_ingested_file(s3_object):
+    """
+    The function open_ingested_file returns a file-like object reading
+    the body of an ingestion bucket object, decoding it if it is
+    compressed.
+    Arguments:
+    s3_object (dict) - the response of s3.get_object.
+    Output:
+    file - a binary file-like object with the CSV content.
+    Errors:
+    ValueError - if the compression is unknown, or is zstd and cramjam
+    is not installed
+    """
+    body = s3_object['Body']
+    compression = s3_object.get('ContentEncoding') or \
+        s3_object.get('Metadata', {}).get('compression')
+
+    if not compression or compression == 'identity':
+        return body
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=body)
+    if compression == 'zstd':
+        if cramjam is None:
+            raise ValueError("zstd objects need cramjam to be installed")
+        return io.BufferedReader(ZstdFrameReader(body), CHUNK_SIZE)
+    raise ValueError(f"Unknown compression: {compression}")
+
+
+def zstd_frame_length(data):
+    """
+    The function zstd_frame_length reads the headers of the first zstd
+    frame of a buffer to find where it ends, without decoding it.
+    Arguments:
+    data (bytes) - the start of a zstd stream.
+    Output:
+    length (int) - the length of the first frame, or None if the
+    buffer does not hold all of it yet.
+    Errors:
+    ValueError - if the buffer does not start with a zstd frame
+    """
+    if len(data) < 8:
+        return None
+    if data[:4] != ZSTD_MAGIC:
+        if data[0] & 0xf0 == 0x50 and data[1:4] == b'\x2a\x4d\x18':
+            # Skippable frame: magic, 4-byte size and content
+            length = 8 + int.from_bytes(data[4:8], 'little')
+            return length if len(data) >= length else None
+        raise ValueError("Not a zstd frame")
+
+    descriptor = data[4]
+    single_segment = (descriptor >> 5) & 1
+    content_size_bytes = (1 if single_segment else 0, 2, 4, 8)[
+        descriptor >> 6]
+    position = (5 + (0 if single_segment else 1)
+                + (0, 1, 2, 4)[descriptor & 3] + content_size_bytes)
+
+    last_block = False
+    while not last_block:
+        if len(data) < position + 3:
+            return None
+        header = int.from_bytes(data[position:position + 3], 'little')
+        last_block = header & 1
+        block_type = (header >> 1) & 3
+        # An RLE block holds a single byte repeated block size times
+        position += 3 + (1 if block_type == 1 else header >> 3)
+
+    if (descriptor >> 2) & 1:
+        position += 4
+    return position if len(data) >= position else None
+
+
+class ZstdFrameReader(io.RawIOBase):
+    """
+    A raw stream decoding a stream of zstd frames one frame at a time,
+    so only one frame is held in memory whatever the size of the
+    object.
+    Arguments:
+    body - a file-like object with the compressed bytes.
+    """
+
+    def __init__(self, body):
+        self.body = body
+        self.compressed = bytearray()
+        self.decoded = b''
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self.position == len(self.decoded):
+            if not self._decode_frame():
+                return 0
+        size = min(len(buffer), len(self.decoded) - self.position)
+        buffer[:size] = self.decoded[self.position:self.position + size]
+        self.position += size
+        return size
+
+    def _decode_frame(self):
+        length = zstd_frame_length(self.compressed)
+        while length is None:
+            chunk = self.body.read(CHUNK_SIZE)
+            if not chunk:
+                if self.compressed:
+                    raise ValueError("Truncated zstd object")
+                return False
+            self.compressed += chunk
+            length = zstd_frame_length(self.compressed)
+
+        frame = bytes(self.compressed[:length])
+        del self.compressed[:length]
+        if frame[:4] == ZSTD_MAGIC:
+            self.decoded = bytes(cramjam.zstd.decompress(frame))
+        else:
+            self.decoded = b''
+        self.position = 0
+        return True
@@ -0,0 +1,154 @@
+import gzip
+import io
+import json
+import pytest
+import pandas as pd
+import boto3
+from moto import mock_s3
+from python.transformation_function.src.ingested_file import (
+    list_new_partitions, open_ingested_file, read_ingested_table,
+    zstd_frame_length)
+from python.transformation_function.src.dim_currency import (
+    dim_currency_data_frame)
+
+CSV_DATA = b"currency_id,currency_code,created_at,last_updated\r\n2,USD,2022-11-03 14:20:49.962000,2022-11-03 14:20:49.962000\r\n"  # noqa: E501
+
+
+@pytest.fixture
+def s3():
+    with mock_s3():
+        s3 = boto3.client('s3', region_name='eu-west-2')
+        s3.create_bucket(
+            Bucket='ingested-data-vox-indicium',
+            CreateBucketConfiguration={'LocationConstraint': 'eu-west-2'})
+        yield s3
+
+
+def test_uncompressed_object_is_read_as_it_is(s3):
+    s3.put_object(Bucket='ingested-data-vox-indicium',
+                  Key='currency.csv', Body=CSV_DATA)
+    file = s3.get_object(Bucket='ingested-data-vox-indicium',
+                         Key='currency.csv')
+    assert open_ingested_file(file).read() == CSV_DATA
+
+
+def test_gzip_object_is_decoded_by_the_readers(s3):
+    s3.put_object(Bucket='ingested-data-vox-indicium', Key='currency.csv',
+                  Body=gzip.compress(CSV_DATA), ContentEncoding='gzip')
+
+    result = dim_currency_data_frame('currency')
+
+    assert isinstance(result, pd.DataFrame)
+    assert list(result['currency_code']) == ['USD']
+
+
+def test_zstd_object_is_decoded_frame_by_frame():
+    cramjam = pytest.importorskip('cramjam')
+    frames = [bytes(cramjam.zstd.compress(CSV_DATA))] + [
+        bytes(cramjam.zstd.compress(CSV_DATA.split(b'\r\n', 1)[1]))
+        for _ in range(3)]
+    body = io.BytesIO(b''.join(frames))
+
+    file = open_ingested_file({'Body': body, 'ContentEncoding': 'zstd'})
+    data_frame = pd.read_csv(file)
+
+    assert data_frame.shape[0] == 4
+
+
+def test_zstd_frame_length_waits_for_the_whole_frame():
+    cramjam = pytest.importorskip('cramjam')
+    frame = bytes(cramjam.zstd.compress(CSV_DATA * 100))
+
+    assert zstd_frame_length(frame + b'\x28\xb5') == len(frame)
+    assert zstd_frame_length(frame[:-1]) is None
+
+
+def test_unknown_compression_raises_value_error():
+    with pytest.raises(ValueError):
+        open_ingested_file({'Body': io.BytesIO(b''),
+                            'ContentEncoding': 'lzma'})
+
+
+def test_csv_table_is_read_when_there_is_no_parquet(s3):
+    s3.put_object(Bucket='ingested-data-vox-indicium',
+                  Key='currency.csv', Body=CSV_DATA)
+
+    data_frame = read_ingested_table(s3, 'currency')
+
+    assert list(data_frame['currency_code']) == ['USD']
+
+
+def test_parquet_table_keeps_its_types(s3):
+    pytest.importorskip('pyarrow')
+    data_frame = pd.DataFrame({
+        'currency_id': [2],
+        'currency_code': ['USD'],
+        'created_at': pd.to_datetime(['2022-11-03 14:20:49.962']),
+        'last_updated': pd.to_datetime(['2022-11-03 14:20:49.962'])})
+    buffer = io.BytesIO()
+    data_frame.to_parquet(buffer)
+    s3.put_object(Bucket='ingested-data-vox-indicium',
+                  Key='currency.parquet', Body=buffer.getvalue())
+
+    result = read_ingested_table(s3, 'currency')
+
+    assert pd.api.types.is_datetime64_any_dtype(result['created_at'])
+    assert str(result['created_at'][0]) == '2022-11-03 14:20:49.962000'
+    assert dim_currency_data_frame('currency').shape[0] == 1
+
+
+def test_partitioned_table_is_read_through_the_latest_pointer(s3):
+    key = ('table=currency/ingest_date=2022-11-03/'
+           'run=20221103T142049962/part-0.csv')
+    s3.put_object(Bucket='ingested-data-vox-indicium', Key=key,
+                  Body=CSV_DATA)
+    s3.put_object(Bucket='ingested-data-vox-indicium', Key='latest.json',
+                  Body=json.dumps({'run': '20221103T142049962',
+                                   'files': {'currency': key}}))
+
+    data_frame = read_ingested_table(s3, 'currency')
+
+    assert list(data_frame['currency_code']) == ['USD']
+
+
+def test_new_partitions_are_listed_in_run_order(s3):
+    runs = ['20221103T143049962', '20221103T142049962', '20221103T144049962']
+    for run in runs:
+        s3.put_object(Bucket='ingested-data-vox-indicium',
+                      Key=f'table=currency/ingest_date=2022-11-03/'
+                          f'run={run}/part-0.csv',
+                      Body=CSV_DATA)
+
+    keys = list_new_partitions(s3, 'currency', '20221103T142049962')
+
+    assert [key.split('/')[2] for key in keys] == [
+        'run=20221103T143049962', 'run=20221103T144049962']
+
+
+def test_table_written_in_parts_is_read_through_its_manifest(s3):
+    header, row = CSV_DATA.split(b'\r\n', 1)
+    parts = []
+    for part in range(2):
+        key = f'currency.part-{part:04d}.csv'
+        body = header + b'\r\n' + row.replace(b'2,', b'%d,' % part)
+        s3.put_object(Bucket='ingested-data-vox-indicium', Key=key,
+                      Body=body)
+        parts.append({'key': key})
+    s3.put_object(Bucket='ingested-data-vox-indicium',
+                  Key='currency.parts.json',
+                  Body=json.dumps({'parts': parts}))
+
+    data_frame = read_ingested_table(s3, 'currency')
+
+    assert list(data_frame['currency_id']) == [0, 1]
+
+
+def test_op_column_of_change_files_is_dropped_unless_kept(s3):
+    s3.put_object(Bucket='ingested-data-vox-indicium',
+                  Key='currency_changes.csv',
+                  Body=b"currency_id,currency_code,op\r\n2,USD,insert\r\n")
+
+    assert list(read_ingested_table(s3, 'currency_changes').columns) == \
+        ['currency_id', 'currency_code']
+    assert list(read_ingested_table(s3, 'currency_changes',
+                                    keep_op=True)['op']) == ['insert']
@@ -305,3 +305,35 @@ resource "aws_iam_role_policy_attachment" "lambda_S3_read_policy_attachment_load
     role = aws_iam_role.iam_for_warehousing_lambda.name
     policy_arn = aws_iam_policy.s3_load_read_policy.arn
 }
+
+####################################################################################
+#
+# Lambda Invoke Permission
+#
+
+resource "aws_iam_policy" "ingestion_fan_out_policy" {
+  name = "ingestion-fan-out-invoke-policy"
+  description = "A policy to let the ingestion lambda invoke itself for its fan-out workers"
+
+
+  policy = <<EOF
+{
+"Version": "2012-10-17",
+"Statement": [
+    {
+        "Effect": "Allow",
+        "Action": [
+            "lambda:InvokeFunction"
+        ],
+        "Resource": "${aws_lambda_function.s3_file_reader.arn}"
+    }
+]
+
+}
+    EOF
+    }
+
+resource "aws_iam_role_policy_attachment" "lambda_fan_out_policy_attachment" {
+    role = aws_iam_role.iam_for_ingestion_lambda.name
+    policy_arn = aws_iam_policy.ingestion_fan_out_policy.arn
+}